@@ -0,0 +1,102 @@
+# This file measures the per-message cost of looking for indicators in chat messages, before and after the
+# pre-scan gate in indicators.might_contain_indicators. It also checks that the gate never skips a message in
+# which the full parse would have found something to scan.
+
+import time
+import statistics
+
+from virustotal import parse_email
+from indicators import IndicatorExtractor, might_contain_indicators
+
+ROUNDS = 200
+
+# Messages of the kind users send to the assistant. Most are plain questions; a few paste links, addresses
+# or a whole email.
+CHAT_CORPUS = [
+    "what is MFA?",
+    "How do I set up two-factor authentication on my work account?",
+    "I think I clicked a phishing link, what should I do now",
+    "my laptop is running really slow since yesterday",
+    "Can you explain what ransomware is?",
+    "Someone called me pretending to be from the bank and asked for my PIN",
+    "How often should we change our passwords?",
+    "Is it safe to use public wifi in a coffee shop for work?",
+    "yes",
+    "no",
+    "What's the difference between a virus and a worm?",
+    "Our receptionist got an invoice from a supplier we don't use, it has a zip attached",
+    "How do I report a lost phone that has company email on it?",
+    "what does a VPN actually protect me from",
+    "We are a 12 person company, do we need a firewall?",
+    "I received a text saying my parcel is held and I need to pay a fee",
+    "How can I tell if an email is really from Microsoft?",
+    "Should staff be allowed to use USB sticks?",
+    "My account was locked after too many login attempts",
+    "Explain social engineering in simple terms please",
+    "Is this safe? https://secure-login.example-payments.com/verify?id=123",
+    "Got an email from billing@paypa1-support.com asking me to confirm my card",
+    "someone told me to check www.free-gift-cards.net is that legit",
+    "Is invoice-portal.co.uk a real site?",
+    (
+        "From: IT Support <helpdesk@m1crosoft-365.com>\n"
+        "To: staff@example.com\n"
+        "Subject: Password expiry notice\n"
+        "Content-Type: text/html\n"
+        "\n"
+        "<p>Your password expires today. <a href=\"https://m1crosoft-365.com/reset\">Keep my password</a></p>\n"
+    ),
+    "What should be in an incident response plan for a small business?",
+    "The printer keeps asking for an admin password, is that normal?",
+    "how do i back up my files safely",
+    "Do we need to tell customers if we had a data breach?",
+    "Thanks, that was helpful!",
+]
+
+
+# The indicator search every chat message went through before the gate.
+def previous_path(text):
+    extractor = IndicatorExtractor()
+    extractor.feed(text)
+    found, attachments = parse_email(text.encode("utf-8"), extractor)
+
+    return bool(found["hosts"] or attachments)
+
+
+def gated_path(text):
+    if not might_contain_indicators(text):
+        return False
+
+    return previous_path(text)
+
+
+def per_message_us(function, corpus):
+    timings = []
+
+    for _ in range(ROUNDS):
+        for text in corpus:
+            start = time.perf_counter()
+            function(text)
+            timings.append((time.perf_counter() - start) * 1_000_000)
+
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    for text in CHAT_CORPUS:
+        assert gated_path(text) == previous_path(text), f"gate changed the result for: {text!r}"
+
+    passed = [text for text in CHAT_CORPUS if might_contain_indicators(text)]
+    plain = [text for text in CHAT_CORPUS if text not in passed]
+    print(f"{len(CHAT_CORPUS)} chat messages, {len(passed)} pass the gate and are parsed, {ROUNDS} rounds")
+
+    for corpus_name, corpus in [("Whole corpus", CHAT_CORPUS), ("Plain questions", plain), ("Messages passing the gate", passed)]:
+        print(corpus_name)
+
+        for name, function in [("parse every message (previous)", previous_path), ("gate, then parse", gated_path)]:
+            mean, p50, p95 = per_message_us(function, corpus)
+            print(f"  {name:<32} mean {mean:8.1f} us   p50 {p50:8.1f} us   p95 {p95:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
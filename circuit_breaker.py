@@ -0,0 +1,119 @@
+# This file stops calls to VirusTotal while it is failing, so requests fail fast instead of waiting on timeouts.
+# After a cool-down one trial request is let through; if it works, normal traffic resumes.
+import os
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Raised instead of sending a request while the circuit is open.
+class CircuitOpen(Exception):
+    pass
+
+# Opens when at least failure_rate of the requests in the last window_seconds failed (and there were at least
+# min_requests of them). Stays open for cooldown_seconds, then allows one trial request (half-open).
+class CircuitBreaker:
+    def __init__(self, failure_rate: float = 0.5, min_requests: int = 5, window_seconds: float = 60,
+                 cooldown_seconds: float = 30):
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window_seconds = window_seconds
+        self.cooldown_seconds = cooldown_seconds
+
+        self.state = CLOSED
+        self._results = deque()
+        self._opened_at = 0.0
+        self._trial_started = None
+
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _trim(self, now: float):
+        while self._results and self._results[0][0] < now - self.window_seconds:
+            self._results.popleft()
+
+    # Call before each request; raises CircuitOpen if the request should not be sent.
+    def before_request(self):
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown_seconds:
+                self.rejected += 1
+                raise CircuitOpen("VirusTotal circuit is open")
+
+            self.state = HALF_OPEN
+            self._trial_started = None
+
+        if self.state == HALF_OPEN:
+            # A trial that never reported back (for example a cancelled request) stops blocking after a cool-down.
+            if self._trial_started is not None and time.monotonic() - self._trial_started < self.cooldown_seconds:
+                self.rejected += 1
+                raise CircuitOpen("VirusTotal circuit is half-open and a trial request is running")
+
+            self._trial_started = time.monotonic()
+
+    def record_success(self):
+        if self.state == HALF_OPEN:
+            self.state = CLOSED
+            self._results.clear()
+            self._trial_started = None
+            return
+
+        self._record(True)
+
+    def record_failure(self):
+        if self.state == HALF_OPEN:
+            self._open()
+            return
+
+        self._record(False)
+
+    def _record(self, ok: bool):
+        now = time.monotonic()
+        self._results.append((now, ok))
+        self._trim(now)
+
+        failures = sum(1 for _, result in self._results if not result)
+
+        if len(self._results) >= self.min_requests and failures / len(self._results) >= self.failure_rate:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._trial_started = None
+        self._results.clear()
+        self.times_opened += 1
+
+    # True if a request would currently be let through. Used to fail fast before queueing for quota.
+    @property
+    def available(self) -> bool:
+        now = time.monotonic()
+
+        if self.state == OPEN:
+            return now - self._opened_at >= self.cooldown_seconds
+
+        if self.state == HALF_OPEN:
+            return self._trial_started is None or now - self._trial_started >= self.cooldown_seconds
+
+        return True
+
+    def stats(self) -> dict:
+        self._trim(time.monotonic())
+        failures = sum(1 for _, result in self._results if not result)
+
+        return {
+            "state": self.state,
+            "recent_requests": len(self._results),
+            "recent_failures": failures,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+            "cooldown_seconds": self.cooldown_seconds
+        }
+
+vt_breaker = CircuitBreaker(
+    failure_rate=float(os.getenv("VT_BREAKER_FAILURE_RATE", "0.5")),
+    min_requests=int(os.getenv("VT_BREAKER_MIN_REQUESTS", "5")),
+    window_seconds=float(os.getenv("VT_BREAKER_WINDOW_SECONDS", "60")),
+    cooldown_seconds=float(os.getenv("VT_BREAKER_COOLDOWN_SECONDS", "30"))
+)
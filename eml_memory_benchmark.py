@@ -0,0 +1,98 @@
+# This file measures peak memory and time for reading uploaded emails with large attachments: the previous
+# approach (whole upload read into memory, parsed with the email package, attachments decoded to bytes)
+# compared with mime_stream.py, which spools the upload and reads it part by part.
+# Peak memory is measured with tracemalloc, which only sees memory allocated by Python.
+
+import os
+import time
+import shutil
+import email
+import tempfile
+import tracemalloc
+from email import policy
+from email.message import EmailMessage
+
+from bs4 import BeautifulSoup
+
+from mime_stream import parse_email_file, close_attachments, EML_SPOOL_MEMORY_BYTES
+
+# (label, number of attachments, size of each attachment)
+EMAILS = [("5 MB, 2 attachments", 2, 2 * 1024 * 1024), ("20 MB, 3 attachments", 3, 5 * 1024 * 1024),
+          ("50 MB, 4 attachments", 4, 9 * 1024 * 1024)]
+
+
+def write_email(path, attachments, size):
+    msg = EmailMessage()
+    msg["From"] = "billing@example-invoices.com"
+    msg["To"] = "accounts@example.com"
+    msg["Subject"] = "Overdue invoices"
+    msg.set_content("Please find the overdue invoices attached: https://portal.example-invoices.com/pay\n" * 50)
+    msg.add_alternative('<p><a href="https://portal.example-invoices.com/pay">Pay now</a></p>' * 50, subtype="html")
+
+    for i in range(attachments):
+        msg.add_attachment(os.urandom(size), maintype="application", subtype="pdf", filename=f"invoice_{i}.pdf")
+
+    with open(path, "wb") as f:
+        f.write(msg.as_bytes())
+
+
+# The previous upload handling: read everything, parse it, decode every attachment into memory.
+def previous(path):
+    with open(path, "rb") as f:
+        raw_bytes = f.read()
+
+    msg = email.message_from_bytes(raw_bytes, policy=policy.default)
+    urls = set()
+
+    for part in msg.walk():
+        if part.get_content_type() == "text/html":
+            for a in BeautifulSoup(part.get_content(), "html.parser").find_all("a", href=True):
+                urls.add(a["href"])
+
+    attachments = [(part.get_filename(), part.get_payload(decode=True)) for part in msg.iter_attachments()]
+    return len(attachments)
+
+
+def streaming(path):
+    spooled = tempfile.SpooledTemporaryFile(max_size=EML_SPOOL_MEMORY_BYTES)
+
+    with open(path, "rb") as f:
+        shutil.copyfileobj(f, spooled, 64 * 1024)
+
+    spooled.seek(0)
+    _, attachments = parse_email_file(spooled)
+    spooled.close()
+    close_attachments(attachments)
+
+    return len(attachments)
+
+
+def measure(function, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = function(path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed * 1000, peak / (1024 * 1024), count
+
+
+def main():
+    directory = tempfile.mkdtemp()
+
+    try:
+        for label, attachments, size in EMAILS:
+            path = os.path.join(directory, "email.eml")
+            write_email(path, attachments, size)
+            print(f"{label} ({os.path.getsize(path) / (1024 * 1024):.1f} MB on disk)")
+
+            for name, function in [("read into memory (previous)", previous), ("spooled, part by part", streaming)]:
+                ms, peak_mb, count = measure(function, path)
+                print(f"  {name:<30} {ms:8.0f} ms   peak {peak_mb:7.1f} MB   {count} attachments")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
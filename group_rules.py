@@ -0,0 +1,186 @@
+# This file places a user's question into a security topic group.
+# The keyword table is compiled once at import. Groups are searched in priority order with substring checks, and the
+# search stops at the first keyword that matches, so most messages only search the first few groups.
+import re
+
+# Keywords used to group security queries. Groups are checked in this order of priority.
+GROUP_RULES = {
+    "email_security": [
+        "phishing", "phish", "email", "link", "url", "attachment", "suspicious email",
+        "malicious email", "spam", "sender", "domain", "eml"
+    ],
+    "security_incidents": [
+        "incident", "security incident", "report", "reporting", "suspicious activity",
+        "compromised", "hacked", "malware", "virus", "ransomware", "unauthorised access",
+        "unauthorized access", "breach", "cyber attack", "infected"
+    ],
+    "data_protection": [
+        "data breach", "data", "gdpr", "confidential", "sensitive", "patient", "privacy",
+        "leak", "personal data", "personal information", "information disclosure"
+    ],
+    "account_access": [
+        "password", "reset password", "mfa", "authentication", "authenticator", "authorised",
+        "authorization", "locked out", "locked account", "account locked", "login", "log in",
+        "sign in", "access", "access request", "account", "user account", "permission", "role"
+    ],
+    "network_and_remote_access": [
+        "wifi", "wi-fi", "network", "vpn", "globalprotect", "internet", "connection",
+        "connectivity", "disconnecting", "not connecting", "remote access", "remote working",
+        "gateway"
+    ],
+    "general_security": [
+        "security", "cybersecurity", "cyber security", "best practice", "awareness",
+        "safe browsing", "security advice", "security guidance"
+    ]
+}
+
+# Simple word endings so "emails", "reported" and "hacking" also match.
+ENDINGS = r"(?:s|es|ed|ing)?"
+
+# Words are made of letters, digits and hyphens; anything else (spaces, punctuation, underscores) separates them.
+SEPARATOR = r"(?:[^\w-]|_)+"
+WORD_END = r"(?![^\W_]|-)"
+
+# Length from which classify_group searches with str.find rather than the in operator.
+LONG_TEXT = 1000
+
+def starts_word(text: str, index: int) -> bool:
+    return index == 0 or not (text[index - 1].isalnum() or text[index - 1] == "-")
+
+# A keyword compiled for matching: its group, the text searched for with str.find, and a pattern checking the whole
+# keyword (any separators between its words, and an ending) from where that text was found.
+class Keyword:
+    def __init__(self, keyword: str, group: str):
+        words = keyword.split()
+
+        self.keyword = keyword
+        self.group = group
+        self.words = words
+        self.first_word = words[0]
+        self.pattern = re.compile(SEPARATOR.join(map(re.escape, words)) + ENDINGS + WORD_END)
+
+        # Longer keywords of other groups containing this one, such as "data breach" for "breach".
+        self.shadowed_by = []
+
+    # Yield (start, end) of each place the keyword appears as whole words in lowercased text, from position start on.
+    def find_all(self, text: str, start: int = 0):
+        index = text.find(self.first_word, start)
+
+        while index != -1:
+            if starts_word(text, index):
+                match = self.pattern.match(text, index)
+
+                if match:
+                    yield match.start(), match.end()
+
+            index = text.find(self.first_word, index + 1)
+
+    # The longest keyword wins where keywords overlap, so "data breach" is not also counted as "breach".
+    def shadowed(self, text: str, start: int, end: int) -> bool:
+        for longer in self.shadowed_by:
+            window = max(0, start - 100)
+
+            for longer_start, longer_end in longer.find_all(text[window:end + 100]):
+                if window + longer_start <= start and window + longer_end >= end:
+                    return True
+
+        return False
+
+    def matches(self, text: str, start: int = 0) -> bool:
+        for start, end in self.find_all(text, start):
+            if not self.shadowed(text, start, end):
+                return True
+
+        return False
+
+# Keywords by group in priority order. Each keyword belongs to the highest priority group it is listed in.
+GROUP_KEYWORDS = {}
+seen = set()
+
+for group, keywords in GROUP_RULES.items():
+    GROUP_KEYWORDS[group] = []
+
+    for keyword in keywords:
+        if keyword not in seen:
+            seen.add(keyword)
+            GROUP_KEYWORDS[group].append(Keyword(keyword, group))
+
+ALL_KEYWORDS = [keyword for keywords in GROUP_KEYWORDS.values() for keyword in keywords]
+
+# Each group's keywords under the shortest first word within the group they contain, so "phishing" is only looked
+# for once "phish" has been found. If a word is not in the text, none of the keywords under it can match.
+GROUP_SEARCH = []
+
+for group, keywords in GROUP_KEYWORDS.items():
+    first_words = {keyword.first_word for keyword in keywords}
+    searches = {}
+
+    for keyword in keywords:
+        word = min((other for other in first_words if other in keyword.first_word), key=len)
+        searches.setdefault(word, []).append(keyword)
+
+    GROUP_SEARCH.append((group, list(searches.items())))
+
+def contains_words(longer: list, shorter: list) -> bool:
+    return any(longer[i:i + len(shorter)] == shorter for i in range(len(longer) - len(shorter) + 1))
+
+for keyword in ALL_KEYWORDS:
+    keyword.shadowed_by = [
+        longer for longer in ALL_KEYWORDS
+        if longer.group != keyword.group and len(longer.words) > len(keyword.words)
+        and contains_words(longer.words, keyword.words)
+    ]
+
+# Return the matched group and the keywords that matched it, for explainability.
+# Groups are checked in priority order and the first group with a match wins, so later groups are not searched.
+def match_group(question: str) -> tuple:
+    text = question.lower()
+
+    for group, searches in GROUP_SEARCH:
+        # The keyword found at each place in the text. Where several match the same text, such as "phish" and
+        # "phishing", the longest one is kept.
+        found = {}
+
+        # Most words do not appear at all; a substring check rules their keywords out before any pattern is tried.
+        for word, keywords in searches:
+            if word in text:
+                for keyword in keywords:
+                    for start, end in keyword.find_all(text):
+                        if not keyword.shadowed(text, start, end):
+                            current = found.get((start, end))
+
+                            if current is None or len(keyword.keyword) > len(current.keyword):
+                                found[start, end] = keyword
+
+        if found:
+            keywords = set(found.values())
+
+            # Within the group, a phrase also stands for the words it is made of.
+            covered = {word for keyword in keywords if len(keyword.words) > 1 for word in keyword.words}
+            return group, sorted(
+                keyword.keyword for keyword in keywords
+                if len(keyword.words) > 1 or keyword.keyword not in covered
+            )
+
+    return "unknown", []
+
+# Same group as match_group without collecting the keywords, so the search stops at the first keyword that matches.
+# Short text is checked with the in operator, which costs less than a str.find call per word. Long text is checked
+# with str.find, so a keyword is matched from where its word was found instead of searching the text again.
+def classify_group(question: str) -> str:
+    text = question.lower()
+
+    if len(text) < LONG_TEXT:
+        for group, searches in GROUP_SEARCH:
+            for word, keywords in searches:
+                if word in text and any(keyword.matches(text) for keyword in keywords):
+                    return group
+    else:
+        find = text.find
+
+        for group, searches in GROUP_SEARCH:
+            for word, keywords in searches:
+                if (index := find(word)) != -1 and any(keyword.matches(text, index) for keyword in keywords):
+                    return group
+
+    return "unknown"
@@ -0,0 +1,77 @@
+# This file measures the cost of classify_group for short chat messages and long pasted emails.
+# It compares the compiled matcher in group_rules.py with the previous chain of substring checks.
+
+import time
+
+from group_rules import classify_group, match_group
+
+RUNS = 2000
+
+SHORT_MESSAGES = [
+    "What is MFA?",
+    "How do I connect to the VPN?",
+    "I think my account was hacked",
+    "How do I report a data breach?",
+    "What is the capital of France?",
+]
+
+EMAIL_BODY = (
+    "Dear colleague, your mailbox storage is almost full. To keep receiving messages please "
+    "verify your details within 24 hours or your access will be suspended. Our records show "
+    "unusual sign-in attempts from a new device. Kind regards, the helpdesk team. "
+)
+
+# A pasted marketing-style email of about 20 KB.
+LONG_MESSAGE = EMAIL_BODY * 80 + "Click the link below to confirm."
+
+# About 20 KB of text with no keywords, the worst case for the substring checks.
+LONG_NO_KEYWORDS = "Please find the minutes from Tuesday's planning meeting attached below for review. " * 240
+
+
+# The substring checks used before the keyword table was compiled.
+def previous_classify_group(question):
+    q = question.lower()
+
+    rules = [
+        ("email_security", ["phishing", "email", "link", "url", "attachment", "suspicious email", "spam", "sender", "domain", "eml"]),
+        ("security_incidents", ["incident", "report", "suspicious activity", "compromised", "hacked", "malware", "virus", "ransomware", "unauthorised access", "unauthorized access", "cyber attack", "infected"]),
+        ("data_protection", ["data breach", "data", "gdpr", "confidential", "sensitive", "patient", "privacy", "leak", "personal data", "information disclosure"]),
+        ("account_access", ["password", "mfa", "authentication", "authenticator", "reset password", "locked out", "account locked", "login", "log in", "sign in", "access", "permission", "permissions", "role"]),
+        ("network_and_remote_access", ["wifi", "wi-fi", "network", "vpn", "globalprotect", "internet", "connection", "connectivity", "disconnecting", "not connecting", "remote access", "remote working"]),
+        ("general_security", ["security", "cybersecurity", "cyber security", "best practice", "awareness", "safe browsing"]),
+    ]
+
+    for group, words in rules:
+        if any(word in q for word in words):
+            return group
+
+    return "unknown"
+
+
+def time_per_call(function, messages):
+    start = time.perf_counter()
+
+    for _ in range(RUNS):
+        for message in messages:
+            function(message)
+
+    return (time.perf_counter() - start) / (RUNS * len(messages)) * 1_000_000
+
+
+def main():
+    inputs = [
+        ("Short messages", SHORT_MESSAGES),
+        (f"Long email ({len(LONG_MESSAGE) // 1024} KB)", [LONG_MESSAGE]),
+        (f"Long text without keywords ({len(LONG_NO_KEYWORDS) // 1024} KB)", [LONG_NO_KEYWORDS]),
+    ]
+
+    for label, messages in inputs:
+        print(label)
+        print(f"  Previous substring checks: {time_per_call(previous_classify_group, messages):9.2f} µs per call")
+        print(f"  Compiled matcher:          {time_per_call(classify_group, messages):9.2f} µs per call")
+
+    print("\nExample:", match_group("I clicked a link in a phishing email and now my password was changed"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# This file measures prompt tokens per turn for the 6-turn triage workflows in AI_Triage_Results,
+# with the full conversation history and with the sliding window plus summary.
+# It runs offline: tokens are estimated and the summary is stood in by a 120-word placeholder.
+
+import re
+import csv
+import glob
+
+from history_window import estimate_tokens, messages_to_summarise
+
+INPUT_FILES = "AI_Triage_Results/*.csv"
+
+# Approximate size of the system prompt and company context sent with every question.
+BASE_PROMPT_TOKENS = 1500
+SUMMARY_TOKENS = estimate_tokens(" ".join(["word"] * 120))
+
+# The first setting is the default in history_window.py.
+SETTINGS = [
+    {"max_turns": 3, "max_tokens": 1000},
+    {"max_turns": 6, "max_tokens": 1500},
+    {"max_turns": 2, "max_tokens": 600},
+]
+
+
+# Split a saved conversation into (user message, bot reply) turns.
+def load_workflows():
+    workflows = []
+
+    for path in sorted(glob.glob(INPUT_FILES)):
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                parts = re.split(r"(?:^|\n)(User|Bot): ", row["Full Conversation"])
+                messages = [text.strip() for text in parts[2::2]]
+
+                turns = list(zip(messages[0::2], messages[1::2]))
+
+                if turns:
+                    workflows.append(turns)
+
+    return workflows
+
+
+# Prompt tokens for each turn of one workflow.
+def replay(turns, max_turns=None, max_tokens=None):
+    history = []
+    summary = False
+    per_turn = []
+
+    for question, reply in turns:
+        if max_turns is not None:
+            count = messages_to_summarise(history, max_turns, max_tokens)
+
+            if count:
+                history = history[count:]
+                summary = True
+
+        tokens = BASE_PROMPT_TOKENS + estimate_tokens(question)
+        tokens += sum(estimate_tokens(m) for m in history)
+        tokens += SUMMARY_TOKENS if summary else 0
+
+        per_turn.append(tokens)
+        history += [question, reply]
+
+    return per_turn
+
+
+def average_per_turn(workflows, **settings):
+    totals = {}
+
+    for turns in workflows:
+        for index, tokens in enumerate(replay(turns, **settings), start=1):
+            totals.setdefault(index, []).append(tokens)
+
+    return {turn: sum(values) / len(values) for turn, values in totals.items()}
+
+
+def print_table(title, workflows, turns_to_show=None):
+    print(f"\n{title} ({len(workflows)} conversations)")
+
+    results = [("Full history", average_per_turn(workflows))]
+
+    for settings in SETTINGS:
+        label = f"Window {settings['max_turns']} turns / {settings['max_tokens']} tokens"
+        results.append((label, average_per_turn(workflows, **settings)))
+
+    turns = turns_to_show or sorted(results[0][1])
+    print(f"{'':40}" + "".join(f"Turn {t:<6}" for t in turns))
+
+    for label, averages in results:
+        print(f"{label:40}" + "".join(f"{averages.get(t, 0):<11.0f}" for t in turns))
+
+
+def main():
+    workflows = load_workflows()
+    print_table("Triage workflows", workflows)
+
+    # Join four workflows together to see how longer conversations behave.
+    long_conversations = [
+        sum(workflows[i:i + 4], [])
+        for i in range(0, len(workflows) - 3, 4)
+    ]
+    print_table("Long conversations", long_conversations, [1, 5, 10, 15])
+
+
+if __name__ == "__main__":
+    main()
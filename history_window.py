@@ -0,0 +1,60 @@
+# This file decides how much conversation history is sent to the LLM.
+# Recent turns are kept word for word; older turns are folded into a short summary.
+import os
+
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "3"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1000"))
+
+# Older turns are only summarised once this many have built up, so the summary is not rewritten every turn.
+SUMMARY_BATCH_TURNS = int(os.getenv("SUMMARY_BATCH_TURNS", "2"))
+
+# Rough token count (about four characters per token for English text).
+def estimate_tokens(text: str) -> int:
+    return (len(text) + 3) // 4
+
+# Return the index where the recent window starts.
+# Each message is a string; a turn is a user message plus the bot reply.
+def window_start(messages: list, max_turns: int = HISTORY_MAX_TURNS, max_tokens: int = HISTORY_MAX_TOKENS) -> int:
+    start = len(messages)
+    tokens = 0
+
+    while start > 0:
+        size = estimate_tokens(messages[start - 1])
+
+        if len(messages) - start + 1 > max_turns * 2 or tokens + size > max_tokens:
+            break
+
+        tokens += size
+        start -= 1
+
+    # Start the window on a user message so turns are not split.
+    if start % 2:
+        start += 1
+
+    return min(start, len(messages))
+
+# Return how many of the oldest messages should be folded into the summary now (0 if none yet).
+def messages_to_summarise(messages: list, max_turns: int = HISTORY_MAX_TURNS,
+                          max_tokens: int = HISTORY_MAX_TOKENS, batch_turns: int = SUMMARY_BATCH_TURNS) -> int:
+    start = window_start(messages, max_turns, max_tokens)
+    return start if start >= batch_turns * 2 else 0
+
+# Prompt used to fold older turns into the running summary.
+def summary_prompt(previous_summary: str, messages: list) -> str:
+    transcript = "\n".join(messages)
+
+    return f"""
+            Update the summary of this conversation between an employee and the company security chatbot.
+
+            Rules:
+            - Maximum 120 words
+            - Keep facts needed to answer follow-up questions (the issue, systems involved, steps already tried, advice given)
+            - Do not add anything that was not said
+            - Return only the summary
+
+            Current summary:
+            {previous_summary or "None"}
+
+            New messages:
+            {transcript}
+            """
@@ -0,0 +1,106 @@
+# This file measures link extraction from large HTML emails: the previous BeautifulSoup tree walk over <a href>
+# compared with the streaming extractor in indicators.py, using html.parser and (if installed) lxml.
+# Peak memory is measured with tracemalloc, which only sees memory allocated by Python.
+
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+import indicators
+
+SIZES = [("100 KB", 100 * 1024), ("500 KB", 500 * 1024), ("2 MB", 2 * 1024 * 1024)]
+ROUNDS = 3
+
+HEAD = (
+    '<html><head><meta charset="utf-8"><meta http-equiv="refresh" content="30; url=https://promo.example-deals.com/live">'
+    '<style>td { font-family: Arial, sans-serif; font-size: 14px; color: #333333; } .btn { background: #0066cc; }</style>'
+    '</head><body><table width="100%" cellpadding="0" cellspacing="0" border="0">'
+)
+
+# One product row of a marketing email: nested tables, inline styles, tracking pixels and several links.
+ROW = (
+    '<tr><td align="center" style="padding: 12px 24px; border-bottom: 1px solid #eeeeee;">'
+    '<table width="600" cellpadding="0" cellspacing="0"><tr>'
+    '<td width="200"><a href="https://shop.example-deals.com/p/{i}?utm_source=newsletter&amp;utm_medium=email">'
+    '<img src="https://cdn.example-deals.com/img/{i}.jpg" width="180" height="180" alt="Product {i}" style="display:block;"></a></td>'
+    '<td style="padding-left: 16px;"><p style="margin: 0 0 8px 0; font-size: 18px;"><b>Limited offer {i}</b></p>'
+    '<p style="margin: 0 0 12px 0;">Save up to 70% on selected items this weekend only. Terms and conditions apply.</p>'
+    '<a class="btn" href="https://shop.example-deals.com/cart/add/{i}" style="padding: 8px 16px; color: #ffffff;">Buy now</a>'
+    '<form action="https://shop.example-deals.com/wishlist/{i}" method="post"><button formaction="https://shop.example-deals.com/save/{i}">Save</button></form>'
+    '</td></tr></table>'
+    '<img src="https://track.example-deals.com/open/{i}.gif" width="1" height="1" alt="">'
+    '</td></tr>\n'
+)
+
+TAIL = '<tr><td><a href="https://shop.example-deals.com/unsubscribe">Unsubscribe</a></td></tr></table></body></html>'
+
+
+def make_html(size):
+    rows = []
+    length = len(HEAD) + len(TAIL)
+    i = 0
+
+    while length < size:
+        row = ROW.format(i=i)
+        rows.append(row)
+        length += len(row)
+        i += 1
+
+    return HEAD + "".join(rows) + TAIL
+
+
+# The link extraction used before: a full BeautifulSoup tree, then every <a href>.
+def previous_links(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [a["href"] for a in soup.find_all("a", href=True)]
+
+
+def html_parser_links(html):
+    links = []
+    parser = indicators.LinkParser(indicators.LinkCollector(links.append, links.append))
+    parser.feed(html)
+    parser.close()
+    return links
+
+
+def lxml_links(html):
+    links, resources = indicators.extract_links(html)
+    return links + resources
+
+
+def measure(function, html):
+    timings = []
+
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        links = function(html)
+        timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    function(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings) * 1000, peak / (1024 * 1024), len(links)
+
+
+def main():
+    extractors = [("BeautifulSoup <a href> (previous)", previous_links), ("HTMLParser streaming", html_parser_links)]
+
+    if indicators.etree is not None:
+        extractors.append(("lxml streaming", lxml_links))
+    else:
+        print("lxml is not installed; only html.parser is measured")
+
+    for label, size in SIZES:
+        html = make_html(size)
+        print(f"{label} HTML email")
+
+        for name, function in extractors:
+            ms, peak_mb, count = measure(function, html)
+            print(f"  {name:<36} {ms:9.1f} ms   peak {peak_mb:7.1f} MB   {count:6} targets")
+
+
+if __name__ == "__main__":
+    main()
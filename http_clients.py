@@ -0,0 +1,106 @@
+# This file holds the shared HTTP clients for VirusTotal, OpenAI and Azure Blob Storage.
+# Connections are pooled and kept alive, so calls reuse an open TLS connection instead of opening a new one.
+import os
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from azure.core.pipeline.transport import RequestsTransport
+from azure.storage.blob import BlobServiceClient
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_SECONDS = float(os.getenv("HTTP_KEEPALIVE_SECONDS", "60"))
+
+def pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_POOL_SIZE,
+        max_keepalive_connections=HTTP_POOL_SIZE,
+        keepalive_expiry=HTTP_KEEPALIVE_SECONDS
+    )
+
+vt_client = None
+openai_http_client = None
+openai_sync_http_client = None
+blob_service_client = None
+blob_session = None
+
+# Called from the FastAPI lifespan hook. Scripts that skip it get the clients on first use.
+def open_clients():
+    get_vt_client()
+    get_openai_http_client()
+    get_openai_sync_http_client()
+    get_blob_service_client()
+
+def get_vt_client() -> httpx.AsyncClient:
+    global vt_client
+
+    if vt_client is None or vt_client.is_closed:
+        vt_client = httpx.AsyncClient(limits=pool_limits(), timeout=15)
+
+    return vt_client
+
+# OpenAI replies can take a while, so reads get OPENAI_TIMEOUT_SECONDS. smeopenai.open_llm() rebuilds its OpenAI
+# clients when these are replaced.
+OPENAI_TIMEOUT_SECONDS = float(os.getenv("OPENAI_TIMEOUT_SECONDS", "60"))
+
+def openai_timeout() -> httpx.Timeout:
+    return httpx.Timeout(OPENAI_TIMEOUT_SECONDS, connect=10)
+
+def get_openai_http_client() -> httpx.AsyncClient:
+    global openai_http_client
+
+    if openai_http_client is None or openai_http_client.is_closed:
+        openai_http_client = httpx.AsyncClient(limits=pool_limits(), timeout=openai_timeout())
+
+    return openai_http_client
+
+def get_openai_sync_http_client() -> httpx.Client:
+    global openai_sync_http_client
+
+    if openai_sync_http_client is None or openai_sync_http_client.is_closed:
+        openai_sync_http_client = httpx.Client(limits=pool_limits(), timeout=openai_timeout())
+
+    return openai_sync_http_client
+
+# Returns None when Azure Storage is not configured.
+def get_blob_service_client():
+    global blob_service_client, blob_session
+
+    if blob_service_client is None:
+        connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+
+        if not connection_string:
+            return None
+
+        blob_session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+        blob_session.mount("https://", adapter)
+        blob_session.mount("http://", adapter)
+
+        blob_service_client = BlobServiceClient.from_connection_string(
+            connection_string,
+            transport=RequestsTransport(session=blob_session, session_owner=False)
+        )
+
+    return blob_service_client
+
+# Close the clients opened by open_clients. They are opened again on next use.
+async def close_clients():
+    global vt_client, openai_http_client, openai_sync_http_client, blob_service_client, blob_session
+
+    if vt_client is not None:
+        await vt_client.aclose()
+        vt_client = None
+
+    if openai_http_client is not None:
+        await openai_http_client.aclose()
+        openai_http_client = None
+
+    if openai_sync_http_client is not None:
+        openai_sync_http_client.close()
+        openai_sync_http_client = None
+
+    if blob_service_client is not None:
+        blob_service_client.close()
+        blob_session.close()
+        blob_service_client = None
+        blob_session = None
@@ -0,0 +1,169 @@
+# This file measures the per-call overhead of opening a new connection for every VirusTotal and Azure call
+# compared with the shared, pooled clients in http_clients.py.
+# It runs against a local HTTPS stand-in server and does not contact VirusTotal or Azure.
+
+import os
+import ssl
+import time
+import base64
+import asyncio
+import datetime
+import ipaddress
+import tempfile
+import threading
+import statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+CALLS = 200
+
+# Self-signed certificate for 127.0.0.1, trusted by the clients through the usual environment variables.
+def make_certificate(directory: str) -> tuple:
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), True)
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+
+    return cert_path, key_path
+
+# Answers like the VirusTotal domain endpoint and the Azure "put blob" endpoint.
+class StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, body: bytes, headers: dict = None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.reply(200, b'{"data": {"attributes": {"last_analysis_stats": {"harmless": 70, "malicious": 0}}}}',
+                   {"Content-Type": "application/json"})
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.reply(201, b"", {
+            "ETag": '"0x1"',
+            "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT",
+            "x-ms-request-server-encrypted": "true"
+        })
+
+def start_server(cert_path: str, key_path: str) -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+def report(name: str, timings: list):
+    timings = sorted(t * 1000 for t in timings)
+    print(f"  {name:<40} mean {statistics.mean(timings):6.2f} ms   p50 {timings[len(timings) // 2]:6.2f} ms   "
+          f"p95 {timings[int(len(timings) * 0.95)]:6.2f} ms")
+
+async def benchmark_virustotal(base_url: str):
+    import httpx
+    import requests
+    from http_clients import get_vt_client
+
+    url = f"{base_url}/domains/example.com"
+    print(f"VirusTotal domain lookups ({CALLS} sequential calls)")
+
+    timings = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        requests.get(url, timeout=15).json()
+        timings.append(time.perf_counter() - started)
+    report("requests.get per call (original)", timings)
+
+    timings = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        async with httpx.AsyncClient() as client:
+            (await client.get(url, timeout=15)).json()
+        timings.append(time.perf_counter() - started)
+    report("new httpx.AsyncClient per call", timings)
+
+    client = get_vt_client()
+    timings = []
+    for _ in range(CALLS):
+        started = time.perf_counter()
+        (await client.get(url, timeout=15)).json()
+        timings.append(time.perf_counter() - started)
+    report("shared pooled client", timings)
+
+def benchmark_azure(connection_string: str):
+    from azure.storage.blob import BlobServiceClient
+    import http_clients
+
+    print(f"Azure incident uploads ({CALLS} sequential calls)")
+
+    timings = []
+    for i in range(CALLS):
+        started = time.perf_counter()
+        client = BlobServiceClient.from_connection_string(connection_string)
+        client.get_blob_client(container="smeincidents", blob=f"IT/INC{i}.json").upload_blob(b"{}", overwrite=True)
+        timings.append(time.perf_counter() - started)
+    report("new BlobServiceClient per call (original)", timings)
+
+    timings = []
+    for i in range(CALLS):
+        started = time.perf_counter()
+        client = http_clients.get_blob_service_client()
+        client.get_blob_client(container="smeincidents", blob=f"IT/INC{i}.json").upload_blob(b"{}", overwrite=True)
+        timings.append(time.perf_counter() - started)
+    report("shared pooled client", timings)
+
+def main():
+    directory = tempfile.mkdtemp()
+    cert_path, key_path = make_certificate(directory)
+    port = start_server(cert_path, key_path)
+
+    # requests (used by the Azure SDK) and httpx both read these.
+    os.environ["REQUESTS_CA_BUNDLE"] = cert_path
+    os.environ["SSL_CERT_FILE"] = cert_path
+    os.environ["AZURE_STORAGE_CONNECTION_STRING"] = (
+        "DefaultEndpointsProtocol=https;AccountName=benchmark;"
+        f"AccountKey={base64.b64encode(b'benchmark-key').decode()};"
+        f"BlobEndpoint=https://127.0.0.1:{port}/benchmark;"
+    )
+
+    asyncio.run(benchmark_virustotal(f"https://127.0.0.1:{port}/api/v3"))
+    benchmark_azure(os.environ["AZURE_STORAGE_CONNECTION_STRING"])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# This file decides locally whether a chat message needs incident triage, so only unclear messages go to the LLM.
+# It combines keyword rules with a small Naive Bayes model trained on the testing results in this repository.
+import os
+import re
+import csv
+import math
+import glob
+import threading
+from collections import defaultdict
+
+TOKEN_REGEX = re.compile(r"[a-z0-9']+")
+
+# Phrases that describe something that has already gone wrong.
+PROBLEM_PATTERNS = re.compile(
+    r"\b(?:"
+    r"i can'?t|i cannot|can'?t (?:log|sign|connect|access|open|get)|cannot (?:log|sign|connect|access|open)|"
+    r"(?:isn'?t|aren'?t|not|stopped) working|doesn'?t work|won'?t (?:work|connect|load|open)|"
+    r"keeps? (?:timing out|crashing|disconnecting|dropping|failing|asking)|error(?: message)?s?|"
+    r"locked out|account (?:is |was |got )?locked|"
+    r"(?:was|been|got|were|have been|has been) (?:hacked|compromised|infected|encrypted|changed|stolen|leaked|deleted)|"
+    r"i (?:accidentally |just )?(?:clicked|opened|downloaded|entered|typed|sent|lost|shared)|"
+    r"ransomware|pop-?ups? (?:keep|appear)|strange activity|weird activity|suspicious activity|"
+    r"unauthori[sz]ed (?:access|login)|someone (?:logged|accessed|used)|data breach|"
+    r"(?:my|our|the) (?:laptop|computer|pc|phone|device|printer|vpn|wi-?fi|internet|email|account) (?:is|was|has|keeps|won'?t|can'?t)"
+    r")\b"
+)
+
+# Phrases that ask for advice or information.
+ADVICE_PATTERNS = re.compile(
+    r"^(?:\d+\.\s*)?(?:hey,?\s*|hi,?\s*|hello,?\s*)?(?:"
+    r"how (?:do|can|should|would|often)|what(?:'s| is| are| should| does| do)|why (?:do|is|are|should)|"
+    r"can you (?:give|explain|tell|help me understand|recommend|suggest)|could you (?:give|explain|tell)|"
+    r"is it (?:safe|ok|okay)|should (?:i|we)|tips? |best practices?|explain|tell me|define"
+    r")"
+)
+
+# Testing results used to train the model: (file pattern, text column, label column, labels meaning "incident").
+# Patterns are relative to this file, so the model is the same whatever directory the app is started from.
+TRAINING_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TRAINING_SOURCES = [
+    ("AI_Triage_Results/*.csv", "Initial Message", "Expected Outcome", {"IT", "Cybersecurity"}),
+    ("AIGenerated_SessionID_Result/*.csv", "User Input", "Expected Bot Behaviour", set()),
+    ("Fixed_SessionID_Auto/Fixed_SessionID_Auto_Questions.csv", "User Input", "Expected Bot Behaviour", set()),
+    ("Mixed_Fixed_Refusal_Function/Mixed_Fixed_Refusal_Function_Questions.csv", "User Input", "Expected Bot Behaviour", set()),
+]
+
+def tokenize(text: str) -> list:
+    words = TOKEN_REGEX.findall(text.lower().replace("’", "'"))
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+# Load (text, is_incident) pairs from the testing CSV files.
+def load_training_data(sources=TRAINING_SOURCES) -> list:
+    examples = []
+    seen = set()
+
+    for pattern, text_column, label_column, incident_labels in sources:
+        for path in sorted(glob.glob(os.path.join(TRAINING_DIR, pattern))):
+            with open(path, encoding="utf-8-sig", errors="replace", newline="") as f:
+                for row in csv.DictReader(f):
+                    text = re.sub(r"^\s*\d+\.\s*", "", row.get(text_column) or "").strip()
+
+                    if not text or text in seen:
+                        continue
+
+                    seen.add(text)
+                    examples.append((text, row.get(label_column, "") in incident_labels))
+
+    return examples
+
+# Multinomial Naive Bayes with add-one smoothing.
+class NaiveBayes:
+    def __init__(self):
+        self.class_counts = {True: 0, False: 0}
+        self.token_counts = {True: defaultdict(int), False: defaultdict(int)}
+        self.token_totals = {True: 0, False: 0}
+        self.vocabulary = set()
+
+    def fit(self, examples):
+        for text, label in examples:
+            self.class_counts[label] += 1
+
+            for token in tokenize(text):
+                self.token_counts[label][token] += 1
+                self.token_totals[label] += 1
+                self.vocabulary.add(token)
+
+        return self
+
+    @property
+    def trained(self) -> bool:
+        return all(self.class_counts.values())
+
+    # Probability that the text describes an incident.
+    def predict_proba(self, text: str) -> float:
+        total_docs = sum(self.class_counts.values())
+        vocab_size = len(self.vocabulary) + 1
+        scores = {}
+
+        for label in (True, False):
+            score = math.log(self.class_counts[label] / total_docs)
+            counts = self.token_counts[label]
+            denominator = self.token_totals[label] + vocab_size
+
+            for token in tokenize(text):
+                if token in self.vocabulary:
+                    score += math.log((counts.get(token, 0) + 1) / denominator)
+
+            scores[label] = score
+
+        top = max(scores.values())
+        incident = math.exp(scores[True] - top)
+        advice = math.exp(scores[False] - top)
+        return incident / (incident + advice)
+
+# Decides the obvious cases locally and reports how many LLM classifier calls were avoided.
+class IncidentPreClassifier:
+    def __init__(self, threshold: float = 0.9, examples=None):
+        self.threshold = threshold
+        self.model = NaiveBayes().fit(load_training_data() if examples is None else examples)
+        self._lock = threading.Lock()
+
+        self.decided_by_rules = 0
+        self.decided_by_model = 0
+        self.sent_to_llm = 0
+
+    # Return {"create_incident": bool, "confidence": float, "source": str}, or None if the LLM should decide.
+    def classify(self, text: str):
+        normalised = text.lower().replace("’", "'").replace("‘", "'").strip()
+
+        problem = bool(PROBLEM_PATTERNS.search(normalised))
+        advice = bool(ADVICE_PATTERNS.search(normalised))
+
+        # A clear advice question that describes no problem never needs an incident.
+        if advice and not problem:
+            with self._lock:
+                self.decided_by_rules += 1
+
+            return {"create_incident": False, "confidence": 1.0, "source": "rules"}
+
+        # Problem phrases also appear in advice questions ("ransomware prevention checklist"), so they never create
+        # an incident by themselves. The model decides locally only above the threshold and only when it agrees
+        # with the rules: an incident needs a problem phrase, and no incident needs the absence of one.
+        if self.model.trained:
+            probability = self.model.predict_proba(text)
+            confidence = max(probability, 1 - probability)
+            incident = probability >= 0.5
+
+            if confidence >= self.threshold and incident == problem:
+                with self._lock:
+                    self.decided_by_model += 1
+
+                return {"create_incident": incident, "confidence": round(confidence, 4), "source": "model"}
+
+        with self._lock:
+            self.sent_to_llm += 1
+
+        return None
+
+    def stats(self) -> dict:
+        decided = self.decided_by_rules + self.decided_by_model
+        total = decided + self.sent_to_llm
+
+        return {
+            "threshold": self.threshold,
+            "decided_by_rules": self.decided_by_rules,
+            "decided_by_model": self.decided_by_model,
+            "sent_to_llm": self.sent_to_llm,
+            "llm_calls_saved": decided,
+            "llm_calls_saved_rate": round(decided / total, 4) if total else 0.0
+        }
@@ -0,0 +1,69 @@
+# This file checks the local incident pre-classifier against labelled chat messages.
+# Advice questions that are decided locally must never start incident triage, so precision on the incident side
+# has to stay at 1.0; everything the classifier is unsure about goes to the LLM and is counted as such.
+# It runs offline and does not call OpenAI.
+
+import os
+
+from incident_classifier import IncidentPreClassifier
+
+# Questions asking for advice or information. Several contain problem words on purpose.
+ADVICE = [
+    "Ransomware prevention checklist for small businesses",
+    "Examples of suspicious activity to look out for",
+    "Data breach notification rules under GDPR",
+    "I can't remember what MFA stands for",
+    "Common error messages when using VPN",
+    "How do I set up MFA on my phone?",
+    "What should I do if I receive a phishing email?",
+    "Is it safe to use public Wi-Fi for work?",
+    "Best practices for creating strong passwords",
+    "Can you explain what a VPN does?",
+    "What is the policy for installing software on work laptops?",
+    "Tips for spotting a fake login page",
+    "Why do I need to change my password every 90 days?",
+    "How often should I back up my files?",
+]
+
+# Messages describing something that has already gone wrong.
+INCIDENTS = [
+    "I clicked a link in an email and entered my password, I think my account was compromised",
+    "My laptop was infected with ransomware and all my files are encrypted",
+    "I can't log in to my email, it says my account is locked",
+    "The VPN keeps timing out and I can't access the shared drive",
+    "Someone logged into my account from another country last night",
+    "My computer keeps crashing every time I open Outlook",
+    "I accidentally sent a spreadsheet with customer data to the wrong person",
+    "The printer on the third floor isn't working",
+]
+
+
+def main():
+    classifier = IncidentPreClassifier(threshold=float(os.getenv("INCIDENT_CLASSIFIER_THRESHOLD", "0.95")))
+
+    decisions = []
+
+    for text, expected in [(text, False) for text in ADVICE] + [(text, True) for text in INCIDENTS]:
+        result = classifier.classify(text)
+        decided = "LLM" if result is None else ("incident" if result["create_incident"] else "no incident")
+        decisions.append((text, expected, result))
+        print(f"  {'incident' if expected else 'advice':<8} → {decided:<11} {'' if result is None else result['source']:<6} {text}")
+
+    local = [(expected, result) for _, expected, result in decisions if result is not None]
+    local_incidents = [expected for expected, result in local if result["create_incident"]]
+    wrong_incidents = [text for text, expected, result in decisions if result and result["create_incident"] and not expected]
+    wrong_advice = [text for text, expected, result in decisions if result and not result["create_incident"] and expected]
+
+    precision = sum(local_incidents) / len(local_incidents) if local_incidents else 1.0
+
+    print()
+    print(f"Decided locally: {len(local)} of {len(decisions)}; {len(decisions) - len(local)} sent to the LLM")
+    print(f"Incident precision on local decisions: {precision:.2f}")
+    print(f"Incidents decided locally as advice: {len(wrong_advice)}")
+
+    assert not wrong_incidents, f"Advice questions classified as incidents: {wrong_incidents}"
+    assert not wrong_advice, f"Incidents classified as advice: {wrong_advice}"
+
+
+if __name__ == "__main__":
+    main()
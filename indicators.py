@@ -0,0 +1,301 @@
+# This file finds indicators of compromise (URLs, domains, email addresses and IP addresses) in text in one pass.
+# Defanged forms such as hxxp://, example[.]com and user[at]example.com are recognised and turned back into
+# the real indicator. Every indicator is canonicalised and de-duplicated, so each one is only scanned once.
+import re
+import ipaddress
+from html.parser import HTMLParser
+from urllib.parse import urlsplit
+
+# lxml is optional; when it is installed, HTML links are found with its faster parser.
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from vt_cache import canonical_url, canonical_domain
+
+# A dot or @ written normally or defanged.
+DOT = r'(?:\.|\[\.\]|\(\.\)|\[dot\]|\(dot\))'
+AT = r'(?:@|\[@\]|\(@\)|\[at\]|\(at\))'
+LABEL = r'[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?'
+SCHEME = r'(?:h[tx]{2}ps?|ftp|fxp)(?:://|\[:\]//|\[://\])'
+
+# One pattern for all indicator types, tried in this order at the start of each word.
+INDICATOR_REGEX = re.compile(
+    rf'(?<![\w.+-])'
+    rf'(?:(?P<url>{SCHEME}[^\s<>"\'`]+|\bwww{DOT}[^\s<>"\'`]+)'
+    rf'|(?P<email>[\w.+-]+{AT}{LABEL}(?:{DOT}{LABEL})+)'
+    rf'|(?P<ip>\b\d{{1,3}}(?:{DOT}\d{{1,3}}){{3}}\b)'
+    rf'|(?P<domain>\b{LABEL}(?:{DOT}{LABEL})+))',
+    re.IGNORECASE
+)
+
+# Every indicator pattern needs one of these characters, and most words contain none of them.
+HINT_CHARACTERS = frozenset(".@:[(")
+
+REFANG_REGEX = re.compile(r'\[\.\]|\(\.\)|\[dot\]|\(dot\)|\[:\]|\[://\]|\[@\]|\(@\)|\[at\]|\(at\)|^h[tx]{2}p|^fxp', re.IGNORECASE)
+
+def refang_token(match) -> str:
+    token = match.group(0).lower()
+
+    if token.startswith("h"):
+        return "http"
+    if token == "fxp":
+        return "ftp"
+    if "dot" in token or "." in token:
+        return "."
+    if "at" in token or "@" in token:
+        return "@"
+
+    return token.strip("[]")
+
+def refang(text: str) -> str:
+    return REFANG_REGEX.sub(refang_token, text)
+
+CLOSING_BRACKETS = {")": "(", "]": "[", "}": "{", ">": "<"}
+
+# Drop punctuation that ends the sentence rather than the URL, and closing brackets that were not opened in it.
+def trim_url(url: str) -> str:
+    while url:
+        last = url[-1]
+
+        if last in ".,;:!?'\"*":
+            url = url[:-1]
+        elif last in CLOSING_BRACKETS and url.count(last) > url.count(CLOSING_BRACKETS[last]):
+            url = url[:-1]
+        else:
+            break
+
+    return url
+
+MAX_PARTIAL_WORD = 64 * 1024
+
+# Domains sent to VirusTotal must end in an alphabetic top-level domain.
+SCANNABLE_DOMAIN = re.compile(r'\.[a-z]{2,63}$')
+
+# Public IP addresses only: private, loopback and reserved addresses say nothing about the sender
+# and should not be sent to VirusTotal.
+def public_ip(text: str) -> str | None:
+    try:
+        ip = ipaddress.ip_address(text)
+    except ValueError:
+        return None
+
+    return str(ip) if ip.is_global else None
+
+def url_host(url: str) -> str:
+    return (urlsplit(url).hostname or "").rstrip(".")
+
+# Collects indicators from any number of texts and links, keeping the first-seen order.
+# Domains and IP addresses that are the host of a URL are covered by scanning that URL and are not listed again.
+class IndicatorExtractor:
+    def __init__(self):
+        self._urls = {}
+        self._domains = {}
+        self._emails = {}
+        self._ips = {}
+        self._partial = ""
+
+    # Indicators never contain whitespace, so the pattern only runs on the words that could hold one.
+    def feed(self, text: str):
+        for word in text.split():
+            if HINT_CHARACTERS.isdisjoint(word):
+                continue
+
+            for match in INDICATOR_REGEX.finditer(word):
+                kind = match.lastgroup
+                value = match.group(0)
+
+                if kind == "url":
+                    self.add_url(value)
+                elif kind == "email":
+                    self.add_email(value)
+                elif kind == "ip":
+                    self.add_ip(value)
+                elif "[" in value or "(" in value:
+                    # Plain words with dots ("e.g", "config.py") are too often not domains; only defanged ones,
+                    # written that way on purpose, are taken as domains.
+                    self.add_domain(value)
+
+    # Feed text that arrives in pieces, such as a large email part being decoded. A word cut off at the end of a
+    # piece is held until the next piece arrives; call flush() after the last piece.
+    def feed_partial(self, text: str):
+        text = self._partial + text
+        cut = max(text.rfind(" "), text.rfind("\n"), text.rfind("\t"))
+
+        # A single word longer than this is not an indicator worth holding on to.
+        if cut < 0 and len(text) < MAX_PARTIAL_WORD:
+            self._partial = text
+            return
+
+        self._partial = text[cut + 1:] if cut >= 0 else ""
+        self.feed(text[:cut + 1] if cut >= 0 else text)
+
+    def flush(self):
+        self.feed(self._partial)
+        self._partial = ""
+
+    # Add a link found outside the text, such as an HTML href. Relative links and other schemes are ignored.
+    def add_url(self, url: str):
+        url = trim_url(refang(url.strip()))
+
+        if url.lower().startswith("mailto:"):
+            return self.add_email(url[7:].split("?")[0])
+
+        if url.lower().startswith("www."):
+            url = "http://" + url
+
+        if not re.match(r'(?:https?|ftp)://', url, re.IGNORECASE):
+            return
+
+        # The canonical form (see vt_cache.canonical_url) only de-duplicates; the URL is scanned and shown as written.
+        try:
+            key = canonical_url(url)
+        except ValueError:
+            return
+
+        if url_host(key):
+            self._urls.setdefault(key, url)
+
+    # Add a resource such as an image or tracking pixel. Only its host is kept: each image URL is different,
+    # but the server it is loaded from is what tells a newsletter from a phishing kit.
+    def add_resource(self, url: str):
+        url = url.strip()
+
+        if url.startswith("//"):
+            url = "https:" + url
+
+        if not re.match(r'https?://', url, re.IGNORECASE):
+            return
+
+        host = url_host(url)
+
+        if ":" in host or host.replace(".", "").isdigit():
+            self.add_ip(host)
+        elif host:
+            self.add_domain(host)
+
+    def add_email(self, address: str):
+        local, _, domain = refang(address.strip()).rpartition("@")
+
+        if local and "." in domain:
+            domain = canonical_domain(domain)
+            self._emails.setdefault(f"{local}@{domain}", None)
+            self.add_domain(domain)
+
+    # Every host is recorded, including internal ones such as rxtra.sk993; result() only lists for scanning
+    # the domains that end in a real top-level domain.
+    def add_domain(self, domain: str):
+        domain = canonical_domain(refang(domain))
+
+        if "." in domain.strip("."):
+            self._domains.setdefault(domain, None)
+
+    def add_ip(self, ip: str):
+        ip = public_ip(refang(ip))
+
+        if ip:
+            self._ips.setdefault(ip, None)
+
+    # Returns lists of "urls", "domains", "emails" and "ips", plus "hosts": every domain and IP address seen,
+    # including URL hosts, for checks such as blocking internal domains.
+    def result(self) -> dict:
+        url_hosts = dict.fromkeys(url_host(url) for url in self._urls)
+
+        return {
+            "urls": list(self._urls.values()),
+            "domains": [domain for domain in self._domains if domain not in url_hosts and SCANNABLE_DOMAIN.search(domain)],
+            "emails": list(self._emails),
+            "ips": [ip for ip in self._ips if ip not in url_hosts],
+            "hosts": list(dict.fromkeys([*url_hosts, *self._domains, *self._ips]))
+        }
+
+def extract_indicators(*texts: str) -> dict:
+    extractor = IndicatorExtractor()
+
+    for text in texts:
+        extractor.feed(text)
+
+    return extractor.result()
+
+# Attributes holding a link that can be followed or a form target.
+LINK_ATTRIBUTES = ("href", "action", "formaction")
+
+META_REFRESH_URL = re.compile(r'url\s*=\s*[\'"]?([^\'"\s>]+)', re.IGNORECASE)
+
+# Receives start tags from either parser and passes on link targets as they are found, without building a
+# document tree. Resources the mail client loads by itself (src of images, scripts, frames) go to on_resource.
+class LinkCollector:
+    def __init__(self, on_link, on_resource):
+        self.on_link = on_link
+        self.on_resource = on_resource
+
+    def start(self, tag, attrs):
+        for name in LINK_ATTRIBUTES:
+            value = attrs.get(name)
+
+            if value:
+                self.on_link(value)
+
+        if attrs.get("src"):
+            self.on_resource(attrs["src"])
+
+        # <meta http-equiv="refresh" content="0; url=https://..."> redirects as soon as the email is opened.
+        if tag == "meta" and (attrs.get("http-equiv") or "").lower() == "refresh":
+            match = META_REFRESH_URL.search(attrs.get("content") or "")
+
+            if match:
+                self.on_link(match.group(1))
+
+    # lxml parser target interface; only start tags are needed.
+    def end(self, tag):
+        pass
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        pass
+
+class LinkParser(HTMLParser):
+    def __init__(self, collector: LinkCollector):
+        super().__init__()
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag, dict(attrs))
+
+# Parser that can be fed HTML in pieces with feed() and finished with close().
+def link_parser(on_link, on_resource):
+    collector = LinkCollector(on_link, on_resource)
+
+    if etree is not None:
+        return etree.HTMLParser(target=collector)
+
+    return LinkParser(collector)
+
+# Return (links, resources) from an HTML document, each in the order they appear.
+def extract_links(html: str) -> tuple:
+    links = []
+    resources = []
+
+    parser = link_parser(links.append, resources.append)
+    parser.feed(html)
+    parser.close()
+
+    return links, resources
+
+# Cheap check run on chat messages before any parsing: matches anything that could be a URL, an email address,
+# a domain, an IP address or an email header. Plain questions such as "what is MFA?" do not match.
+INDICATOR_HINT = re.compile(
+    rf'{SCHEME}|www{DOT}|{AT}'
+    rf'|[a-z0-9-]{DOT}[a-z]{{2}}|\d{DOT}\d'
+    r'|^(?:content-type|content-transfer-encoding|mime-version|from|to|cc|subject|date|received|return-path|reply-to|message-id)[ \t]*:',
+    re.IGNORECASE | re.MULTILINE
+)
+
+def might_contain_indicators(text: str) -> bool:
+    if HINT_CHARACTERS.isdisjoint(text):
+        return False
+
+    return INDICATOR_HINT.search(text) is not None
@@ -0,0 +1,112 @@
+# This file compares the indicators found in uploaded emails by the previous extraction (a URL regex over the
+# text parts, every <a href> and the host of each URL as a domain) with the single-pass extractor in indicators.py.
+# Each indicator is one VirusTotal scan, so fewer duplicates means fewer calls per email.
+
+import re
+import time
+import email
+from email import policy
+from email.message import EmailMessage
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup
+
+from virustotal import parse_email
+
+ROUNDS = 200
+
+
+def make_email(subject, text, html=None):
+    msg = EmailMessage()
+    msg["From"] = "sender@example.net"
+    msg["To"] = "staff@example.com"
+    msg["Subject"] = subject
+    msg.set_content(text)
+
+    if html:
+        msg.add_alternative(html, subtype="html")
+
+    return msg.as_bytes()
+
+
+# Marketing-style phishing: the same links in the text and HTML parts, with tracking parameters.
+NEWSLETTER = make_email(
+    "Your account needs attention",
+    "Hi,\n\nPlease confirm your details at https://account-verify.example-login.com/confirm?utm_source=mail&utm_medium=email.\n"
+    "Questions? Visit https://account-verify.example-login.com/help, or write to support@example-login.com.\n",
+    "<p>Please <a href=\"https://account-verify.example-login.com/confirm?utm_source=mail&utm_medium=email&utm_campaign=q3\">confirm your details</a>.</p>"
+    "<p><a href=\"https://Account-Verify.example-login.com/help#faq\">Help</a> | <a href=\"mailto:support@example-login.com\">Contact</a>"
+    " | <a href=\"#top\">Top</a></p>"
+)
+
+# A forwarded threat report with defanged indicators.
+FORWARDED_REPORT = make_email(
+    "FW: indicators from last week's campaign",
+    "Block these please:\n"
+    "hxxps://invoice-portal[.]co/download.php?id=8812\n"
+    "hxxp://185[.]220[.]101[.]4/payload.bin\n"
+    "reply-to: billing[at]invoice-portal[.]co\n"
+    "Also seen: www[.]invoice-portal[.]co/login (same host).\n"
+)
+
+# A plain text email with links ending sentences and inside brackets.
+PLAIN = make_email(
+    "Shared document",
+    "A document was shared with you (https://docs.share-files.example.org/d/9f8e7d).\n"
+    "Open it here: https://docs.share-files.example.org/d/9f8e7d.\n"
+    "Unsubscribe: https://docs.share-files.example.org/unsubscribe?fbclid=abc123\n"
+)
+
+EMAILS = [("Newsletter with tracking links", NEWSLETTER), ("Forwarded defanged report", FORWARDED_REPORT), ("Plain text links", PLAIN)]
+
+
+# The extraction used before indicators.py: URLs by regex from text parts, every href, and each URL host as a domain.
+def previous_indicators(raw_email_bytes):
+    msg = email.message_from_bytes(raw_email_bytes, policy=policy.default)
+    text_parts = []
+    html_parts = []
+
+    for part in msg.walk():
+        if part.get_content_type() == "text/plain":
+            text_parts.append(part.get_content())
+        elif part.get_content_type() == "text/html":
+            html_parts.append(part.get_content())
+
+    urls = set(re.findall(r'https?://[^\s"\']+', "\n".join(text_parts)))
+
+    for html in html_parts:
+        for a in BeautifulSoup(html, "html.parser").find_all("a", href=True):
+            urls.add(a["href"])
+
+    domains = {urlparse(u).netloc for u in urls}
+    return sorted(urls) + sorted(domains)
+
+
+def current_indicators(raw_email_bytes):
+    found, _ = parse_email(raw_email_bytes)
+    return found["urls"] + found["domains"] + found["ips"]
+
+
+def timed_ms(function, raw):
+    start = time.perf_counter()
+
+    for _ in range(ROUNDS):
+        function(raw)
+
+    return (time.perf_counter() - start) * 1000 / ROUNDS
+
+
+def main():
+    for name, raw in EMAILS:
+        print(name)
+
+        for label, function in [("previous", previous_indicators), ("single pass", current_indicators)]:
+            indicators = function(raw)
+            print(f"  {label:<12} {len(indicators):2} scans   {timed_ms(function, raw):6.3f} ms per email")
+
+            for indicator in indicators:
+                print(f"      {indicator}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# This file reads a batch of emails (an .mbox file or a .zip of .eml files) for one combined scan.
+# Messages are read one at a time, and indicators and attachments found in several messages are collected once,
+# so each unique URL, domain, IP address or attachment is scanned once per batch however many messages hold it.
+from vt_cache import verdict_type, canonical_url
+from mime_stream import parse_email_file, iter_mailbox, close_attachments, EmailTooLarge, EML_MAX_ATTACHMENTS, EML_MAX_BATCH_MESSAGES
+
+# Most serious first; a message gets the verdict of its most serious indicator.
+VERDICT_ORDER = ["malicious", "suspicious", "not_found", "unverified", "deferred", "safe"]
+
+VERDICT_LABELS = {
+    "malicious": "Malicious",
+    "suspicious": "Suspicious",
+    "not_found": "Unverified",
+    "unverified": "Unverified",
+    "deferred": "Not fully scanned",
+    "safe": "Clean"
+}
+
+# Read every message in the batch. is_internal is called with a message's hosts; internal messages are listed
+# but not scanned. Returns a dict with:
+#   messages    - per message: name, subject, sender, internal, and the indicators it holds
+#   found       - urls, domains and ips, each listed once for the whole batch
+#   attachments - one mime_stream.Attachment per unique sha256; call close_attachments() when done with them
+#   occurrences - indicators found across all messages, counting repeats
+#   truncated   - True if the batch held more than EML_MAX_BATCH_MESSAGES messages, or a zip unpacked to more
+#                 than EML_MAX_BATCH_EXPANDED_BYTES
+def read_mailbox(fileobj, is_internal) -> dict:
+    messages = []
+    found = {"urls": {}, "domains": {}, "ips": {}}
+    attachments = {}
+    occurrences = 0
+    truncated = False
+    kept = 0
+
+    try:
+        for name, message in iter_mailbox(fileobj):
+            if len(messages) >= EML_MAX_BATCH_MESSAGES:
+                truncated = True
+                break
+
+            headers = {}
+
+            def on_headers(message_headers):
+                headers["subject"] = str(message_headers.get("subject") or "")
+                headers["sender"] = str(message_headers.get("from") or "")
+
+            try:
+                result, message_attachments = parse_email_file(message, on_headers=on_headers)
+            except EmailTooLarge as e:
+                # The zip unpacks to more than the batch may read; scan the messages read so far.
+                print(f"Stopped reading the batch at {name}: {e}")
+                truncated = True
+                break
+            except Exception as e:
+                print(f"Could not read {name} in the batch: {e}")
+                messages.append({"name": name, "subject": "", "sender": "", "internal": False, "unreadable": True,
+                                 "urls": [], "domains": [], "ips": [], "attachments": []})
+                continue
+
+            internal = is_internal(result["hosts"])
+            entry = {
+                "name": name,
+                "subject": headers.get("subject", ""),
+                "sender": headers.get("sender", ""),
+                "internal": internal,
+                "unreadable": False,
+                "urls": [] if internal else result["urls"],
+                "domains": [] if internal else result["domains"],
+                "ips": [] if internal else result["ips"],
+                "attachments": [] if internal else [(a.filename, a.sha256) for a in message_attachments]
+            }
+            messages.append(entry)
+
+            if internal:
+                close_attachments(message_attachments)
+                continue
+
+            for kind in ("urls", "domains", "ips"):
+                occurrences += len(result[kind])
+
+                for value in result[kind]:
+                    found[kind].setdefault(indicator_key(kind, value), value)
+
+            for attachment in message_attachments:
+                occurrences += 1
+
+                # Keep the first copy of each file; later copies are the same file under any name.
+                if attachment.sha256 in attachments:
+                    attachment.close()
+                    continue
+
+                # The batch shares one upload limit, so later unique files are looked up by hash only.
+                if attachment.file is not None:
+                    if kept < EML_MAX_ATTACHMENTS:
+                        kept += 1
+                    else:
+                        attachment.close()
+
+                attachments[attachment.sha256] = attachment
+    except Exception:
+        close_attachments(attachments.values())
+        raise
+
+    return {
+        "messages": messages,
+        "found": {kind: list(values.values()) for kind, values in found.items()},
+        "attachments": list(attachments.values()),
+        "occurrences": occurrences,
+        "truncated": truncated
+    }
+
+# URLs that differ only in tracking parameters or case are the same indicator (see vt_cache.canonical_url).
+def indicator_key(kind: str, value: str) -> str:
+    return canonical_url(value) if kind == "urls" else value
+
+# Keys for the scans built by main.email_scans(found, attachments), in the same order.
+def scan_keys(found: dict, attachments: list) -> list:
+    return (
+        [indicator_key(kind, value) for kind in ("urls", "domains", "ips") for value in found[kind]]
+        + [attachment.sha256 for attachment in attachments]
+    )
+
+# The indicators of a message as (label, name, key), where key is the indicator's key in the verdicts dict.
+def message_indicators(message: dict) -> list:
+    return (
+        [("URL", url, indicator_key("urls", url)) for url in message["urls"]]
+        + [("Domain", dom, dom) for dom in message["domains"]]
+        + [("IP address", ip, ip) for ip in message["ips"]]
+        + [("Attachment", filename, sha256) for filename, sha256 in message["attachments"]]
+    )
+
+# Give each message the verdict of its most serious indicator. verdicts maps the key of each URL, domain and
+# IP address (see indicator_key), and each attachment's sha256, to the verdict returned by its scan.
+# Returns one dict per message: name, subject, sender, verdict, the flagged indicators as "label: name", and the
+# indicators that were not scanned (deferred by quota, or VirusTotal unavailable) in the same form.
+def message_verdicts(batch: dict, verdicts: dict) -> list:
+    results = []
+
+    for message in batch["messages"]:
+        result = {"name": message["name"], "subject": message["subject"], "sender": message["sender"],
+                  "verdict": None, "flagged": [], "deferred": []}
+
+        if message["internal"]:
+            result["verdict"] = "Internal (not scanned)"
+        elif message["unreadable"]:
+            result["verdict"] = "Could not be read"
+        else:
+            worst = None
+
+            for label, name, key in message_indicators(message):
+                kind = verdict_type(verdicts.get(key, "Deferred"))
+
+                if kind == "deferred":
+                    result["deferred"].append(f"{label}: {name}")
+                elif kind != "safe":
+                    result["flagged"].append(f"{label}: {name}")
+
+                if worst is None or VERDICT_ORDER.index(kind) < VERDICT_ORDER.index(worst):
+                    worst = kind
+
+            result["verdict"] = VERDICT_LABELS[worst] if worst else "No indicators found"
+
+        results.append(result)
+
+    return results
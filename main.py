@@ -7,55 +7,107 @@ import os
 import re
 
 from fastapi import FastAPI, Request, UploadFile, File
-from fastapi.responses import PlainTextResponse, HTMLResponse, FileResponse, JSONResponse
+from fastapi.responses import PlainTextResponse, HTMLResponse, FileResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
 from datetime import datetime
-from collections import defaultdict
 
 
-from smeopenai import ask_openai, classify_group
-from virustotal import parse_email, scan_url, scan_domain, scan_file_attachment
+from smeopenai import ask_openai_async, complete_async, stream_openai, classify_group, response_cache_key, open_llm
+from response_cache import ResponseCache
+from semantic_cache import SemanticCache
+from session_manager import SessionManager
+from incident_classifier import IncidentPreClassifier
+from redaction import redact_pi
+from indicators import IndicatorExtractor, might_contain_indicators
+from mime_stream import parse_email_file, spool_upload, close_attachments, EmailTooLarge, EML_MAX_BATCH_BYTES
+from mailbox_batch import read_mailbox, message_verdicts, scan_keys
+from session_store import session_store, StoreMapping, call_store, SESSION_IDLE_TTL_SECONDS
+from virustotal import parse_email, scan_url, scan_domain, scan_ip, scan_file_attachment, scan_deadline, job_deadline, run_rescan_worker, rescan_queue
+from vt_cache import verdict_cache, verdict_type
+from vt_scheduler import vt_scheduler
+from circuit_breaker import vt_breaker
+from scan_jobs import ScanJobs
 from pdf_generation import generate_incident_pdf
 from notifypdf import notify_cybersecurity
-from azure.storage.blob import BlobServiceClient
+from http_clients import open_clients, close_clients, get_blob_service_client
 
 import uuid
 import json
-
-app = FastAPI()
+import asyncio
+from contextlib import asynccontextmanager
+
+# Removes idle sessions from the session store.
+session_manager = SessionManager(
+    session_store,
+    idle_ttl_seconds=SESSION_IDLE_TTL_SECONDS,
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", "10000"))
+)
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+VT_RESCAN_INTERVAL = float(os.getenv("VT_RESCAN_INTERVAL_SECONDS", "10"))
+
+# Start background tasks when the app starts and stop them on shutdown.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    open_clients()
+    open_llm()
+    sweeper = asyncio.create_task(session_manager.run_sweeper(SESSION_SWEEP_INTERVAL))
+    rescanner = asyncio.create_task(run_rescan_worker(VT_RESCAN_INTERVAL, on_flagged=report_rescan_results))
+
+    yield
+
+    sweeper.cancel()
+    rescanner.cancel()
+    scan_jobs.cancel_all()
+    session_store.close()
+    verdict_cache.close()
+    await close_clients()
+
+app = FastAPI(lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 INTERNAL_DOMAINS = {
-    d.strip() for d in os.getenv("INTERNAL_DOMAINS", "").split(",") if d.strip()
+    d.strip().lower() for d in os.getenv("INTERNAL_DOMAINS", "").split(",") if d.strip()
 }
 
-# detect emails and URLs inside messages sent 
-EMAIL_REGEX = r'[\w\.-]+@([\w\.-]+\.\w+)'
-URL_REGEX   = r'(https?://[^\s]+|www\.[^\s]+)'
+# check the format of domains before sending them to VirusTotal
 DOMAIN_PATTERN = r'^[a-zA-Z0-9-]+(?:\.[a-zA-Z0-9-]+)+$'
 
-# Patterns used to detect personal information.
-PI_PATTERNS = {
-    "NI_NUMBER": r"\b[A-CEGHJ-PR-TW-Z]{2}\d{6}[A-D]\b",
-    "UK_PHONE": r"\b(?:\+44|0)\d{10,11}\b",
-    "CREDIT_CARD": r"\b(?:\d[ -]*?){13,16}\b",
-    "PASSPORT_LIKE_ID": r"\b[A-Z]{1,2}\d{6,9}\b"
-}
-
 THRESHOLD     = 3 # threshold for out-of-scope questions, warning after 3rd time
 FOLLOWUPQUESTIONS = 2  # 2 follow-up questions before asking if the user wants an incident created.
 
-refusal_count = defaultdict(int)
+# Per-session data lives in the session store so every worker sees the same sessions.
+refusal_count = StoreMapping(session_store, "refusal_count", default=int)
 
 # Store chat history temporarily
-chat_sessions = defaultdict(list)
+chat_sessions = StoreMapping(session_store, "chat_sessions", default=list)
 
 # Store incident triage progress for each session.
-triage_state = {}
+triage_state = StoreMapping(session_store, "triage_state")
+
+# Decides locally whether a message needs incident triage before asking the LLM.
+incident_preclassifier = IncidentPreClassifier(
+    threshold=float(os.getenv("INCIDENT_CLASSIFIER_THRESHOLD", "0.95"))
+)
 
 # Cache previous chatbot responses.
-response_cache = {}
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000")),
+    ttl_seconds=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))
+)
+
+# Match paraphrased questions to cached responses.
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9")),
+    max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+)
+
+# Background .eml scans started from /scan-jobs.
+scan_jobs = ScanJobs(
+    session_store,
+    workers=int(os.getenv("SCAN_JOB_WORKERS", "4")),
+    ttl_seconds=float(os.getenv("SCAN_JOB_TTL_SECONDS", "3600"))
+)
 
 # For the bot to detect out-of-scope questions, common phrases in replies
 REFUSAL_TAGS = [ 
@@ -69,6 +121,9 @@ REFUSAL_TAGS = [
     "I'm here to focus"
 ]
 
+# Tag the LLM puts at the start of out-of-scope replies.
+REFUSAL_PREFIX = "[REFUSAL]"
+
 SCAN_KEYWORDS = [     
     r'\bscan.*email\b',            
 ]
@@ -88,12 +143,40 @@ def block_internal(dom: str, session_id: str) -> str | None:
         )
     return None
 
+# A verdict decided without asking VirusTotal, such as a badly formatted domain.
+async def fixed_verdict(verdict: str):
+    return {"verdict": verdict}
+
+# Scan all indicators at the same time, so the total time is that of the slowest scan rather than the sum.
+# Each scan is (label, name shown to the user, name recorded in the incident, coroutine returning a verdict).
+async def run_scans(scans: list):
+    results = await asyncio.gather(*(scan for *_, scan in scans))
+
+    messages = []
+    malicious_indicators = []
+    unverified_indicators = []
+
+    for (label, shown, recorded, _), result in zip(scans, results):
+        verdict = result["verdict"]
+        messages.append(f"{label} {shown} → {verdict}.")
+
+        if verdict.startswith("Likely") or verdict == "Suspicious":
+            malicious_indicators.append(f"{label}: {recorded}")
+
+        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
+            unverified_indicators.append(f"{label}: {recorded}")
+
+        # Deferred (quota reached) and degraded (VirusTotal unavailable) scans are reported to the user
+        # but do not create an incident.
+
+    return messages, malicious_indicators, unverified_indicators
+
 # Save incidents to Azure Blob Storage
 def save_incident(incident: dict):
     upload_incident_to_blob(incident)
 
 #The function to stop the bot from creating incidents for normal advice questions. Used prompt engineering to help bot decide real issues
-def classify_incident(text: str, session_id: str):
+async def classify_incident(text: str, session_id: str):
     prompt = f"""
 
                 You are an IT/security incident classifier.
@@ -132,7 +215,7 @@ def classify_incident(text: str, session_id: str):
                 {text}
                 """
     
-    return ask_openai(prompt, session_id)
+    return await complete_async(prompt)
 
 #decides the groups based on user's input
 def get_department_from_group(group: str):
@@ -144,7 +227,7 @@ def get_department_from_group(group: str):
     return "IT"
 
 #the bot will generate a followup question based on user input. Focuses on missing informations.
-def generate_next_question(group: str, answers: list, user_input: str, session_id: str):
+async def generate_next_question(group: str, answers: list, user_input: str, session_id: str):
         prompt = f"""
                     You are an IT security incident triage assistant.
 
@@ -164,25 +247,26 @@ def generate_next_question(group: str, answers: list, user_input: str, session_i
                     - Keep it short and natural
                     - Focus on missing information only
                     """
-        return ask_openai(prompt, session_id)
+        return await complete_async(prompt)
 
 # Save the incident to Azure Blob Storage, create a PDF report, and give user a download link.
-def create_incident_from_triage(session_id: str, state: dict):
+async def create_incident_from_triage(session_id: str, state: dict):
     group = state["group"]
     department = get_department_from_group(group)
 
     incident = {
                 "id": f"INC{uuid.uuid4().hex[:8]}",
-                "summary": generate_incident_title(state["conversation"], session_id),
+                "summary": await generate_incident_title(state["conversation"], session_id),
                 "conversation": redact_pi("\n".join(state["conversation"])),
                 "department": department,
                 "status": "open",
                 "created_at": datetime.utcnow().isoformat()
             }
 
-    save_incident(incident)
+    # The blob upload and the PDF are blocking work, so they run in a thread like scan_incident_result.
+    await asyncio.to_thread(save_incident, incident)
 
-    pdf_path, incident_id = generate_incident_pdf({
+    pdf_path, incident_id = await asyncio.to_thread(generate_incident_pdf, {
                 "incident_id": incident["id"],
                 "summary": incident["summary"],
                 "details": state["answers"][-1]
@@ -190,7 +274,7 @@ def create_incident_from_triage(session_id: str, state: dict):
     
     filename = os.path.basename(pdf_path)
 
-    triage_state.pop(session_id, None)
+    await triage_state.apop(session_id)
 
     return (
                 f"Your incident has been successfully created and sent to the "
@@ -203,7 +287,7 @@ def create_incident_from_triage(session_id: str, state: dict):
             )
 
 # gives short helpful advice first, then asks one follow-up question
-def generate_triage_response(group, answers, user_input, session_id):
+async def generate_triage_response(group, answers, user_input, session_id):
         prompt = f"""
                 You are an IT and cybersecurity assistant.
 
@@ -228,9 +312,9 @@ def generate_triage_response(group, answers, user_input, session_id):
                 - Do not suggest to give contact information unless asked.
                 - Maximum 100 words.
                 """
-        return ask_openai(prompt, session_id)
+        return await complete_async(prompt, group)
 
-def generate_final_details_question(group: str, answers: list, session_id: str):
+async def generate_final_details_question(group: str, answers: list, session_id: str):
         prompt = f"""
                 You are an IT and cybersecurity incident triage assistant.
 
@@ -252,9 +336,9 @@ def generate_final_details_question(group: str, answers: list, session_id: str):
                 - Do not ask more than one question.
                 - Do not mention error messages unless the issue is a system or login problem.
                 """
-        return ask_openai(prompt, session_id)
+        return await complete_async(prompt, group)
 
-def generate_incident_title(answers: list, session_id: str):
+async def generate_incident_title(answers: list, session_id: str):
         prompt = f"""
                 Create a short incident title from this triage conversation.
 
@@ -267,36 +351,17 @@ def generate_incident_title(answers: list, session_id: str):
                 Conversation:
                 {answers}
                 """
-        return ask_openai(prompt, session_id)
-
-# Remove personal information before processing.
-def redact_pi(text: str) -> str:
-    if not text:
-        return text
-
-    redacted = text
-
-    for label, pattern in PI_PATTERNS.items():
-        redacted = re.sub(
-            pattern,
-            f"[REDACTED_{label}]",
-            redacted,
-            flags=re.IGNORECASE
-        )
-
-    return redacted
+        return await complete_async(prompt)
 
 # Store incident records in Azure Blob Storage.
 def upload_incident_to_blob(incident: dict):
     try:
-        connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+        blob_service_client = get_blob_service_client()
 
-        if not connection_string:
+        if blob_service_client is None:
             print("Azure Storage connection string missing.")
             return
 
-        blob_service_client = BlobServiceClient.from_connection_string(connection_string)
-
         container_name = "smeincidents"
 
         blob_name = f"{incident['department']}/{incident['id']}.json"
@@ -317,37 +382,118 @@ def upload_incident_to_blob(incident: dict):
         print("BLOB ERROR:", str(e))
 
 
+# Update the refusal counter, response cache and chat history once the full LLM reply is known.
+async def finish_llm_reply(llm_reply: str, session_id: str, cache_key: str, question: str, group: str) -> str:
+    reply_lower = llm_reply.lower()
+    
+    if "[refusal]" in reply_lower:
+        refusals = await refusal_count.aload(session_id) + 1
+        await refusal_count.asave(session_id, refusals)
+
+        if refusals >= THRESHOLD:
+            return WARNING_MESSAGE
+    
+    llm_reply = llm_reply.replace("[REFUSAL]", "").strip()
+    response_cache.set(cache_key, llm_reply)
+    semantic_cache.add(group, question, cache_key)
+
+    history = await chat_sessions.aload(session_id)
+    history.append({
+        "sender": "bot",
+        "message": llm_reply
+        })
+    await chat_sessions.asave(session_id, history)
+        
+    return llm_reply
+
+# Format one Server-Sent Event.
+def sse_event(payload: dict, event: str | None = None) -> str:
+    lines = []
+
+    if event:
+        lines.append(f"event: {event}")
+
+    lines.append(f"data: {json.dumps(payload)}")
+    return "\n".join(lines) + "\n\n"
+
+# Forward LLM tokens to the browser as they arrive, then send the final reply.
+async def stream_llm_reply(question: str, session_id: str, cache_key: str, group: str):
+    parts = []
+    buffered = []
+    is_refusal = None
+
+    try:
+        async for token in stream_openai(question, session_id, group):
+            parts.append(token)
+
+            # Hold tokens back until we know if the reply starts with the refusal tag.
+            if is_refusal is None:
+                buffered.append(token)
+                start = "".join(buffered).lstrip()
+
+                if start.startswith(REFUSAL_PREFIX):
+                    is_refusal = True
+                elif len(start) >= len(REFUSAL_PREFIX) or not REFUSAL_PREFIX.startswith(start):
+                    is_refusal = False
+                    yield sse_event({"token": "".join(buffered)})
+                    buffered = []
+
+            elif not is_refusal:
+                yield sse_event({"token": token})
+
+    except Exception as e:
+        print("STREAM ERROR:", str(e))
+        yield sse_event({"message": "Sorry, something went wrong while generating a response."}, event="done")
+        return
+
+    final_reply = await finish_llm_reply("".join(parts), session_id, cache_key, question, group)
+
+    yield sse_event({"message": final_reply}, event="done")
+
 # The main chatbot endpoint, handles messages, scans links/domains, sends questions to OpenAI
 @app.post("/chat", response_class=PlainTextResponse)
 async def chat(req: Request):
     data = await req.json()
+    return await handle_chat(data)
+
+# Same as /chat, but LLM answers are streamed to the browser as Server-Sent Events.
+@app.post("/chat/stream", response_class=PlainTextResponse)
+async def chat_stream(req: Request):
+    data = await req.json()
+    return await handle_chat(data, stream=True)
+
+async def handle_chat(data: dict, stream: bool = False):
     user_input = data.get("query", "").strip()
     safe_user_input = redact_pi(user_input)
 
     session_id = data.get("session_id", "default")
+    await session_manager.atouch(session_id)
 
-    cache_key = safe_user_input.lower().strip()
+    # The message is classified once here and its group passed to the caches, triage and the LLM call.
+    group = classify_group(safe_user_input)
+    cache_key = response_cache_key(safe_user_input, group)
+    state = await triage_state.aget(session_id)
 
-    if session_id in triage_state:
-        state = triage_state[session_id]
+    if state is not None:
 
         if state.get("stage") == "confirm":
             if user_input.lower() in ["yes", "y"]:
                 state["conversation"].append(f"U: {user_input}")
                 state["stage"] = "more_details"
 
-                question = generate_final_details_question(
+                question = await generate_final_details_question(
                     state["group"],
                     state["answers"],
                     session_id
                 )
 
                 state["conversation"].append(f"B: {question}")
+                await triage_state.asave(session_id, state)
 
                 return question
             
             if user_input.lower() in ["no", "n"]:
-                triage_state.pop(session_id, None)
+                await triage_state.apop(session_id)
                 return "Okay, no incident was created."
 
             return "Please reply YES or NO."
@@ -355,7 +501,7 @@ async def chat(req: Request):
         if state.get("stage") == "more_details":
             state["answers"].append(user_input)
             state["conversation"].append(f"U: {user_input}")
-            return create_incident_from_triage(session_id, state)
+            return await create_incident_from_triage(session_id, state)
 
         state["answers"].append(user_input)
 
@@ -364,10 +510,11 @@ async def chat(req: Request):
             question = "Okay. Would you like me to create an incident for this? Reply YES or NO."
 
             state["conversation"].append(f"B: {question}")
+            await triage_state.asave(session_id, state)
 
             return question
         
-        next_question = generate_triage_response(
+        next_question = await generate_triage_response(
             state["group"],
             state["answers"],
             user_input,
@@ -375,6 +522,7 @@ async def chat(req: Request):
         )
         state["conversation"].append(f"B: {next_question}")
         state["question_count"] += 1
+        await triage_state.asave(session_id, state)
         return next_question
     
     # Block requests to scan internal company domains.
@@ -405,158 +553,54 @@ async def chat(req: Request):
             "5. Return here and click **Add Email File**, and select your saved `.eml` file."
         ])
 
-    raw_bytes = user_input.encode("utf-8")
-    urls, domains, attachments = parse_email(raw_bytes)
-
-#separate detected threats from unverified indicators.
-    malicious_indicators = []
-    unverified_indicators = []
     messages = []
 
-    # if domain is rxtra.sk993 (internal domain), don't scan
-    for dom in domains:
-        msg = block_internal(dom, session_id) # prevent internal domains from being sent to VirusTotal.
-        if msg:
-            return msg
-        
-    
-    # Scan URLs 
-    for url in set(re.findall(URL_REGEX, user_input)):
-        full_url = url if url.startswith("http") else "http://" + url
-        verdict = scan_url(full_url)["verdict"]
-        messages.append(f"URL {full_url} → {verdict}.")
-
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"URL: {full_url}")
-
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"URL: {full_url}")
-
-    # Scan domains
-    for dom in domains:
-
-        if not re.match(DOMAIN_PATTERN, dom):
-            messages.append(f"Domain {dom} → Unable to verify domain format. Treat as suspicious and verify manually.")
-            unverified_indicators.append(f"Domain: {dom}")
-
-            continue
-
-        verdict = scan_domain(dom)["verdict"]
-        messages.append(f"Domain {dom} → {verdict}.")
-
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"Domain: {dom}")
-
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"Domain: {dom}")
-
-    #scan attachments
-    for fname, fbytes in attachments:
-
-        verdict = scan_file_attachment(fname, fbytes)["verdict"]
-        messages.append(f"Attachment {fname} → {verdict}.")
-
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"Attachment: {fname}")
-
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"Attachment: {fname}")
-
-    for dom in set(re.findall(EMAIL_REGEX, user_input)):
-
-        msg = block_internal(dom, session_id) # prevent internal domains from being sent to VirusTotal.
-
-        if msg:
-            return msg
-
-        if dom not in domains:
-
+    # Most chat messages are plain questions; only text that could contain a URL, email address, domain or
+    # email headers is parsed and scanned.
+    if might_contain_indicators(user_input):
+        # The text is searched as written; if it is a whole pasted email, parse_email adds its links and attachments.
+        extractor = IndicatorExtractor()
+        extractor.feed(user_input)
+        found, attachments = parse_email(user_input.encode("utf-8"), extractor)
+
+        # if domain is rxtra.sk993 (internal domain), don't scan
+        for dom in found["hosts"]:
+            msg = block_internal(dom, session_id) # prevent internal domains from being sent to VirusTotal.
+            if msg:
+                close_attachments(attachments)
+                return msg
+
+    #separate detected threats from unverified indicators.
+        scans = []
+        deadline = scan_deadline() # all scans for this request share one time budget
+
+        for url in found["urls"]:
+            scans.append(("URL", url, url, scan_url(url, deadline=deadline)))
+
+        # Domains that are the host of a URL above are not scanned again.
+        for dom in found["domains"]:
             if not re.match(DOMAIN_PATTERN, dom):
+                verdict = fixed_verdict("Unable to verify domain format. Treat as suspicious and verify manually")
+            else:
+                verdict = scan_domain(dom, deadline=deadline)
 
-                messages.append(f"Domain {dom} → Unable to verify domain format. Treat as suspicious and verify manually.")
-                unverified_indicators.append(f"Domain: {dom}")
-
-                continue
-
-            verdict = scan_domain(dom)["verdict"]
-            messages.append(f"Domain {dom} → {verdict}.")
-
-            if verdict.startswith("Likely") or verdict == "Suspicious":
-                malicious_indicators.append(f"Domain: {dom}")
-
-            elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-                unverified_indicators.append(f"Domain: {dom}")
-
-# If anything malicious is detected, generate a PDF incident report automatically, notify security team and create an incident for malicious or unverified indicators.
-    if malicious_indicators or unverified_indicators:
-
-    # Set severity based on the scan result.
-        if malicious_indicators:
-            severity = "high"
-            indicators = malicious_indicators
-            summary = "Malicious indicators detected during scan"
-
-            warning_text = ("⚠️ A potential security threat was detected during the VirusTotal scan.")
-
-    # VirusTotal could not confirm the indicator
-        else:
-            severity = "medium"
-            indicators = unverified_indicators
-            summary = "Unverified indicators detected during scan"
-
-            warning_text = ("⚠️ The submitted indicator could not be verified using VirusTotal.")
-
-        incident = {
-            "id": f"INC{uuid.uuid4().hex[:8]}",
-            "summary": summary,
-            "details": ", ".join(indicators),
-            "department": "Cybersecurity",
-            "status": "open",
-            "created_at": datetime.utcnow().isoformat()
-        }
-
-        # Save incident permanently to Azure Blob Storage
-        save_incident(incident)
-
-        report_data = {
-            "incident_id": incident["id"],
-            "report_type": "automatic",
-            "summary": incident["summary"],
-            "severity": severity,
-            "indicators": indicators
-        }
-
-        pdf_path, incident_id = generate_incident_pdf(report_data)
+            scans.append(("Domain", dom, dom, verdict))
 
-        notify_cybersecurity({
-            "incident_id": incident["id"],
-            "report_type": "automatic",
-            "severity": severity,
-            "indicators": indicators
-        })
+        for ip in found["ips"]:
+            scans.append(("IP address", ip, ip, scan_ip(ip, deadline=deadline)))
 
-        filename = os.path.basename(pdf_path)
+        for attachment in attachments:
+            scans.append(("Attachment", attachment.filename, attachment.filename, scan_attachment(attachment, deadline)))
 
-        scan_results = "\n\n".join(messages)
-
-        message = (
-            f"{scan_results}\n\n"
-            f"{warning_text}\n\n"
-            f"As a precaution, an incident report has been automatically generated "
-            f"and sent to Cybersecurity team for review.\n\n"
-            f"- **Incident ID**: {incident['id']}\n\n"
-            f"- **Severity**: {severity.capitalize()}\n\n"
-            f"Please avoid interacting with the suspicious or unverified URL, domain, "
-            f"or file until it has been reviewed.\n\n"
-            f"You can download the incident report "
-            f"[here](/download/{filename})."
-        )
+        try:
+            messages, malicious_indicators, unverified_indicators = await run_scans(scans)
+        finally:
+            close_attachments(attachments)
 
-        return JSONResponse({
-            "message": message,
-            "download_url": f"/download/{filename}",
-            "incident_id": incident["id"]
-        })
+    # If anything malicious is detected, generate a PDF incident report automatically, notify security team and create an incident for malicious or unverified indicators.
+        if malicious_indicators or unverified_indicators:
+            result = await asyncio.to_thread(scan_incident_result, messages, malicious_indicators, unverified_indicators)
+            return JSONResponse(result)
     
     # Block requests to scan internal company domains.
     if (
@@ -587,32 +631,34 @@ async def chat(req: Request):
 
         return "\n\n".join(messages)
 
-    classification_raw = classify_incident(user_input, session_id)
+    # Decide the obvious cases locally and only ask the LLM when unsure.
+    classification = incident_preclassifier.classify(user_input)
 
-    try:
-        classification_clean = classification_raw.strip()
+    if classification is None:
+        classification_raw = await classify_incident(user_input, session_id)
 
-        if classification_clean.startswith("```json"):
-            classification_clean = classification_clean.replace("```json", "").replace("```", "").strip()
-        elif classification_clean.startswith("```"):
-            classification_clean = classification_clean.replace("```", "").strip()
+        try:
+            classification_clean = classification_raw.strip()
 
-        classification = json.loads(classification_clean)
+            if classification_clean.startswith("```json"):
+                classification_clean = classification_clean.replace("```json", "").replace("```", "").strip()
+            elif classification_clean.startswith("```"):
+                classification_clean = classification_clean.replace("```", "").strip()
 
-    except Exception as e:
-        classification = {"create_incident": False}
+            classification = json.loads(classification_clean)
+
+        except Exception as e:
+            classification = {"create_incident": False}
             
     if classification.get("create_incident"):
-        group = classify_group(user_input)
-
-        first_question = generate_triage_response(
+        first_question = await generate_triage_response(
             group,
             [user_input],
             user_input,
             session_id
         )
 
-        triage_state[session_id] = {
+        await triage_state.asave(session_id, {
             "group": group,
             "answers": [user_input],
             "conversation": [
@@ -621,154 +667,192 @@ async def chat(req: Request):
             ],
             "question_count": 1,
             "stage": "asking"
-        }
+        })
 
         return first_question
     
     # Reuse a cached response if available.
-    if cache_key in response_cache:
+    cached_reply = response_cache.get(cache_key)
+
+    if cached_reply is not None:
         print("CACHE HIT:", cache_key)
-        return response_cache[cache_key].replace("[REFUSAL]", "").strip()
+        return cached_reply.replace("[REFUSAL]", "").strip()
 
-    llm_reply = ask_openai(safe_user_input, session_id=session_id)
+    # Reuse the answer to a very similar question in the same group.
+    match = semantic_cache.lookup(group, safe_user_input)
 
-    reply_lower = llm_reply.lower()
-    
-    if "[refusal]" in reply_lower:
-        refusal_count[session_id] += 1
+    if match:
+        similar_key, score = match
+        cached_reply = response_cache.get(similar_key)
 
-        if refusal_count[session_id] >= THRESHOLD:
-            return WARNING_MESSAGE
-    
-    llm_reply = llm_reply.replace("[REFUSAL]", "").strip()
-    response_cache[cache_key] = llm_reply
+        if cached_reply is not None:
+            print(f"SEMANTIC CACHE HIT ({score:.2f}):", similar_key)
+            return cached_reply.replace("[REFUSAL]", "").strip()
 
-    chat_sessions[session_id].append({
-        "sender": "bot",
-        "message": llm_reply
-        })
-        
-    return llm_reply
+        semantic_cache.discard(group, similar_key)
+
+    if stream:
+        return StreamingResponse(
+            stream_llm_reply(safe_user_input, session_id, cache_key, group),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    llm_reply = await ask_openai_async(safe_user_input, session_id=session_id, group=group)
+
+    return await finish_llm_reply(llm_reply, session_id, cache_key, safe_user_input, group)
     
+# Returns response cache counters
+@app.get("/cache/stats")
+async def cache_stats():
+    return {
+        "exact": response_cache.stats(),
+        "semantic": semantic_cache.stats(),
+        "virustotal": verdict_cache.stats()
+    }
+
+# Returns how many incident classification LLM calls were avoided
+@app.get("/classifier/stats")
+async def classifier_stats():
+    return incident_preclassifier.stats()
+
+# Returns VirusTotal quota usage, queue depth, waiting times and circuit breaker state
+@app.get("/virustotal/stats")
+async def virustotal_stats():
+    return {
+        "scheduler": vt_scheduler.stats(),
+        "circuit_breaker": vt_breaker.stats(),
+        "rescan_queue": len(rescan_queue),
+        "scan_jobs": scan_jobs.stats()
+    }
+
+# Returns session counters
+@app.get("/sessions/stats")
+async def session_stats():
+    return session_manager.stats()
+
 # Returns previous chat history for a session
 @app.get("/history/{session_id}")
 async def get_history(session_id: str):
-    return chat_sessions[session_id]
-
-# To scan uploaded .eml files
-@app.post("/scan-email-file", response_class=PlainTextResponse)
-async def scan_email_file(email_file: UploadFile = File(...)):
+    return await chat_sessions.aget(session_id, [])
 
-    raw_bytes = await email_file.read()
-    urls, domains, attachments = parse_email(raw_bytes)
+INTERNAL_EMAIL_MESSAGE = (
+    "For security and privacy reasons, internal-domain messages cannot be scanned. "
+    "Please reach out to our IT support team at security@rxtra.sk993 for assistance."
+)
 
-    malicious_indicators = []
-    unverified_indicators = []
-    messages = []
+# if domain is rxtra.sk993 (internal domain), don't scan
+def email_is_internal(hosts: list) -> bool:
+    return any(host in INTERNAL_DOMAINS for host in hosts)
 
-  # if domain is rxtra.sk993 (internal domain), don't scan
-    for dom in domains:
-        if dom in INTERNAL_DOMAINS:
-            return "For security and privacy reasons, internal-domain messages cannot be scanned. Please reach out to our IT support team at security@rxtra.sk993 for assistance."
+# Attachments are mime_stream.Attachment objects, already hashed while the email was read.
+def scan_attachment(attachment, deadline: float):
+    return scan_file_attachment(attachment.filename, attachment.file, deadline=deadline, sha256=attachment.sha256)
 
-    for url in urls:
-        full_url = url if url.startswith("http") else "http://" + url
+# Build the scans for the indicators found in an uploaded email.
+# Domains and IP addresses that are the host of a URL are covered by the URL scan.
+# All scans share one deadline: scan_deadline() for a waiting request, job_deadline() for a background job.
+def email_scans(found: dict, attachments: list, deadline: float | None = None) -> list:
+    scans = []
+    deadline = deadline or scan_deadline()
 
-        verdict = scan_url(full_url)["verdict"]
-        messages.append(f"URL {url} → {verdict}.")
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"URL: {url}")
+    for url in found["urls"]:
+        scans.append(("URL", url, url, scan_url(url, deadline=deadline)))
 
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"URL: {full_url}")
+    for dom in found["domains"]:
+        scans.append(("Domain", dom, dom, scan_domain(dom, deadline=deadline)))
 
-    for dom in domains:
-        verdict = scan_domain(dom)["verdict"]
-        messages.append(f"Domain {dom} → {verdict}.")
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"Domain: {dom}")
+    for ip in found["ips"]:
+        scans.append(("IP address", ip, ip, scan_ip(ip, deadline=deadline)))
 
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"Domain: {dom}")
+    for attachment in attachments:
+        scans.append(("Attachment", attachment.filename, attachment.filename, scan_attachment(attachment, deadline)))
 
-    for fn, fb in attachments:
-        verdict = scan_file_attachment(fn, fb)["verdict"]
-        messages.append(f"Attachment {fn} → {verdict}.")
-        if verdict.startswith("Likely") or verdict == "Suspicious":
-            malicious_indicators.append(f"Attachment: {fn}")
-    
-        elif (verdict.startswith("Not found") or verdict.startswith("Unable to verify")):
-            unverified_indicators.append(f"Attachment: {fn}")
+    return scans
 
 # If anything malicious is detected, generate a PDF incident report automatically, notify security team and create an incident for malicious or unverified indicators.
-    if malicious_indicators or unverified_indicators:
+# messages are the scan result lines shown above the warning. Returns a dict (message, download_url, incident_id).
+def scan_incident_result(messages: list, malicious_indicators: list, unverified_indicators: list) -> dict:
+    if malicious_indicators:
+        severity = "high"
+        indicators = malicious_indicators
+        summary = "Malicious indicators detected during scan"
 
-        if malicious_indicators:
-            severity = "high"
-            indicators = malicious_indicators
-            summary = "Malicious indicators detected during scan"
-
-            warning_text = ("⚠️ A potential security threat was detected during the VirusTotal scan.")
+        warning_text = ("⚠️ A potential security threat was detected during the VirusTotal scan.")
 
     # VirusTotal could not confirm the indicator
-        else:
-            severity = "medium"
-            indicators = unverified_indicators
-            summary = "Unverified indicators detected during scan"
+    else:
+        severity = "medium"
+        indicators = unverified_indicators
+        summary = "Unverified indicators detected during scan"
 
-            warning_text = ("⚠️ The submitted indicator could not be verified using VirusTotal.")
+        warning_text = ("⚠️ The submitted indicator could not be verified using VirusTotal.")
 
-        incident = {
-            "id": f"INC{uuid.uuid4().hex[:8]}",
-            "summary": summary,
-            "details": ", ".join(indicators),
-            "department": "Cybersecurity",
-            "status": "open",
-            "created_at": datetime.utcnow().isoformat()
-        }
+    incident = {
+        "id": f"INC{uuid.uuid4().hex[:8]}",
+        "summary": summary,
+        "details": ", ".join(indicators),
+        "department": "Cybersecurity",
+        "status": "open",
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+    # Save incident permanently to Azure Blob Storage
+    save_incident(incident)
 
-        # Save incident permanently to Azure Blob Storage
-        save_incident(incident)
+    report_data = {
+        "incident_id": incident["id"],
+        "report_type": "automatic",
+        "summary": incident["summary"],
+        "severity": severity,
+        "indicators": indicators
+    }
 
-        report_data = {
-            "incident_id": incident["id"],
-            "report_type": "automatic",
-            "summary": incident["summary"],
-            "severity": severity,
-            "indicators": indicators
-        }
+    pdf_path, incident_id = generate_incident_pdf(report_data)
 
-        pdf_path, incident_id = generate_incident_pdf(report_data)
+    notify_cybersecurity({
+        "incident_id": incident["id"],
+        "report_type": "automatic",
+        "severity": severity,
+        "indicators": indicators
+    })
 
-        notify_cybersecurity({
-            "incident_id": incident["id"],
-            "report_type": "automatic",
-            "severity": severity,
-            "indicators": indicators
-        })
+    filename = os.path.basename(pdf_path)
 
-        filename = os.path.basename(pdf_path)
+    scan_results = "\n\n".join(messages)
+
+    message = (
+        f"{scan_results}\n\n"
+        f"{warning_text}\n\n"
+        f"As a precaution, an incident report has been automatically generated "
+        f"and routed to Cybersecurity for review.\n\n"
+        f"- **Incident ID**: {incident['id']}\n\n"
+        f"- **Severity**: {severity.capitalize()}\n\n"
+        f"Please avoid interacting with the suspicious or unverified URL, domain, "
+        f"or file until it has been reviewed.\n\n"
+        f"You can download the incident report "
+        f"[here](/download/{filename})."
+    )
 
-        scan_results = "\n\n".join(messages)
-
-        message = (
-            f"{scan_results}\n\n"
-            f"{warning_text}\n\n"
-            f"As a precaution, an incident report has been automatically generated "
-            f"and routed to Cybersecurity for review.\n\n"
-            f"- **Incident ID**: {incident['id']}\n\n"
-            f"- **Severity**: {severity.capitalize()}\n\n"
-            f"Please avoid interacting with the suspicious or unverified URL, domain, "
-            f"or file until it has been reviewed.\n\n"
-            f"You can download the incident report "
-            f"[here](/download/{filename})."
-        )
+    return {
+        "message": message,
+        "download_url": f"/download/{filename}",
+        "incident_id": incident["id"]
+    }
 
-        return JSONResponse({
-            "message": message,
-            "download_url": f"/download/{filename}",
-            "incident_id": incident["id"]
-        })
+# Indicators first scanned during a VirusTotal outage and found malicious or suspicious once it recovered.
+# flagged is a list of (label, name, verdict); they get one incident, PDF report and notification, as a live scan would.
+async def report_rescan_results(flagged: list):
+    messages = [f"{label} {name} → {verdict}." for label, name, verdict in flagged]
+    malicious_indicators = [f"{label}: {name}" for label, name, _ in flagged]
+
+    await asyncio.to_thread(scan_incident_result, messages, malicious_indicators, [])
+
+# Turn the scan results for an uploaded email into the reply.
+# Returns a dict (message, download_url, incident_id) when an incident was created, otherwise text.
+def email_scan_result(messages: list, malicious_indicators: list, unverified_indicators: list):
+    if malicious_indicators or unverified_indicators:
+        return scan_incident_result(messages, malicious_indicators, unverified_indicators)
     
     if not messages:
             return "No URLs, domains, or attachments found in that .eml."
@@ -779,6 +863,179 @@ async def scan_email_file(email_file: UploadFile = File(...)):
 
     return "\n\n".join(report_lines)
 
+
+# To scan uploaded .eml files
+@app.post("/scan-email-file", response_class=PlainTextResponse)
+async def scan_email_file(email_file: UploadFile = File(...)):
+
+    try:
+        spooled = await spool_upload(email_file)
+    except EmailTooLarge as e:
+        return PlainTextResponse(f"{e}.", status_code=413)
+
+    try:
+        found, attachments = await asyncio.to_thread(parse_email_file, spooled)
+    finally:
+        spooled.close()
+
+    try:
+        if email_is_internal(found["hosts"]):
+            return INTERNAL_EMAIL_MESSAGE
+
+        results = await run_scans(email_scans(found, attachments))
+    finally:
+        close_attachments(attachments)
+
+    # PDF generation and the incident upload block, so they run off the event loop.
+    result = await asyncio.to_thread(email_scan_result, *results)
+
+    return JSONResponse(result) if isinstance(result, dict) else result
+
+# Start a background scan of an uploaded .eml file and return its job ID straight away.
+@app.post("/scan-jobs", status_code=202)
+async def create_scan_job(email_file: UploadFile = File(...)):
+
+    # The upload is closed once this request returns, so the job reads its own spooled copy.
+    try:
+        spooled = await spool_upload(email_file)
+    except EmailTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": f"{e}."})
+
+    async def run(job):
+        try:
+            found, attachments = await asyncio.to_thread(parse_email_file, spooled)
+        finally:
+            spooled.close()
+
+        try:
+            if email_is_internal(found["hosts"]):
+                return INTERNAL_EMAIL_MESSAGE
+
+            results = await run_scans(await scan_jobs.track(job, email_scans(found, attachments, job_deadline())))
+        finally:
+            close_attachments(attachments)
+
+        # The incident is created once all scans are done; PDF generation and uploads block, so run them in a thread.
+        return await asyncio.to_thread(email_scan_result, *results)
+
+    job = await scan_jobs.submit(run)
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/scan-jobs/{job['job_id']}"
+    }
+
+# Turn the scan results for a batch of emails into one report: a verdict per message, then each unique indicator.
+# verdicts maps each scanned indicator's key to its verdict (see mailbox_batch.message_verdicts).
+# Returns a dict (message, messages, counts, and download_url and incident_id when an incident was created).
+def batch_scan_result(batch: dict, message_results: list, verdicts: dict, messages: list, malicious_indicators: list, unverified_indicators: list) -> dict:
+    unique = len(messages)
+
+    report_lines = [
+        f"Scanned {len(message_results)} messages: {batch['occurrences']} indicators found, "
+        f"{unique} unique {'indicator' if unique == 1 else 'indicators'} checked on VirusTotal."
+    ]
+
+    if batch["truncated"]:
+        report_lines.append(f"Only the first {len(message_results)} messages in the file were scanned.")
+
+    deferred = sum(1 for verdict in verdicts.values() if verdict_type(verdict) == "deferred")
+
+    if deferred:
+        report_lines.append(
+            f"{deferred} unique {'indicator was' if deferred == 1 else 'indicators were'} not scanned because the "
+            f"VirusTotal quota ran out or VirusTotal was unavailable; they are listed under each message. "
+            f"Please scan the file again later."
+        )
+
+    for i, result in enumerate(message_results, start=1):
+        subject = result["subject"] or "(no subject)"
+        line = f"{i}. **{subject}** from {result['sender'] or 'unknown sender'} → {result['verdict']}."
+
+        if result["flagged"]:
+            line += " Flagged: " + ", ".join(result["flagged"]) + "."
+
+        if result["deferred"]:
+            line += " Not scanned: " + ", ".join(result["deferred"]) + "."
+
+        report_lines.append(line)
+
+    if messages:
+        report_lines.append("Unique indicators:")
+        report_lines.extend(messages)
+
+    report = {
+        "messages": message_results,
+        "unique_indicators": unique,
+        "indicator_occurrences": batch["occurrences"],
+        "deferred_indicators": deferred,
+        "truncated": batch["truncated"]
+    }
+
+    if malicious_indicators or unverified_indicators:
+        return {**report, **scan_incident_result(report_lines, malicious_indicators, unverified_indicators)}
+
+    return {**report, "message": "\n\n".join(report_lines)}
+
+# Start a background scan of an .mbox file or a .zip of .eml files and return its job ID straight away.
+# Indicators are de-duplicated across the batch, so each unique URL, domain, IP address or file is scanned once.
+@app.post("/scan-batch", status_code=202)
+async def create_batch_scan_job(mailbox_file: UploadFile = File(...)):
+
+    try:
+        spooled = await spool_upload(mailbox_file, EML_MAX_BATCH_BYTES)
+    except EmailTooLarge as e:
+        return JSONResponse(status_code=413, content={"error": f"{e}."})
+
+    async def run(job):
+        try:
+            batch = await asyncio.to_thread(read_mailbox, spooled, email_is_internal)
+        finally:
+            spooled.close()
+
+        found = batch["found"]
+        attachments = batch["attachments"]
+        keys = scan_keys(found, attachments)
+        verdicts = {}
+
+        async def recorded(key, scan):
+            result = await scan
+            verdicts[key] = result["verdict"]
+            return result
+
+        try:
+            scans = [
+                (label, shown, recorded_name, recorded(key, scan))
+                for key, (label, shown, recorded_name, scan) in zip(keys, email_scans(found, attachments, job_deadline(len(keys))))
+            ]
+            results = await run_scans(await scan_jobs.track(job, scans))
+        finally:
+            close_attachments(attachments)
+
+        message_results = message_verdicts(batch, verdicts)
+
+        # PDF generation and uploads block, so the report (and any incident) is built in a thread.
+        return await asyncio.to_thread(batch_scan_result, batch, message_results, verdicts, *results)
+
+    job = await scan_jobs.submit(run)
+
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "status_url": f"/scan-jobs/{job['job_id']}"
+    }
+
+# Returns per-indicator progress and, once finished, the same result /scan-email-file would give
+@app.get("/scan-jobs/{job_id}")
+async def get_scan_job(job_id: str):
+    job = await call_store(session_store, scan_jobs.get, job_id)
+
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Scan job not found"})
+
+    return job
+
 # Open incident form page
 @app.get("/incident_form.html")
 async def incident_page():
@@ -808,10 +1065,11 @@ async def create_incident(request: Request):
             "created_at": datetime.utcnow().isoformat()
         }
 
-        save_incident(incident)
+        # The blob upload and the PDF are blocking work, so they run in a thread.
+        await asyncio.to_thread(save_incident, incident)
 
         # Generate downloadable PDF report
-        pdf_path, incident_id = generate_incident_pdf({
+        pdf_path, incident_id = await asyncio.to_thread(generate_incident_pdf, {
             "incident_id": incident["id"],
             "summary": incident["summary"],
             "details": incident["details"]
@@ -819,6 +1077,7 @@ async def create_incident(request: Request):
 
         filename = os.path.basename(pdf_path)
         session_id = data.get("session_id", "default")
+        await session_manager.atouch(session_id)
         incident_message = (
             f"Your incident has been successfully created and sent to the "
             f"{incident['department']} department!\n\n"
@@ -830,10 +1089,12 @@ async def create_incident(request: Request):
             f"In the meantime, you can download the PDF for your incident [here](/download/{filename})"
         )
 
-        chat_sessions[session_id].append({
+        history = await chat_sessions.aload(session_id)
+        history.append({
             "sender": "bot",
             "message": incident_message
         })
+        await chat_sessions.asave(session_id, history)
 
         print("Saved incident:", incident)
 
@@ -0,0 +1,437 @@
+# This file reads uploaded emails part by part from a file instead of loading them into memory.
+# Text and HTML parts are decoded and searched for indicators as they are read, and attachments are hashed
+# while they are copied to temporary files, so memory use per scan stays bounded however large the email is.
+import os
+import re
+import codecs
+import binascii
+import hashlib
+import zipfile
+import tempfile
+from email import policy
+from email.parser import BytesHeaderParser
+
+from indicators import IndicatorExtractor, link_parser
+
+# Uploads larger than this are refused.
+EML_MAX_UPLOAD_BYTES = int(os.getenv("EML_MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# Attachments larger than this are only looked up on VirusTotal by hash and never uploaded.
+EML_MAX_ATTACHMENT_BYTES = int(os.getenv("EML_MAX_ATTACHMENT_BYTES", str(10 * 1024 * 1024)))
+
+# Only the first this many attachments are kept for upload; later ones are looked up by hash.
+EML_MAX_ATTACHMENTS = int(os.getenv("EML_MAX_ATTACHMENTS", "20"))
+
+# Uploads and attachments are kept in memory up to this size, then moved to a temporary file on disk.
+EML_SPOOL_MEMORY_BYTES = int(os.getenv("EML_SPOOL_MEMORY_BYTES", str(1024 * 1024)))
+
+# A batch of emails (.mbox or .zip) may be larger than a single email, and hold at most this many messages.
+EML_MAX_BATCH_BYTES = int(os.getenv("EML_MAX_BATCH_BYTES", str(200 * 1024 * 1024)))
+EML_MAX_BATCH_MESSAGES = int(os.getenv("EML_MAX_BATCH_MESSAGES", "500"))
+
+# A zip is small compared with what it unpacks to, so the .eml files read from one zip may add up to at most this.
+EML_MAX_BATCH_EXPANDED_BYTES = int(os.getenv("EML_MAX_BATCH_EXPANDED_BYTES", str(500 * 1024 * 1024)))
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_LINE_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 256 * 1024
+
+HEADER_LINE = re.compile(rb'^[!-9;-~]+:')
+
+class EmailTooLarge(Exception):
+    pass
+
+# Copy an uploaded file (a FastAPI UploadFile) into a spooled temporary file, refusing it once it passes max_bytes.
+async def spool_upload(upload, max_bytes: int = EML_MAX_UPLOAD_BYTES):
+    spooled = tempfile.SpooledTemporaryFile(max_size=EML_SPOOL_MEMORY_BYTES)
+    size = 0
+
+    while chunk := await upload.read(READ_CHUNK_SIZE):
+        size += len(chunk)
+
+        if size > max_bytes:
+            spooled.close()
+            raise EmailTooLarge(f"Email files larger than {max_bytes // (1024 * 1024)} MB cannot be scanned")
+
+        spooled.write(chunk)
+
+    spooled.seek(0)
+    return spooled
+
+# An attachment read from an email. file holds its contents (positioned at the start), or is None if the
+# attachment was over the size or count limit; sha256 and size always cover the whole attachment.
+class Attachment:
+    def __init__(self, filename: str, keep: bool = True):
+        self.filename = filename
+        self.size = 0
+        self.sha256 = None
+        self.file = tempfile.SpooledTemporaryFile(max_size=EML_SPOOL_MEMORY_BYTES) if keep else None
+        self._digest = hashlib.sha256()
+
+    def write(self, data: bytes):
+        self.size += len(data)
+        self._digest.update(data)
+
+        if self.file is None:
+            return
+
+        if self.size > EML_MAX_ATTACHMENT_BYTES:
+            self.file.close()
+            self.file = None
+        else:
+            self.file.write(data)
+
+    def finish(self):
+        self.sha256 = self._digest.hexdigest()
+
+        if self.file is not None:
+            self.file.seek(0)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def close_attachments(attachments: list):
+    for attachment in attachments:
+        attachment.close()
+
+MBOX_QUOTED_FROM = re.compile(rb'^>+From ')
+
+# Split an mbox file into messages, copying each to a spooled temporary file as it is read.
+# Yields (name, file); each file is closed once the next message is requested.
+def iter_mbox(fileobj):
+    reader = LineReader(fileobj)
+    message = None
+    count = 0
+    previous_blank = True
+
+    while True:
+        line, starts = reader.readline()
+
+        if not line:
+            break
+
+        # A "From " line after a blank line starts the next message.
+        if starts and previous_blank and line.startswith(b"From "):
+            if message is not None:
+                message.seek(0)
+                yield f"message {count}", message
+                message.close()
+
+            message = tempfile.SpooledTemporaryFile(max_size=EML_SPOOL_MEMORY_BYTES)
+            count += 1
+            previous_blank = False
+            continue
+
+        # A file without "From " lines, such as a single .eml, is read as one message.
+        if message is None:
+            message = tempfile.SpooledTemporaryFile(max_size=EML_SPOOL_MEMORY_BYTES)
+            count += 1
+
+        if starts and MBOX_QUOTED_FROM.match(line):
+            line = line[1:]
+
+        message.write(line)
+        previous_blank = starts and line in (b"\n", b"\r\n")
+
+    if message is not None:
+        message.seek(0)
+        yield f"message {count}", message
+        message.close()
+
+# Reads lines from a zip member, stopping at the size the archive declares for it and counting every byte against
+# the budget for the whole zip. Raises EmailTooLarge once the budget is used up.
+class LimitedReader:
+    def __init__(self, fileobj, limit: int, budget: dict):
+        self.fileobj = fileobj
+        self.remaining = limit
+        self.budget = budget
+
+    def readline(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+
+        line = self.fileobj.readline(size)
+        self.remaining -= len(line)
+        self.budget["remaining"] -= len(line)
+
+        if self.budget["remaining"] < 0:
+            raise EmailTooLarge(f"Archives that unpack to more than {EML_MAX_BATCH_EXPANDED_BYTES // (1024 * 1024)} MB cannot be scanned")
+
+        return line
+
+# Yield (name, file) for each .eml file in a zip archive, read straight from the archive.
+# Files larger than EML_MAX_UPLOAD_BYTES and macOS metadata files are skipped, and reading stops with
+# EmailTooLarge once the files read add up to more than max_expanded_bytes.
+def iter_zip(fileobj, max_expanded_bytes: int = EML_MAX_BATCH_EXPANDED_BYTES):
+    budget = {"remaining": max_expanded_bytes}
+
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            basename = name.rsplit("/", 1)[-1]
+
+            if info.is_dir() or not basename.lower().endswith(".eml") or basename.startswith("._"):
+                continue
+
+            if "__MACOSX/" in name or info.file_size > EML_MAX_UPLOAD_BYTES:
+                continue
+
+            with archive.open(info) as message:
+                yield name, LimitedReader(message, info.file_size, budget)
+
+# Yield (name, file) for each message in an uploaded .zip of .eml files or an .mbox file.
+# An mbox is read as uploaded, so it is already limited by the upload size.
+def iter_mailbox(fileobj):
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        yield from iter_zip(fileobj)
+    else:
+        fileobj.seek(0)
+        yield from iter_mbox(fileobj)
+
+# Undoes the Content-Transfer-Encoding of a part in pieces. Bytes that cannot be decoded yet
+# (part of a base64 group or of a quoted-printable escape) are held until the next piece.
+class TransferDecoder:
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        self._pending = b""
+
+    def decode(self, data: bytes) -> bytes:
+        if self.encoding == "base64":
+            data = self._pending + re.sub(rb'[^A-Za-z0-9+/=]', b"", data)
+            usable = len(data) - len(data) % 4
+            self._pending = data[usable:]
+
+            try:
+                return binascii.a2b_base64(data[:usable])
+            except binascii.Error:
+                return b""
+
+        if self.encoding == "quoted-printable":
+            data = self._pending + data
+            escape = data.rfind(b"=", max(len(data) - 2, 0))
+            self._pending = data[escape:] if escape >= 0 else b""
+
+            return binascii.a2b_qp(data[:escape] if escape >= 0 else data)
+
+        return data
+
+    def finish(self) -> bytes:
+        data, self._pending = self._pending, b""
+
+        if self.encoding == "quoted-printable":
+            return binascii.a2b_qp(data)
+
+        return b""
+
+# Decodes a text or HTML part and passes the text on as it arrives.
+class TextPart:
+    def __init__(self, headers, on_text, on_finish):
+        self.transfer = TransferDecoder(transfer_encoding(headers))
+        self.on_text = on_text
+        self.on_finish = on_finish
+
+        try:
+            self.text = codecs.getincrementaldecoder(headers.get_content_charset() or "utf-8")(errors="replace")
+        except LookupError:
+            self.text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def write(self, data: bytes):
+        text = self.text.decode(self.transfer.decode(data))
+
+        if text:
+            self.on_text(text)
+
+    def finish(self):
+        text = self.text.decode(self.transfer.finish(), final=True)
+
+        if text:
+            self.on_text(text)
+
+        self.on_finish()
+
+class AttachmentPart:
+    def __init__(self, headers, attachment: Attachment):
+        self.transfer = TransferDecoder(transfer_encoding(headers))
+        self.attachment = attachment
+
+    def write(self, data: bytes):
+        self.attachment.write(self.transfer.decode(data))
+
+    def finish(self):
+        self.attachment.write(self.transfer.finish())
+        self.attachment.finish()
+
+def transfer_encoding(headers) -> str:
+    return str(headers.get("content-transfer-encoding", "7bit")).strip().lower()
+
+# Reads a binary file in lines of at most MAX_LINE_BYTES, remembering whether each one starts a new line,
+# and allows one line to be put back.
+class LineReader:
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.line_start = True
+        self._unread = None
+
+    # Returns (line, True if the line starts a new line rather than continuing a long one).
+    def readline(self):
+        if self._unread is not None:
+            item, self._unread = self._unread, None
+            return item
+
+        line = self.fileobj.readline(MAX_LINE_BYTES)
+        starts = self.line_start
+        self.line_start = line.endswith(b"\n")
+
+        return line, starts
+
+    def unread(self, item):
+        self._unread = item
+
+# Read a header block up to the blank line that ends it. Text that does not look like a header
+# (for example a chat message pasted without headers) is left to be read as the body.
+def read_headers(reader: LineReader):
+    lines = []
+    size = 0
+
+    while True:
+        line, starts = reader.readline()
+
+        if not line or (starts and line in (b"\r\n", b"\n")):
+            break
+
+        if not starts or not (HEADER_LINE.match(line) or (lines and line[:1] in (b" ", b"\t"))):
+            reader.unread((line, starts))
+            break
+
+        size += len(line)
+
+        if size <= MAX_HEADER_BYTES:
+            lines.append(line)
+
+    return BytesHeaderParser(policy=policy.default).parsebytes(b"".join(lines))
+
+def split_newline(line: bytes) -> tuple:
+    if line.endswith(b"\r\n"):
+        return line[:-2], b"\r\n"
+
+    if line.endswith(b"\n"):
+        return line[:-1], b"\n"
+
+    return line, b""
+
+# Read an email from a binary file object. Returns the IndicatorExtractor result (see indicators.py) and a list
+# of Attachment objects; call close_attachments() when done with them. Pass an extractor to add to indicators
+# already found elsewhere, and on_headers to receive the email's own headers (an email.message.Message).
+def parse_email_file(fileobj, extractor=None, on_headers=None):
+    extractor = extractor or IndicatorExtractor()
+    reader = LineReader(fileobj)
+    boundaries = []
+    attachments = []
+
+    def start_part(headers):
+        ctype = headers.get_content_type()
+
+        if ctype.startswith("multipart/"):
+            boundary = headers.get_param("boundary")
+
+            if boundary:
+                boundaries.append(b"--" + str(boundary).encode("utf-8", "replace"))
+
+            return None
+
+        # A forwarded email: its own headers follow straight away.
+        if ctype == "message/rfc822":
+            return start_part(read_headers(reader))
+
+        filename = headers.get_filename()
+
+        if filename and (headers.get_content_disposition() == "attachment" or ctype not in ("text/plain", "text/html")):
+            attachment = Attachment(filename, keep=len([a for a in attachments if a.file]) < EML_MAX_ATTACHMENTS)
+            attachments.append(attachment)
+            return AttachmentPart(headers, attachment)
+
+        if ctype == "text/plain":
+            return TextPart(headers, extractor.feed_partial, extractor.flush)
+
+        # Links, form targets and the hosts of images are taken from HTML parts.
+        if ctype == "text/html":
+            parser = link_parser(extractor.add_url, extractor.add_resource)
+            return TextPart(headers, parser.feed, parser.close)
+
+        return None
+
+    headers = read_headers(reader)
+
+    if on_headers is not None:
+        on_headers(headers)
+
+    part = start_part(headers)
+
+    # Lines of the current part are passed on in batches. The newline at the end of a batch is held back,
+    # because the newline before a boundary belongs to the boundary, not to the part.
+    batch = []
+    batch_size = 0
+    held_newline = b""
+
+    def write_batch(before_boundary: bool):
+        nonlocal batch_size, held_newline
+
+        data = held_newline + b"".join(batch)
+        batch.clear()
+        batch_size = 0
+        held_newline = b""
+
+        if before_boundary:
+            data, _ = split_newline(data)
+        else:
+            data, held_newline = split_newline(data)
+
+        if part is not None:
+            part.write(data)
+
+    while True:
+        line, starts = reader.readline()
+
+        if not line:
+            break
+
+        if starts and boundaries and line.startswith(b"--"):
+            delimiter = line.rstrip()
+            depth = len(boundaries) - 1
+
+            while depth >= 0 and delimiter not in (boundaries[depth], boundaries[depth] + b"--"):
+                depth -= 1
+
+            if depth >= 0:
+                write_batch(before_boundary=True)
+
+                if part is not None:
+                    part.finish()
+
+                if delimiter == boundaries[depth]:
+                    del boundaries[depth + 1:]
+                    part = start_part(read_headers(reader))
+                else:
+                    del boundaries[depth:]
+                    part = None
+
+                continue
+
+        if part is not None:
+            batch.append(line)
+            batch_size += len(line)
+
+            if batch_size >= READ_CHUNK_SIZE:
+                write_batch(before_boundary=False)
+
+    if part is not None:
+        part.write(held_newline + b"".join(batch))
+        part.finish()
+
+    return extractor.result(), attachments
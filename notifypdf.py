@@ -1,8 +1,7 @@
-import os
 import csv
 import io
 from datetime import datetime
-from azure.storage.blob import BlobServiceClient
+from http_clients import get_blob_service_client
 
 # Azure CSV storage location.
 CONTAINER_NAME = "smeincidents"
@@ -11,17 +10,13 @@ BLOB_NAME = "Logs/virustotal_incident.csv"
 # Record VirusTotal incidents in Azure.
 def notify_cybersecurity(meta: dict):
     try:
-        connection_string = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
+# Reuse the shared Azure Blob Storage client.
+        blob_service_client = get_blob_service_client()
 
-        if not connection_string:
+        if blob_service_client is None:
             print("Azure Storage connection string missing.")
             return
 
-# Connect to Azure Blob Storage.
-        blob_service_client = BlobServiceClient.from_connection_string(
-            connection_string
-        )
-
         blob_client = blob_service_client.get_blob_client(
             container=CONTAINER_NAME,
             blob=BLOB_NAME
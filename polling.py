@@ -0,0 +1,35 @@
+# This file waits for long-running VirusTotal analyses to finish.
+# The first check is made after about a second, then the wait doubles (with some randomness) until the deadline.
+import os
+import time
+import random
+import asyncio
+
+POLL_INITIAL_DELAY = float(os.getenv("POLL_INITIAL_DELAY_SECONDS", "1"))
+POLL_MAX_DELAY = float(os.getenv("POLL_MAX_DELAY_SECONDS", "8"))
+POLL_BACKOFF = 2.0
+
+# Delays between checks: about 1 s, 2 s, 4 s, ... up to the maximum. Each delay is shortened by up to a fifth
+# at random, so scans started together do not all poll VirusTotal at the same moment.
+def poll_delays(initial: float = POLL_INITIAL_DELAY, maximum: float = POLL_MAX_DELAY, factor: float = POLL_BACKOFF):
+    step = initial
+
+    while True:
+        yield random.uniform(step * 0.8, step)
+        step = min(step * factor, maximum)
+
+# Call check() until it returns a result, or return None once the deadline (a time.monotonic() value) passes.
+# check is an async function that returns None while the analysis is still running.
+async def poll_until(check, deadline: float, delays=None):
+    for delay in delays or poll_delays():
+        remaining = deadline - time.monotonic()
+
+        if remaining <= 0:
+            return None
+
+        await asyncio.sleep(min(delay, remaining))
+
+        result = await check()
+
+        if result is not None:
+            return result
@@ -0,0 +1,59 @@
+# This file removes personal information from text before it is sent to the LLM or stored.
+# All patterns are compiled once into a single expression, so the text is scanned in one pass.
+import re
+
+# Patterns used to detect personal information. Every repeat is bounded, so the work done at each
+# position in the text is limited and the total time grows linearly with the length of the text.
+# Matches must start at the beginning of a word; this is checked once for all patterns below.
+# Every match also has a digit within its first three characters ("4", "07", "+44", "AB1"). That is checked first,
+# so text without digits (prose, runs of separators) is ruled out at each position before any pattern is tried.
+PI_PATTERNS = {
+    "UK_PHONE": r"(?:\+44|0)\d{10,11}\b",
+    "CREDIT_CARD": r"\d(?:[ -]?\d){12,15}\b",
+    "NI_NUMBER": r"[A-CEGHJ-PR-TW-Z]{2}\d{6}[A-D]\b",
+    "PASSPORT_LIKE_ID": r"[A-Z]{1,2}\d{6,9}\b"
+}
+
+PI_REGEX = re.compile(
+    r"(?=[+A-Z]{0,2}\d)(?<![\w+])(?:" + "|".join(f"(?P<{label}>{pattern})" for label, pattern in PI_PATTERNS.items()) + ")",
+    re.IGNORECASE
+)
+
+# Luhn checksum used by payment card numbers. Digit runs that fail it are not card numbers.
+# Every second digit from the right is doubled (digits of the result added), done here with one translate.
+LUHN_DOUBLED = str.maketrans("0123456789", "0246813579")
+
+def luhn_valid(number: str) -> bool:
+    digits = number.replace(" ", "").replace("-", "")
+
+    # Summing the ASCII codes avoids converting each digit to int; 48 is the code of "0".
+    total = sum(digits[-1::-2].encode()) + sum(digits[-2::-2].translate(LUHN_DOUBLED).encode())
+
+    return (total - 48 * len(digits)) % 10 == 0
+
+def _replace(match) -> str:
+    label = match.lastgroup
+
+    if label == "CREDIT_CARD" and not luhn_valid(match.group()):
+        return match.group()
+
+    return f"[REDACTED_{label}]"
+
+# Remove personal information before processing.
+def redact_pi(text: str) -> str:
+    if not text:
+        return text
+
+    return PI_REGEX.sub(_replace, text)
+
+# Return (label, matched text) for each piece of personal information found.
+def find_pi(text: str) -> list:
+    found = []
+
+    for match in PI_REGEX.finditer(text or ""):
+        if match.lastgroup == "CREDIT_CARD" and not luhn_valid(match.group()):
+            continue
+
+        found.append((match.lastgroup, match.group()))
+
+    return found
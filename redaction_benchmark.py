@@ -0,0 +1,65 @@
+# This file measures personal information redaction on 1 KB, 100 KB and 1 MB inputs.
+# It compares the single-pass engine in redaction.py with the previous one-pattern-at-a-time version.
+
+import re
+import time
+
+from redaction import redact_pi
+
+SIZES = [("1 KB", 1024), ("100 KB", 100 * 1024), ("1 MB", 1024 * 1024)]
+
+PREVIOUS_PI_PATTERNS = {
+    "NI_NUMBER": r"\b[A-CEGHJ-PR-TW-Z]{2}\d{6}[A-D]\b",
+    "UK_PHONE": r"\b(?:\+44|0)\d{10,11}\b",
+    "CREDIT_CARD": r"\b(?:\d[ -]*?){13,16}\b",
+    "PASSPORT_LIKE_ID": r"\b[A-Z]{1,2}\d{6,9}\b"
+}
+
+# A pasted chat message with some personal information in it.
+CHAT_TEXT = (
+    "Hi, my laptop was stolen on the train this morning. My NI number is AB123456C and you can "
+    "call me on 07123456789. I had saved my card 4111 1111 1111 1111 in the browser. "
+)
+
+# Pasted log output: long runs of digits and separators.
+LOG_TEXT = "2024-05-01 12:00:01 id 1234 5678 9012 3456 7890 1234 5678 9012 - - - 0 0 0 0 0 0 0 0 0 0 0 0 0 0 "
+
+# Digits separated by long runs of spaces and dashes, which the previous card pattern scanned across.
+ADVERSARIAL_TEXT = "7" + " -" * 100
+
+
+# The redaction used before the patterns were combined.
+def previous_redact_pi(text):
+    redacted = text
+
+    for label, pattern in PREVIOUS_PI_PATTERNS.items():
+        redacted = re.sub(pattern, f"[REDACTED_{label}]", redacted, flags=re.IGNORECASE)
+
+    return redacted
+
+
+def make_input(sample, size):
+    return (sample * (size // len(sample) + 1))[:size]
+
+
+def timed(function, text):
+    start = time.perf_counter()
+    function(text)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    for name, sample in [("Chat text", CHAT_TEXT), ("Log text (digit runs)", LOG_TEXT), ("Adversarial separators", ADVERSARIAL_TEXT)]:
+        print(name)
+
+        for label, size in SIZES:
+            text = make_input(sample, size)
+
+            print(
+                f"  {label:7} previous: {timed(previous_redact_pi, text):9.2f} ms   "
+                f"single pass: {timed(redact_pi, text):9.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
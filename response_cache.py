@@ -0,0 +1,87 @@
+# This file provides the bounded response cache used by the chatbot.
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Stores chatbot replies with a size limit (least recently used entries are removed first) and an expiry time.
+class ResponseCache:
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    # Return the cached reply, or None if it is missing or expired.
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: str, ttl_seconds: float | None = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# Short hash used to tie cache keys to the current prompt and company context.
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+
+    return digest.hexdigest()[:16]
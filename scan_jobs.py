@@ -0,0 +1,150 @@
+# This file runs email scans in the background, so an upload returns a job ID straight away
+# instead of holding the HTTP request open while VirusTotal is queried.
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from session_store import call_store
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Session store namespace holding each job, keyed by job ID.
+JOBS_NAMESPACE = "scan_jobs"
+
+# Runs at most `workers` jobs at the same time in this worker. Job progress is saved to the session store, so any
+# uvicorn worker can answer /scan-jobs/{job_id}; the jobs this worker started are also kept in memory for stats
+# and clean-up.
+class ScanJobs:
+    def __init__(self, store, workers: int = 4, ttl_seconds: float = 3600, max_jobs: int = 1000):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.max_jobs = max_jobs
+
+        self._jobs = OrderedDict()
+        self._tasks = {}
+        self._workers = asyncio.Semaphore(workers)
+
+        self.submitted = 0
+        self.failed = 0
+
+    # Start a job. run is an async function taking the job dict and returning the final result.
+    async def submit(self, run) -> dict:
+        await call_store(self.store, self._purge)
+
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "created_at": time.time(),
+            "finished_at": None,
+            "indicators": [],
+            "result": None,
+            "error": None
+        }
+
+        self._jobs[job["job_id"]] = job
+        await self._asave(job)
+        self._tasks[job["job_id"]] = asyncio.create_task(self._run(job, run))
+        self.submitted += 1
+
+        return job
+
+    async def _run(self, job: dict, run):
+        try:
+            async with self._workers:
+                job["status"] = RUNNING
+                await self._asave(job)
+                job["result"] = await run(job)
+                job["status"] = COMPLETED
+        except Exception as e:
+            print(f"Scan job {job['job_id']} failed: {e}")
+            job["status"] = FAILED
+            job["error"] = "The scan could not be completed. Please try again."
+            self.failed += 1
+        finally:
+            job["finished_at"] = time.time()
+            self._tasks.pop(job["job_id"], None)
+            await self._asave(job)
+
+    # Jobs are stored like sessions, so a job left behind by a worker that stopped expires with idle sessions.
+    def _save(self, job: dict):
+        try:
+            self.store.set(JOBS_NAMESPACE, job["job_id"], job)
+            self.store.touch(job["job_id"])
+        except Exception as e:
+            print(f"Could not save scan job {job['job_id']}: {e}")
+
+    # Shared stores save in a thread, so they get a copy the event loop will not change while it is written.
+    async def _asave(self, job: dict):
+        snapshot = {**job, "indicators": [dict(indicator) for indicator in job["indicators"]]}
+        await call_store(self.store, self._save, snapshot)
+
+    # Record the indicators a job will scan, and wrap each scan so its verdict is recorded as soon as it is known.
+    # scans are (label, name shown to the user, name recorded in the incident, coroutine) as used by main.run_scans.
+    async def track(self, job: dict, scans: list) -> list:
+        job["indicators"] = [{"type": label, "name": shown, "verdict": None} for label, shown, _, _ in scans]
+        await self._asave(job)
+
+        async def tracked(index: int, scan):
+            result = await scan
+            job["indicators"][index]["verdict"] = result["verdict"]
+            await self._asave(job)
+            return result
+
+        return [
+            (label, shown, recorded, tracked(index, scan))
+            for index, (label, shown, recorded, scan) in enumerate(scans)
+        ]
+
+    # Look a job up in the session store, wherever it is running. Async code calls it through call_store.
+    def get(self, job_id: str):
+        job = self.store.get(JOBS_NAMESPACE, job_id)
+
+        if job is None:
+            return None
+
+        return {
+            **job,
+            "completed": sum(1 for indicator in job["indicators"] if indicator["verdict"] is not None),
+            "total": len(job["indicators"])
+        }
+
+    # Forget finished jobs after ttl_seconds, and the oldest finished jobs once there are too many.
+    def _purge(self):
+        cutoff = time.time() - self.ttl_seconds
+
+        for job_id, job in list(self._jobs.items()):
+            if job["finished_at"] is not None and job["finished_at"] < cutoff:
+                self._forget(job_id)
+
+        for job_id, job in list(self._jobs.items()):
+            if len(self._jobs) < self.max_jobs:
+                break
+
+            if job["finished_at"] is not None:
+                self._forget(job_id)
+
+    def _forget(self, job_id: str):
+        del self._jobs[job_id]
+
+        try:
+            self.store.delete_session(job_id)
+        except Exception as e:
+            print(f"Could not delete scan job {job_id}: {e}")
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+
+    def stats(self) -> dict:
+        statuses = [job["status"] for job in self._jobs.values()]
+
+        return {
+            "jobs": len(statuses),
+            "queued": statuses.count(QUEUED),
+            "running": statuses.count(RUNNING),
+            "submitted": self.submitted,
+            "failed": self.failed
+        }
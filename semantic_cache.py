@@ -0,0 +1,250 @@
+# This file lets the chatbot reuse cached answers for paraphrased questions.
+# It uses a local TF-IDF index so no network call is needed.
+import re
+import math
+import threading
+from itertools import islice
+from collections import OrderedDict, defaultdict
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+
+# Common words that do not change the meaning of a security question.
+STOPWORDS = {
+    "a", "an", "the", "i", "me", "my", "we", "our", "you", "your", "it", "is", "are",
+    "was", "be", "to", "of", "in", "on", "for", "and", "or", "do", "does", "did",
+    "how", "what", "can", "could", "should", "would", "please", "with", "at", "this",
+    "that", "there", "any", "some", "if", "so", "by", "from", "about", "am", "have",
+    "has", "get", "need", "want", "tell", "explain", "steps", "step", "way", "ways"
+}
+
+# Words that change what is being asked even though they carry little weight in TF-IDF. Two questions only match
+# if they contain the same negations, the same question words when both have any ("How do I change my password"
+# is not "How often should I change my password"), and the same modal verbs when both have any.
+NEGATIONS = {"not", "no", "never", "without", "nothing", "none", "nobody"}
+QUESTION_WORDS = {"how", "what", "when", "where", "why", "who", "which", "whose", "often"}
+MODAL_WORDS = {"can", "could", "should", "would", "must", "may"}
+
+CONTRACTIONS = re.compile(r"\b(?:can'?t|cannot|won't)\b|n't\b")
+
+def expand_contraction(match) -> str:
+    word = match.group(0)
+
+    if word.startswith("ca"):
+        return "can not"
+    if word.startswith("wo"):
+        return "will not"
+
+    return " not"
+
+def words(text: str) -> list:
+    return TOKEN_REGEX.findall(CONTRACTIONS.sub(expand_contraction, text.lower().replace("’", "'")))
+
+# Cut simple word endings so "resetting" and "reset" count as the same word.
+def stem(word: str) -> str:
+    for suffix in ("ing", "ed", "es", "s"):
+        if len(word) > len(suffix) + 2 and word.endswith(suffix):
+            word = word[: -len(suffix)]
+
+            # "resett" -> "reset"
+            if suffix in ("ing", "ed") and len(word) > 3 and word[-1] == word[-2]:
+                word = word[:-1]
+
+            return word
+    return word
+
+def tokenize(text: str) -> dict:
+    counts = defaultdict(int)
+
+    for word in words(text):
+        if word not in STOPWORDS:
+            counts[stem(word)] += 1
+
+    return dict(counts)
+
+# The negations, question words and modal verbs in a question, which must agree for two questions to match.
+def must_match(text: str) -> tuple:
+    found = set(words(text))
+    return frozenset(found & NEGATIONS), frozenset(found & QUESTION_WORDS), frozenset(found & MODAL_WORDS)
+
+def compatible(first: tuple, second: tuple) -> bool:
+    negations, questions, modals = first
+    other_negations, other_questions, other_modals = second
+
+    if negations != other_negations:
+        return False
+
+    if questions and other_questions and questions != other_questions:
+        return False
+
+    return not modals or not other_modals or modals == other_modals
+
+# TF-IDF index for one question group.
+class _GroupIndex:
+    def __init__(self):
+        self.entries = OrderedDict()   # entry id -> (term counts, cache key, must_match words)
+        self.postings = defaultdict(set)
+        self.doc_freq = defaultdict(int)
+
+    def add(self, entry_id: int, terms: dict, cache_key: str, required: tuple):
+        self.entries[entry_id] = (terms, cache_key, required)
+
+        for term in terms:
+            self.postings[term].add(entry_id)
+            self.doc_freq[term] += 1
+
+    def remove(self, entry_id: int):
+        terms, _, _ = self.entries.pop(entry_id)
+
+        for term in terms:
+            self.postings[term].discard(entry_id)
+            self.doc_freq[term] -= 1
+
+            if self.doc_freq[term] <= 0:
+                del self.doc_freq[term]
+                del self.postings[term]
+
+    # Inverse document frequency: rare words get a higher weight.
+    def idf(self, term: str) -> float:
+        return math.log((len(self.entries) + 1) / (1 + self.doc_freq.get(term, 0))) + 1
+
+# Finds the closest cached question in the same group and returns its response cache key.
+class SemanticCache:
+    def __init__(self, threshold: float = 0.9, max_entries: int = 100000, max_candidates: int = 500):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.max_candidates = max_candidates
+
+        self._groups = defaultdict(_GroupIndex)
+        self._order = OrderedDict()   # entry id -> group, oldest first
+        self._keys = {}   # (group, cache key) -> entry id
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, group: str, question: str, cache_key: str):
+        terms = tokenize(question)
+
+        if not terms:
+            return
+
+        with self._lock:
+            if (group, cache_key) in self._keys:
+                return
+
+            entry_id = self._next_id
+            self._next_id += 1
+
+            self._groups[group].add(entry_id, terms, cache_key, must_match(question))
+            self._order[entry_id] = group
+            self._keys[(group, cache_key)] = entry_id
+
+            while len(self._order) > self.max_entries:
+                old_id, old_group = self._order.popitem(last=False)
+                self._drop(old_group, old_id)
+
+    # Remove an entry whose cached answer has expired.
+    def discard(self, group: str, cache_key: str):
+        with self._lock:
+            entry_id = self._keys.get((group, cache_key))
+
+            if entry_id is not None:
+                self._order.pop(entry_id, None)
+                self._drop(group, entry_id)
+
+    def _drop(self, group: str, entry_id: int):
+        index = self._groups[group]
+        _, cache_key, _ = index.entries[entry_id]
+
+        index.remove(entry_id)
+        self._keys.pop((group, cache_key), None)
+
+    # Return (cache key, similarity) for the best match above the threshold, otherwise None.
+    def lookup(self, group: str, question: str):
+        terms = tokenize(question)
+        required = must_match(question)
+
+        with self._lock:
+            index = self._groups.get(group)
+
+            if not terms or index is None or not index.entries:
+                self.misses += 1
+                return None
+
+            idf = {}
+
+            def weight(term, count):
+                if term not in idf:
+                    idf[term] = index.idf(term)
+                return count * idf[term]
+
+            query = {term: weight(term, count) for term, count in terms.items()}
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+
+            # Collect candidates from the rarest words first, as they say the most about the question.
+            # Very common words are only used when nothing rarer matched, and then only up to the limit.
+            candidates = set()
+
+            for term in sorted(query, key=lambda t: -query[t]):
+                postings = index.postings.get(term)
+
+                if not postings:
+                    continue
+
+                if candidates and len(postings) > self.max_candidates:
+                    break
+
+                candidates.update(islice(postings, self.max_candidates - len(candidates)))
+
+                if len(candidates) >= self.max_candidates:
+                    break
+
+            best_key = None
+            best_score = 0.0
+
+            for entry_id in candidates:
+                entry_terms, cache_key, entry_required = index.entries[entry_id]
+
+                if not compatible(required, entry_required):
+                    continue
+
+                dot = 0.0
+                entry_norm = 0.0
+
+                for term, count in entry_terms.items():
+                    w = weight(term, count)
+                    entry_norm += w * w
+
+                    if term in query:
+                        dot += w * query[term]
+
+                if not dot:
+                    continue
+
+                score = dot / (query_norm * math.sqrt(entry_norm))
+
+                if score > best_score:
+                    best_key = cache_key
+                    best_score = score
+
+            if best_key is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            return best_key, best_score
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(self._order),
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
@@ -0,0 +1,106 @@
+# This file measures the semantic cache hit rate and lookup time with 10k and 100k cached questions.
+# It runs offline and does not call OpenAI.
+
+import time
+import random
+import statistics
+
+from semantic_cache import SemanticCache
+
+SIZES = [10_000, 100_000]
+QUERIES = 1_000
+GROUP = "account_access"
+
+# Each pair is (stored question, paraphrased question) for the same request.
+TEMPLATES = [
+    ("How do I reset my password for {system}?", "{system} password reset steps?"),
+    ("How can I request access to {system}?", "request {system} access please"),
+    ("My account is locked on {system}, what should I do?", "{system} account locked what to do"),
+    ("How do I set up MFA for {system}?", "setting up MFA on {system}"),
+    ("Who approves permissions for {system}?", "{system} permission approval who approves"),
+]
+
+# Each pair is (stored question, different question that shares most of its words). The second must not get the
+# first one's cached answer.
+NEAR_MISSES = [
+    ("Should I click links in emails?", "Should I never click links in emails?"),
+    ("How often should I change my password?", "How do I change my password?"),
+    ("Can I share my password with IT?", "Can I share my password with my manager?"),
+    ("Is it safe to open attachments from known senders?", "Is it safe to open attachments from unknown senders?"),
+    ("What is phishing?", "How do I report phishing?"),
+    ("Why should I use MFA?", "How do I set up MFA?"),
+    ("I can't log in to Outlook", "I can log in to Outlook but it is slow"),
+    ("Should I report a phishing email?", "Should I not report a phishing email?"),
+]
+
+# Unique made-up system names so the index grows to the required size.
+def system_name(i: int) -> str:
+    return f"app{i}"
+
+def build_cache(size: int):
+    cache = SemanticCache(max_entries=size)
+    stored = []
+
+    for i, (stored_q, _) in enumerate(NEAR_MISSES):
+        cache.add(GROUP, stored_q, f"near{i}")
+
+    for i in range(size):
+        stored_q, paraphrase = TEMPLATES[i % len(TEMPLATES)]
+        system = system_name(i)
+
+        cache.add(GROUP, stored_q.format(system=system), f"key{i}")
+        stored.append((paraphrase.format(system=system), f"key{i}"))
+
+    return cache, stored
+
+def run(size: int):
+    random.seed(size)
+
+    start = time.perf_counter()
+    cache, stored = build_cache(size)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    correct_hits = 0
+
+    # Paraphrases of cached questions should hit.
+    for paraphrase, expected_key in random.sample(stored, QUERIES):
+        start = time.perf_counter()
+        match = cache.lookup(GROUP, paraphrase)
+        latencies.append(time.perf_counter() - start)
+
+        if match and match[0] == expected_key:
+            correct_hits += 1
+
+    # Questions that share most words with a cached question but ask something else should miss.
+    false_hits = []
+
+    for _, near_miss in NEAR_MISSES:
+        start = time.perf_counter()
+        match = cache.lookup(GROUP, near_miss)
+        latencies.append(time.perf_counter() - start)
+
+        # Near-miss questions were never cached, so any match is a wrong answer.
+        if match:
+            false_hits.append(f"{near_miss!r} -> {match[0]} ({match[1]:.2f})")
+
+    latencies.sort()
+
+    print(f"Cached questions: {size:,}")
+    print(f"  Build time:           {build_seconds:.2f} s")
+    print(f"  Paraphrase hits:      {correct_hits / QUERIES:.1%}")
+    print(f"  Near-miss false hits: {len(false_hits)} of {len(NEAR_MISSES)}")
+
+    for false_hit in false_hits:
+        print(f"    {false_hit}")
+
+    print(f"  Lookup p50:           {statistics.median(latencies) * 1000:.3f} ms")
+    print(f"  Lookup p95:           {latencies[int(len(latencies) * 0.95)] * 1000:.3f} ms")
+
+def main():
+    for size in SIZES:
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# This file removes idle chat sessions so per-session data does not grow forever.
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from session_store import call_store
+
+# Tracks session activity and evicts idle sessions from the session store.
+class SessionManager:
+    def __init__(self, store, idle_ttl_seconds: float = 3600, max_sessions: int = 10000):
+        self.store = store
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+
+        self._last_access = OrderedDict()   # session id -> last access time, oldest first
+        self._lock = threading.Lock()
+
+        self.evicted_idle = 0
+        self.evicted_lru = 0
+
+    # Record that a session was used, evicting the least recently used sessions if over the limit.
+    def touch(self, session_id: str):
+        self.store.touch(session_id)
+
+        # Shared stores keep sessions outside this process and expire them themselves.
+        if self.store.shared:
+            return
+
+        with self._lock:
+            self._last_access[session_id] = time.monotonic()
+            self._last_access.move_to_end(session_id)
+
+            while len(self._last_access) > self.max_sessions:
+                oldest, _ = self._last_access.popitem(last=False)
+                self.store.delete_session(oldest)
+                self.evicted_lru += 1
+
+    # touch() for async code; shared stores are touched in a thread.
+    async def atouch(self, session_id: str):
+        await call_store(self.store, self.touch, session_id)
+
+    def evict(self, session_id: str):
+        with self._lock:
+            self._last_access.pop(session_id, None)
+
+        self.store.delete_session(session_id)
+
+    # Remove every session that has been idle for longer than the TTL.
+    def sweep(self) -> int:
+        removed = self.store.purge_idle(self.idle_ttl_seconds)
+        cutoff = time.monotonic() - self.idle_ttl_seconds
+
+        with self._lock:
+            while self._last_access:
+                session_id, last_access = next(iter(self._last_access.items()))
+
+                if last_access > cutoff:
+                    break
+
+                self._last_access.popitem(last=False)
+
+            self.evicted_idle += removed
+
+        return removed
+
+    # Background task that sweeps idle sessions until cancelled.
+    async def run_sweeper(self, interval_seconds: float = 60):
+        while True:
+            await asyncio.sleep(interval_seconds)
+
+            # Purging many sessions takes a while, so it runs in a thread instead of blocking the event loop.
+            try:
+                removed = await asyncio.to_thread(self.sweep)
+            except Exception as e:
+                print("SESSION SWEEP ERROR:", str(e))
+                continue
+
+            if removed:
+                print(f"Session sweeper removed {removed} idle sessions.")
+
+    def __len__(self) -> int:
+        return len(self._last_access)
+
+    def stats(self) -> dict:
+        return {
+            "store": type(self.store).__name__,
+            "tracked_sessions": len(self._last_access),
+            "max_sessions": self.max_sessions,
+            "idle_ttl_seconds": self.idle_ttl_seconds,
+            "evicted_idle": self.evicted_idle,
+            "evicted_lru": self.evicted_lru
+        }
@@ -0,0 +1,404 @@
+# This file stores per-session data (chat memory, triage progress, refusal counts).
+# A shared backend (SQLite or Redis) lets several uvicorn workers see the same sessions.
+import os
+import json
+import time
+import asyncio
+import socket
+import sqlite3
+import threading
+from collections import defaultdict
+from urllib.parse import urlparse
+
+# Namespace used to record when each session was last active.
+SESSIONS_NAMESPACE = "__sessions__"
+
+# Keeps everything in process memory. Only suitable for a single worker.
+class MemoryStore:
+    shared = False
+
+    def __init__(self):
+        self._data = {}
+        self._namespaces = defaultdict(set)   # session id -> namespaces holding a value for it
+        self._last_access = {}
+        self._lock = threading.Lock()
+
+    def get(self, namespace: str, key: str, default=None):
+        return self._data.get((namespace, key), default)
+
+    def set(self, namespace: str, key: str, value):
+        with self._lock:
+            self._data[(namespace, key)] = value
+            self._namespaces[key].add(namespace)
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._data.pop((namespace, key), None)
+
+            namespaces = self._namespaces.get(key)
+
+            if namespaces is not None:
+                namespaces.discard(namespace)
+
+                if not namespaces:
+                    del self._namespaces[key]
+
+    def touch(self, session_id: str):
+        self._last_access[session_id] = time.time()
+
+    # Only the session's own keys are visited, so evicting a session costs the same however many there are.
+    def delete_session(self, session_id: str):
+        with self._lock:
+            for namespace in self._namespaces.pop(session_id, ()):
+                self._data.pop((namespace, session_id), None)
+
+            self._last_access.pop(session_id, None)
+
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        cutoff = time.time() - max_idle_seconds
+        idle = [sid for sid, seen in list(self._last_access.items()) if seen < cutoff]
+
+        for session_id in idle:
+            self.delete_session(session_id)
+
+        return len(idle)
+
+    def close(self):
+        pass
+
+# Stores sessions in a local SQLite database in WAL mode, shared by all workers on the same machine.
+class SQLiteStore:
+    shared = True
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS session_data (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS session_data_key ON session_data (key)")
+
+    def get(self, namespace: str, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_data WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            ).fetchone()
+
+        return json.loads(row[0]) if row else default
+
+    def set(self, namespace: str, key: str, value):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO session_data (namespace, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), time.time())
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM session_data WHERE namespace = ? AND key = ?",
+                (namespace, key)
+            )
+
+    def touch(self, session_id: str):
+        self.set(SESSIONS_NAMESPACE, session_id, True)
+
+    def delete_session(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_data WHERE key = ?", (session_id,))
+
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        cutoff = time.time() - max_idle_seconds
+
+        with self._lock:
+            idle = [
+                row[0] for row in self._conn.execute(
+                    "SELECT key FROM session_data WHERE namespace = ? AND updated_at < ?",
+                    (SESSIONS_NAMESPACE, cutoff)
+                )
+            ]
+
+            for session_id in idle:
+                self._conn.execute("DELETE FROM session_data WHERE key = ?", (session_id,))
+
+        return len(idle)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Raised for an error reply from Redis. The connection is still in step, so it is kept.
+class RedisError(RuntimeError):
+    pass
+
+# Small client for the Redis protocol (RESP), so no extra package is needed.
+# The socket is opened on first use. After a timeout or any other connection error the reply stream can no longer be
+# trusted, so the socket is dropped and the next command opens a new one.
+class RedisConnection:
+    def __init__(self, host: str, port: int, db: int = 0, password: str | None = None, timeout: float = 5):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+        self.reconnects = 0
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._file = self._sock.makefile("rb")
+
+        if self.password:
+            self._send("AUTH", self.password)
+
+        if self.db:
+            self._send("SELECT", str(self.db))
+
+    def _drop(self):
+        for resource in (self._file, self._sock):
+            try:
+                if resource is not None:
+                    resource.close()
+            except OSError:
+                pass
+
+        self._sock = None
+        self._file = None
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    # Commands used by RedisStore are safe to repeat, so one that failed on an old connection is retried once
+    # on a new one.
+    def execute(self, *args):
+        with self._lock:
+            for attempt in range(2):
+                reused = self._sock is not None
+
+                try:
+                    if not reused:
+                        self._connect()
+
+                    return self._send(*args)
+                except RedisError:
+                    raise
+                except (OSError, ValueError, RuntimeError):
+                    self._drop()
+
+                    if not reused or attempt:
+                        raise
+
+                    self.reconnects += 1
+
+    def _read_reply(self):
+        line = self._file.readline()
+
+        if not line:
+            raise ConnectionError("Redis connection closed")
+
+        kind, rest = line[:1], line[1:-2]
+
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            raise RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+
+            if length == -1:
+                return None
+
+            data = self._file.read(length + 2)
+
+            if len(data) != length + 2:
+                raise ConnectionError("Redis connection closed")
+
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+
+            if count == -1:
+                return None
+
+            return [self._read_reply() for _ in range(count)]
+
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
+
+    def close(self):
+        with self._lock:
+            self._drop()
+
+# Stores sessions in Redis (or any server speaking the Redis protocol). Keys expire on their own when idle.
+# Each session also has a set listing its namespaces, so touch and delete_session reach every key of the session,
+# whichever worker wrote it.
+class RedisStore:
+    shared = True
+
+    def __init__(self, host: str, port: int = 6379, db: int = 0, password: str | None = None,
+                 idle_ttl_seconds: float = 3600, prefix: str = "sme"):
+        self._redis = RedisConnection(host, port, db, password)
+        self.idle_ttl_seconds = int(idle_ttl_seconds)
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def _index(self, session_id: str) -> str:
+        return self._key(SESSIONS_NAMESPACE, session_id)
+
+    def get(self, namespace: str, key: str, default=None):
+        value = self._redis.execute("GET", self._key(namespace, key))
+        return json.loads(value) if value is not None else default
+
+    def set(self, namespace: str, key: str, value):
+        self._redis.execute("SET", self._key(namespace, key), json.dumps(value), "EX", self.idle_ttl_seconds)
+        self._redis.execute("SADD", self._index(key), namespace)
+        self._redis.execute("EXPIRE", self._index(key), self.idle_ttl_seconds)
+
+    def delete(self, namespace: str, key: str):
+        self._redis.execute("DEL", self._key(namespace, key))
+        self._redis.execute("SREM", self._index(key), namespace)
+
+    def _namespaces(self, session_id: str) -> list:
+        return [ns.decode("utf-8") for ns in self._redis.execute("SMEMBERS", self._index(session_id)) or []]
+
+    # Push back the expiry of every key belonging to the session.
+    def touch(self, session_id: str):
+        for namespace in self._namespaces(session_id):
+            self._redis.execute("EXPIRE", self._key(namespace, session_id), self.idle_ttl_seconds)
+
+        self._redis.execute("EXPIRE", self._index(session_id), self.idle_ttl_seconds)
+
+    def delete_session(self, session_id: str):
+        keys = [self._key(ns, session_id) for ns in self._namespaces(session_id)]
+        self._redis.execute("DEL", self._index(session_id), *keys)
+
+    # Redis removes idle keys itself.
+    def purge_idle(self, max_idle_seconds: float) -> int:
+        return 0
+
+    def close(self):
+        self._redis.close()
+
+# Shared stores block on disk or network I/O, so async code calls them through here to run them in a thread and
+# keep the event loop free. memory:// is only a dict lookup and is called directly.
+async def call_store(store, fn, *args):
+    if not store.shared:
+        return fn(*args)
+
+    return await asyncio.to_thread(fn, *args)
+
+# Dict-like view of one namespace, so existing code can keep using session_data[session_id].
+# Values are copies: write them back after changing them. Async code uses the a* methods, which go through call_store.
+class StoreMapping:
+    def __init__(self, store, namespace: str, default=None):
+        self.store = store
+        self.namespace = namespace
+        self.default = default
+
+    def __getitem__(self, session_id: str):
+        value = self.store.get(self.namespace, session_id)
+
+        if value is None:
+            if self.default is None:
+                raise KeyError(session_id)
+            return self.default()
+
+        return value
+
+    def __setitem__(self, session_id: str, value):
+        self.store.set(self.namespace, session_id, value)
+
+    def __delitem__(self, session_id: str):
+        self.store.delete(self.namespace, session_id)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.store.get(self.namespace, session_id) is not None
+
+    def get(self, session_id: str, default=None):
+        value = self.store.get(self.namespace, session_id)
+        return default if value is None else value
+
+    def pop(self, session_id: str, default=None):
+        value = self.get(session_id, default)
+        self.store.delete(self.namespace, session_id)
+        return value
+
+    async def aload(self, session_id: str):
+        return await call_store(self.store, self.__getitem__, session_id)
+
+    async def asave(self, session_id: str, value):
+        await call_store(self.store, self.__setitem__, session_id, value)
+
+    async def aget(self, session_id: str, default=None):
+        return await call_store(self.store, self.get, session_id, default)
+
+    async def apop(self, session_id: str, default=None):
+        return await call_store(self.store, self.pop, session_id, default)
+
+# Create the store from a URL: memory://, sqlite:///path/to/sessions.db or redis://[:password@]host:port/db
+def open_store(url: str, idle_ttl_seconds: float = 3600):
+    parsed = urlparse(url)
+
+    if parsed.scheme in ("", "memory"):
+        return MemoryStore()
+
+    if parsed.scheme == "sqlite":
+        # sqlite:///sessions.db is relative, sqlite:////var/data/sessions.db is absolute.
+        return SQLiteStore(parsed.path[1:])
+
+    if parsed.scheme == "redis":
+        db = int(parsed.path.lstrip("/") or 0)
+        return RedisStore(
+            parsed.hostname or "localhost",
+            parsed.port or 6379,
+            db,
+            parsed.password,
+            idle_ttl_seconds=idle_ttl_seconds
+        )
+
+    raise ValueError(f"Unsupported session store URL: {url}")
+
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", "3600"))
+
+# Shared store used by main.py and smeopenai.py.
+session_store = open_store(os.getenv("SESSION_STORE_URL", "memory://"), SESSION_IDLE_TTL_SECONDS)
+
+# Number of uvicorn workers started by the Procfile. WEB_CONCURRENCY is not used because hosting platforms set
+# it on their own, which would silently split in-memory sessions between workers.
+UVICORN_WORKERS = int(os.getenv("UVICORN_WORKERS", "1"))
+
+if UVICORN_WORKERS > 1 and not session_store.shared:
+    raise RuntimeError(
+        f"UVICORN_WORKERS={UVICORN_WORKERS} needs a shared SESSION_STORE_URL (sqlite:// or redis://); "
+        "memory:// sessions are only visible to one worker"
+    )
@@ -2,18 +2,28 @@
 
 import os
 import random
+import asyncio
+import json
 from dotenv import load_dotenv
 from openai import OpenAI
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables.history import RunnableWithMessageHistory
-from langchain_core.chat_history import InMemoryChatMessageHistory
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage, messages_from_dict, messages_to_dict
+from response_cache import fingerprint
+from session_store import session_store, StoreMapping, call_store
+from history_window import messages_to_summarise, summary_prompt
+from group_rules import classify_group
+from http_clients import get_openai_http_client, get_openai_sync_http_client
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-llm    = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model="gpt-4o", temperature=0.2)
+
+# Maximum number of LLM calls running at the same time across all chats.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
 
 # Company-specific settings.
 COMPANY_NAME = "Rxtra"
@@ -26,17 +36,6 @@ VPN_NAME = "GlobalProtect VPN"
 VPN_PORTAL = "portal.rxtra.sk993"
 PASSWORD_DAYS = "90 days"
 
-# Keywords used to group security queries.
-GROUP_RULES = {
-            "email_security": [ "email", "phishing", "phish", "suspicious email", "attachment", "link", "url", "domain", "sender", "spam", "eml", "malicious email"],
-            "security_incidents": [ "incident", "report", "reporting", "suspicious activity", "compromised", "hacked", "malware", "virus", "ransomware", "security incident", "unauthorised access", "breach", "infected", "cyber attack"],
-            "data_protection": ["data", "data breach", "confidential", "sensitive", "patient", "privacy", "gdpr", "personal information", "personal data", "information disclosure"],
-            "account_access": ["password", "mfa", "login", "locked account", "account locked", "access", "permission", "permissions", "authorised", "authorization", "authentication", "account", "user account", "reset password", "access request"],
-            "network_and_remote_access": ["vpn", "network", "wifi", "wi-fi", "internet", "remote access", "remote working", "connection", "connectivity", "gateway"],
-            "general_security": [ "security", "cybersecurity", "cyber security", "best practice", "awareness", "safe browsing", "security advice", "security guidance"
-            ]
-        }
-
 # Each group gives the chatbot company specific guidance.
 GROUP_CONTEXT = {
                 "account_access": f"""
@@ -169,24 +168,115 @@ prompt = ChatPromptTemplate.from_template ("""
                                                             
             New Question:\n{question} """)
 
-chain = prompt | llm
+# Minimal prompt for internal tasks (classification, triage questions, titles).
+# These calls do not use or add to the user's conversation memory.
+internal_prompt = ChatPromptTemplate.from_messages([
+    ("system", f"You are an internal IT and security assistant for {COMPANY_NAME}. Follow the instructions exactly.\n{{company_context}}"),
+    ("human", "{task}")
+])
+
+# Changes whenever the system prompt or company context is edited, so cached replies from an older prompt are not reused.
+PROMPT_VERSION = fingerprint(
+    prompt.messages[0].prompt.template,
+    json.dumps(GROUP_CONTEXT, sort_keys=True)
+)
+
+# Chat memory kept in the session store, so any worker can continue the conversation.
+# Older turns are replaced by a summary (see history_window.py), so the history sent to the LLM stays small.
+class StoreChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self, store, session_id: str, namespace: str = "chat_history"):
+        self.store = store
+        self.session_id = session_id
+        self.namespace = namespace
+
+    @property
+    def summary(self) -> str:
+        return self.store.get("chat_summary", self.session_id, "")
+
+    # Turns that are due to be folded into the summary are left out even if the summary has not been written (or
+    # failed), so HISTORY_MAX_TURNS and HISTORY_MAX_TOKENS always bound the prompt.
+    @property
+    def messages(self):
+        stored = self.store.get(self.namespace, self.session_id, [])
+        start = messages_to_summarise([m["data"]["content"] for m in stored])
+        recent = messages_from_dict(stored[start:])
+        summary = self.summary
+
+        if summary:
+            return [SystemMessage(content=f"Summary of the earlier conversation: {summary}")] + recent
+
+        return recent
+
+    # Return (stored messages to fold into the summary, current summary), or None if nothing needs summarising yet.
+    def pending_summary(self):
+        stored = self.store.get(self.namespace, self.session_id, [])
+        count = messages_to_summarise([m["data"]["content"] for m in stored])
+
+        if not count:
+            return None
+
+        return stored[:count], self.summary
+
+    # Save the new summary and drop the messages it covers. Nothing is changed, and False is returned, if the summary
+    # or the oldest messages were changed by another request while the summary was being written.
+    def apply_summary(self, summary: str, covered: list, previous: str) -> bool:
+        stored = self.store.get(self.namespace, self.session_id, [])
+
+        if self.summary != previous or stored[:len(covered)] != covered:
+            return False
 
-# Stores chat memory and refusal history for each user session.
-chat_history = {}
-refusal_history = {}
+        self.store.set("chat_summary", self.session_id, summary)
+        self.store.set(self.namespace, self.session_id, stored[len(covered):])
+        return True
+
+    def add_messages(self, messages):
+        stored = self.store.get(self.namespace, self.session_id, [])
+        stored.extend(messages_to_dict(messages))
+        self.store.set(self.namespace, self.session_id, stored)
+
+    def clear(self):
+        self.store.delete(self.namespace, self.session_id)
+        self.store.delete("chat_summary", self.session_id)
+
+# Stores refusal history for each user session.
+refusal_history = StoreMapping(session_store, "refusal_history", default=list)
 
 def user_session_history(session_id: str):
-    if session_id not in chat_history:
-        chat_history[session_id] = InMemoryChatMessageHistory()
-    return chat_history[session_id]
-
-# Adds conversation memory so the chatbot can understand follow-up questions.
-conversation_memory = RunnableWithMessageHistory(
-    chain,
-    user_session_history,
-    input_messages_key="question",
-    history_messages_key="history"
-)
+    return StoreChatMessageHistory(session_store, session_id)
+
+# The OpenAI clients and chains are built by open_llm() on top of the shared HTTP clients in http_clients.py.
+client = None
+llm = None
+internal_chain = None
+conversation_memory = None
+llm_http_clients = None
+
+# Build the OpenAI clients and chains, again whenever http_clients has replaced its OpenAI HTTP clients
+# (they are closed at the end of each app lifespan). Called before every OpenAI call.
+def open_llm():
+    global client, llm, internal_chain, conversation_memory, llm_http_clients
+
+    http_clients = (get_openai_http_client(), get_openai_sync_http_client())
+
+    if http_clients == llm_http_clients:
+        return
+
+    async_http_client, sync_http_client = http_clients
+
+    client = OpenAI(api_key=OPENAI_API_KEY, http_client=sync_http_client)
+    llm    = ChatOpenAI(openai_api_key=OPENAI_API_KEY, model="gpt-4o", temperature=0.2, http_async_client=async_http_client)
+
+    internal_chain = internal_prompt | llm
+
+    # Adds conversation memory so the chatbot can understand follow-up questions.
+    conversation_memory = RunnableWithMessageHistory(
+        prompt | llm,
+        user_session_history,
+        input_messages_key="question",
+        history_messages_key="history"
+    )
+
+    llm_http_clients = http_clients
 
 # Responses used for out-of-scope questions.
 REFUSALS = [
@@ -198,93 +288,113 @@ REFUSALS = [
             "I'm here to focus on questions related to company security or improvement, particularly in protecting your company's assets, data, and infrastructure. If you have any questions in those areas, I'd be happy to help!"
         ]
 
-# Place the user's question into a security topic.
-def classify_group(question: str) -> str:
-    q = question.lower()
-
-    # Email security
-    if any(word in q for word in [
-        "phishing", "email", "link", "url", "attachment",
-        "suspicious email", "spam", "sender", "domain", "eml"
-    ]):
-        return "email_security"
-
-    # Security incidents
-    elif any(word in q for word in [
-        "incident", "report", "suspicious activity",
-        "compromised", "hacked", "malware", "virus",
-        "ransomware", "unauthorised access", "unauthorized access",
-        "cyber attack", "infected"
-    ]):
-        return "security_incidents"
-
-    # Data protection
-    elif any(word in q for word in [
-        "data breach", "data", "gdpr", "confidential",
-        "sensitive", "patient", "privacy", "leak",
-        "personal data", "information disclosure"
-    ]):
-        return "data_protection"
-
-    # Account access
-    elif any(word in q for word in [
-        "password", "mfa", "authentication", "authenticator",
-        "reset password", "locked out", "account locked",
-        "login", "log in", "sign in", "access",
-        "permission", "permissions", "role"
-    ]):
-        return "account_access"
-
-    # Network and remote access
-    elif any(word in q for word in [
-        "wifi", "wi-fi", "network", "vpn",
-        "globalprotect", "internet", "connection",
-        "connectivity", "disconnecting", "not connecting",
-        "remote access", "remote working"
-    ]):
-        return "network_and_remote_access"
-
-    # General security
-    elif any(word in q for word in [
-        "security", "cybersecurity", "cyber security",
-        "best practice", "awareness", "safe browsing"
-    ]):
-        return "general_security"
-
-    return "unknown"
+# Build the response cache key from the prompt version, the question's group and the redacted question.
+def response_cache_key(question: str, group: str) -> str:
+    normalised = " ".join(question.lower().split())
+
+    return f"{PROMPT_VERSION}:{group}:{fingerprint(normalised)}"
 
 #use a different refusal response where possible.
 def refuse(session_id: str) -> str:
-    used = refusal_history.setdefault(session_id, set())
+    used = set(refusal_history[session_id])
     choices = [r for r in REFUSALS if r not in used]
     if not choices:
         used.clear()
         choices = REFUSALS.copy()
     choice = random.choice(choices)
     used.add(choice)
+    refusal_history[session_id] = list(used)
     return choice
 
 #check user input using OpenAI moderation.
 def is_safe(text: str) -> bool:
     try:
+        open_llm()
         resp = client.moderations.create(input=text)
         return not resp.results[0].flagged
     except Exception as e:
         print(f"[Moderation error] {e}")
         return False
 
-#main function called by main.py
-def ask_openai(question: str, session_id: str) -> str:
-    group = classify_group(question)
-
+#main function called by main.py. It is async so a slow LLM call does not block the event loop.
+#group is the question's group from classify_group, worked out once per message by the caller.
+async def ask_openai_async(question: str, session_id: str, group: str) -> str:
     group_context = GROUP_CONTEXT.get(
         group,
         GROUP_CONTEXT["unknown"]
     )
 
-    result = conversation_memory.invoke(
-        {"question": question, "group_context": group_context },
-        config={"configurable": {"session_id": session_id}}
+    open_llm()
+
+    async with llm_semaphore:
+        result = await conversation_memory.ainvoke(
+            {"question": question, "group_context": group_context },
+            config={"configurable": {"session_id": session_id}}
+        )
+
+    schedule_summary(session_id)
+
+    return result.content.strip()
+
+# Stream the reply token by token. Conversation memory is updated once the stream finishes.
+async def stream_openai(question: str, session_id: str, group: str):
+    group_context = GROUP_CONTEXT.get(
+        group,
+        GROUP_CONTEXT["unknown"]
     )
 
-    return result.content.strip()
\ No newline at end of file
+    open_llm()
+
+    async with llm_semaphore:
+        async for chunk in conversation_memory.astream(
+            {"question": question, "group_context": group_context },
+            config={"configurable": {"session_id": session_id}}
+        ):
+            if chunk.content:
+                yield chunk.content
+
+    schedule_summary(session_id)
+
+# Stateless completion for internal prompts. Nothing is read from or saved to chat history.
+# Pass a group to include that group's company guidance.
+async def complete_async(task: str, group: str | None = None) -> str:
+    company_context = GROUP_CONTEXT.get(group, "") if group else ""
+
+    open_llm()
+
+    async with llm_semaphore:
+        result = await internal_chain.ainvoke({"task": task, "company_context": company_context})
+
+    return result.content.strip()
+
+# Fold older turns into the session's summary once enough have built up.
+async def summarise_history_async(session_id: str):
+    history = user_session_history(session_id)
+    pending = await call_store(session_store, history.pending_summary)
+
+    if pending:
+        covered, previous = pending
+
+        try:
+            summary = await complete_async(summary_prompt(previous, transcript(covered)))
+        except Exception as e:
+            print(f"[Summary error] {e}")
+            return
+
+        if not await call_store(session_store, history.apply_summary, summary, covered, previous):
+            print(f"[Summary skipped] history for {session_id} changed while it was being summarised")
+
+def transcript(stored: list) -> list:
+    return [f"{m['type']}: {m['data']['content']}" for m in stored]
+
+# Summaries are written after the reply is sent, one at a time per session in this worker.
+# Other workers are covered by the check in StoreChatMessageHistory.apply_summary.
+summary_tasks = {}
+
+def schedule_summary(session_id: str):
+    if session_id in summary_tasks:
+        return
+
+    task = asyncio.create_task(summarise_history_async(session_id))
+    summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: summary_tasks.pop(session_id, None))
@@ -1,35 +1,138 @@
-# This file is for the scanning of URLs, domains, and uploaded email files.
+# This file is for the scanning of URLs, domains, IP addresses and uploaded email files.
+import io
 import os
-import re
-import requests
-import email
+import base64
+import asyncio
+import logging
+import contextvars
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+import httpx
 import time
-from email import policy
-from urllib.parse import urlparse
 from dotenv import load_dotenv
-from bs4 import BeautifulSoup
+from http_clients import get_vt_client
+from polling import poll_until
+from mime_stream import parse_email_file
+from vt_cache import verdict_cache, verdict_type, canonical_url, canonical_domain, file_sha256
+from circuit_breaker import vt_breaker, CircuitOpen
+from vt_scheduler import vt_scheduler, QuotaDeferred, PRIORITY_ATTACHMENT, PRIORITY_URL, PRIORITY_DOMAIN
+
+logger = logging.getLogger(__name__)
 
 # Load the VirusTotal API key.
 load_dotenv()
 VT_API_KEY = os.getenv("VT_API_KEY")
-headers = {"x-apikey": VT_API_KEY}
+headers = {"x-apikey": VT_API_KEY or ""}
+VT_BASE_URL = os.getenv("VT_BASE_URL", "https://www.virustotal.com/api/v3").rstrip("/")
+VT_REQUEST_TIMEOUT = float(os.getenv("VT_REQUEST_TIMEOUT_SECONDS", "15"))
+
+# Indicators are scanned concurrently. This limits how many requests are sent to VirusTotal at the same time.
+# A request only takes a slot once the scheduler has given it a quota token, so the order requests are sent in is
+# decided by priority (see vt_scheduler.py), not by which scan started first.
+VT_MAX_CONCURRENCY = int(os.getenv("VT_MAX_CONCURRENCY", "4"))
+vt_semaphore = asyncio.Semaphore(VT_MAX_CONCURRENCY)
 
-# Scan a domain with VirusTotal.
-def scan_domain(domain):
-    resp = requests.get(
-    f"https://www.virustotal.com/api/v3/domains/{domain}",
-    headers=headers,
-    timeout=15
-    )
+# Priority and deadline (a time.monotonic() value) of the scan currently running, used by vt_request when
+# queueing for quota.
+request_priority = contextvars.ContextVar("request_priority", default=PRIORITY_URL)
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
 
-    if resp.status_code == 404:
-        return {"verdict": "Not found on VirusTotal. Treat as suspicious and verify manually"}
+# Send a request to the VirusTotal API once the scheduler allows it. A 429 reply pauses all requests
+# and the request is queued again; if quota does not free up in time the scan is deferred.
+# Network errors and 5xx replies count towards the circuit breaker; while it is open nothing is sent.
+async def vt_request(method, url, **kwargs):
+    while True:
+        if not vt_breaker.available:
+            raise CircuitOpen("VirusTotal is unavailable")
 
-    if resp.status_code != 200:
-        return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
-    
-    stats = resp.json().get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
-    
+        deadline = request_deadline.get()
+        await vt_scheduler.acquire(request_priority.get(), deadline)
+
+        # The circuit may have opened, or another request taken the half-open trial, while this one waited.
+        # Its token is returned so the quota is not used up by a request that is never sent.
+        try:
+            vt_breaker.before_request()
+        except CircuitOpen:
+            vt_scheduler.refund()
+            raise
+
+        # A request never waits on the network past the scan's deadline.
+        if deadline is not None and "timeout" in kwargs:
+            kwargs["timeout"] = max(1, min(kwargs["timeout"], deadline - time.monotonic()))
+
+        try:
+            async with vt_semaphore:
+                resp = await get_vt_client().request(method, url, **kwargs)
+        except httpx.HTTPError:
+            vt_breaker.record_failure()
+
+            if not vt_breaker.available:
+                raise CircuitOpen("VirusTotal is unavailable")
+
+            raise
+
+        if resp.status_code >= 500:
+            vt_breaker.record_failure()
+
+            # This failure opened the circuit, so the scan is degraded like the ones that follow.
+            if not vt_breaker.available:
+                raise CircuitOpen("VirusTotal is unavailable")
+
+            return resp
+
+        vt_breaker.record_success()
+
+        if resp.status_code != 429:
+            return resp
+
+        vt_scheduler.pause(retry_after_seconds(resp.headers.get("retry-after")))
+
+# Retry-After is either a number of seconds or an HTTP date. Anything else waits the default 60 seconds.
+def retry_after_seconds(value, default: float = 60) -> float:
+    if value is None:
+        return default
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return default
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+# Time allowed for each scan, including waiting for VirusTotal to finish analysing a new URL or file.
+VT_SCAN_DEADLINE_SECONDS = float(os.getenv("VT_SCAN_DEADLINE_SECONDS", "30"))
+
+def scan_deadline():
+    return time.monotonic() + VT_SCAN_DEADLINE_SECONDS
+
+# Background scan jobs have nobody waiting on the reply, so their scans may wait much longer for quota and analyses.
+VT_JOB_DEADLINE_SECONDS = float(os.getenv("VT_JOB_DEADLINE_SECONDS", "600"))
+VT_JOB_MAX_DEADLINE_SECONDS = float(os.getenv("VT_JOB_MAX_DEADLINE_SECONDS", "7200"))
+
+# A scan makes about this many requests on average: a report lookup, plus a submission and an analysis check when
+# VirusTotal has not seen the URL or file.
+REQUESTS_PER_SCAN = 2
+
+# Deadline for a job running scan_count scans: long enough for all of them at the current per-minute quota,
+# at least VT_JOB_DEADLINE_SECONDS and at most VT_JOB_MAX_DEADLINE_SECONDS.
+def job_deadline(scan_count: int = 0):
+    needed = scan_count * REQUESTS_PER_SCAN * 60 / vt_scheduler.per_minute
+    return time.monotonic() + min(max(VT_JOB_DEADLINE_SECONDS, needed), VT_JOB_MAX_DEADLINE_SECONDS)
+
+# Existing URL reports younger than this are reused instead of queuing a new analysis. 0 always submits the URL.
+VT_URL_REPORT_MAX_AGE = int(os.getenv("VT_URL_REPORT_MAX_AGE_SECONDS", str(3 * 24 * 3600)))
+
+# Turn VirusTotal analysis stats into a verdict for a URL or domain.
+def url_verdict(stats):
     malicious = stats.get("malicious", 0)
     suspicious = stats.get("suspicious", 0)
 
@@ -41,15 +144,13 @@ def scan_domain(domain):
 
     return {"verdict": "Looks Safe"}
 
-# Scan a URL with VirusTotal.
-def scan_url(url):
-    data = {"url": url}
-
-    resp = requests.post(
-        "https://www.virustotal.com/api/v3/urls",
-        headers=headers,
-        data=data,
-        timeout=15
+# Look up a domain or IP address report on VirusTotal, e.g. path "domains/example.com".
+async def lookup_report(path):
+    resp = await vt_request(
+    "GET",
+    f"{VT_BASE_URL}/{path}",
+    headers=headers,
+    timeout=VT_REQUEST_TIMEOUT
     )
 
     if resp.status_code == 404:
@@ -57,148 +158,281 @@ def scan_url(url):
 
     if resp.status_code != 200:
         return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
+    
+    stats = resp.json().get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
+    
+    return url_verdict(stats)
 
-    scan_id = resp.json()["data"]["id"]
+async def lookup_domain(domain):
+    return await lookup_report(f"domains/{domain}")
 
-# Wait for VirusTotal to complete the analysis.
-    for _ in range(10):
+async def lookup_ip(ip):
+    return await lookup_report(f"ip_addresses/{ip}")
+
+# VirusTotal identifies a URL by its base64 encoding without padding.
+def url_id(url):
+    return base64.urlsafe_b64encode(url.encode("utf-8")).decode("ascii").rstrip("=")
+
+# Look up an existing URL report. Returns None if there is no report or it is older than max_age seconds.
+async def lookup_url_report(url, max_age=VT_URL_REPORT_MAX_AGE):
+    resp = await vt_request(
+        "GET",
+        f"{VT_BASE_URL}/urls/{url_id(url)}",
+        headers=headers,
+        timeout=VT_REQUEST_TIMEOUT
+    )
+
+    if resp.status_code != 200:
+        return None
 
-        analysis = requests.get(
-            f"https://www.virustotal.com/api/v3/analyses/{scan_id}",
+    attributes = resp.json().get("data", {}).get("attributes", {})
+    stats = attributes.get("last_analysis_stats", {})
+    analysed_at = attributes.get("last_analysis_date") or 0
+
+    if not any(stats.values()) or time.time() - analysed_at > max_age:
+        return None
+
+    return url_verdict(stats)
+
+# Wait for VirusTotal to complete an analysis. The first check is quick and later checks back off,
+# until the scan's deadline (a time.monotonic() value) passes.
+async def wait_for_analysis(analysis_id, to_verdict, deadline=None,
+                            not_found="Unable to verify with VirusTotal. Treat as suspicious and verify manually",
+                            delays=None):
+    deadline = deadline or scan_deadline()
+
+    async def check():
+        analysis = await vt_request(
+            "GET",
+            f"{VT_BASE_URL}/analyses/{analysis_id}",
             headers=headers,
-            timeout=15
+            timeout=max(1, min(VT_REQUEST_TIMEOUT, deadline - time.monotonic()))
         )
 
         if analysis.status_code == 404:
-            return {"verdict": "Not found on VirusTotal. Treat as suspicious and verify manually"}
+            return {"verdict": not_found}
 
         if analysis.status_code != 200:
             return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
 
-        attributes = (
-            analysis.json()
-            .get("data", {})
-            .get("attributes", {})
-        )
-
-        status = attributes.get("status")
+        attributes = analysis.json().get("data", {}).get("attributes", {})
 
-        if status == "completed":
-            stats = attributes.get("stats", {})
+        if attributes.get("status") == "completed":
+            return to_verdict(attributes.get("stats", {}))
 
-            malicious = stats.get("malicious", 0)
-            suspicious = stats.get("suspicious", 0)
+        return None
 
-            if malicious > 0:
-                return {"verdict": "Likely Malicious"}
+    result = await poll_until(check, deadline, delays)
 
-            if suspicious > 0:
-                return {"verdict": "Suspicious"}
+    return result or {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
 
-            return {"verdict": "Looks Safe"}
+# Reuse a recent VirusTotal report for the URL, or submit it and wait for a new analysis.
+async def lookup_url(url, deadline=None):
+    if VT_URL_REPORT_MAX_AGE > 0:
+        report = await lookup_url_report(url)
 
-        time.sleep(2)
+        if report is not None:
+            return report
 
-    return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
-
-# Scan .EML file uploaded with VirusTotal.
-def scan_file_attachment(filename, file_bytes):
-    files = {"file": (filename, file_bytes)}
+    data = {"url": url}
 
-    resp = requests.post(
-        "https://www.virustotal.com/api/v3/files",
+    resp = await vt_request(
+        "POST",
+        f"{VT_BASE_URL}/urls",
         headers=headers,
-        files=files,
-        timeout=15
+        data=data,
+        timeout=VT_REQUEST_TIMEOUT
     )
 
+    if resp.status_code == 404:
+        return {"verdict": "Not found on VirusTotal. Treat as suspicious and verify manually"}
+
     if resp.status_code != 200:
         return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
 
-    analysis_id = resp.json()["data"]["id"]
+    scan_id = resp.json()["data"]["id"]
 
-# Wait for VirusTotal to complete the analysis.
-    for _ in range(10):
+    return await wait_for_analysis(
+        scan_id, url_verdict, deadline,
+        not_found="Not found on VirusTotal. Treat as suspicious and verify manually"
+    )
 
-        analysis = requests.get(
-            f"https://www.virustotal.com/api/v3/analyses/{analysis_id}",
-            headers=headers,
-            timeout=15
-        )
+# Turn VirusTotal analysis stats into a verdict for an attachment.
+def file_verdict(stats):
+    malicious = stats.get("malicious", 0)
+    suspicious = stats.get("suspicious", 0)
 
-        if analysis.status_code != 200:
-            return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
+    if malicious > 0:
+        return {"verdict": "Likely Malicious File"}
 
-        attributes = (
-            analysis.json()
-            .get("data", {})
-            .get("attributes", {})
-        )
+    if suspicious > 0:
+        return {"verdict": "Suspicious"}
 
-        status = attributes.get("status")
+    return {"verdict": "File Seems Safe"}
 
-        if status == "completed":
-            stats = attributes.get("stats", {})
+# Look up an existing file report by SHA-256. Returns None if VirusTotal has not seen the file.
+async def lookup_file_report(sha256):
+    resp = await vt_request(
+        "GET",
+        f"{VT_BASE_URL}/files/{sha256}",
+        headers=headers,
+        timeout=VT_REQUEST_TIMEOUT
+    )
 
-            malicious = stats.get("malicious", 0)
-            suspicious = stats.get("suspicious", 0)
+    if resp.status_code == 404:
+        return None
 
-            if malicious > 0:
-                return {"verdict": "Likely Malicious File"}
+    if resp.status_code != 200:
+        return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
 
-            if suspicious > 0:
-                return {"verdict": "Suspicious"}
+    stats = resp.json().get("data", {}).get("attributes", {}).get("last_analysis_stats", {})
 
-            return {"verdict": "File Seems Safe"}
+    # A report with no engine results yet is treated as unknown, so the file is uploaded.
+    if not any(stats.values()):
+        return None
 
-        time.sleep(2)
+    return file_verdict(stats)
 
-    return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
+# Check whether VirusTotal already knows the attachment. Only unknown files are uploaded and analysed.
+# file_data is the attachment as bytes or a binary file object, or None if it is too large to upload.
+async def lookup_file_attachment(filename, file_data, sha256=None, deadline=None):
+    report = await lookup_file_report(sha256 or file_sha256(file_data))
 
-# Extract URLs from email text.
-def extract_urls(text):
-    pattern = r'https?://[^\s"\']+'
-    return set(re.findall(pattern, text))
+    if report is not None:
+        return report
 
-# Extract URLs, domains and attachments from an email.
-def parse_email(raw_email_bytes):
-    msg = email.message_from_bytes(raw_email_bytes, policy=policy.default)
+    if file_data is None:
+        return {"verdict": "Not found on VirusTotal (file not uploaded). Treat as suspicious and verify manually"}
 
-    text_parts = []
-    html_parts = []
+    if not isinstance(file_data, bytes):
+        file_data.seek(0)
 
-    if msg.is_multipart():
-        for part in msg.walk():
-            ctype = part.get_content_type()
+    files = {"file": (filename, file_data)}
 
-            if ctype == "text/plain":
-                text_parts.append(part.get_content())
-            elif ctype == "text/html":
-                html_parts.append(part.get_content())
-    else:
-        if msg.get_content_type() == "text/plain":
-            text_parts.append(msg.get_content())
-        elif msg.get_content_type() == "text/html":
-            html_parts.append(msg.get_content())
+    resp = await vt_request(
+        "POST",
+        f"{VT_BASE_URL}/files",
+        headers=headers,
+        files=files,
+        timeout=VT_REQUEST_TIMEOUT
+    )
 
-    email_text = "\n".join(text_parts)
-    urls = set(extract_urls(email_text))
+    if resp.status_code != 200:
+        return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
+
+    analysis_id = resp.json()["data"]["id"]
 
-    # Extract links from HTML content.
-    for html in html_parts:
-        soup = BeautifulSoup(html, "html.parser")
+    return await wait_for_analysis(analysis_id, file_verdict, deadline)
+
+# Returned when VirusTotal quota ran out. It is not cached and does not create an incident.
+DEFERRED_VERDICT = "Deferred: VirusTotal quota reached. Please try the scan again later"
+
+# Returned straight away while VirusTotal is failing. The indicator is re-scanned once VirusTotal recovers.
+DEGRADED_VERDICT = (
+    "Degraded: VirusTotal is currently unavailable. The indicator has been queued for re-scan; "
+    "treat it with caution until then"
+)
+
+# Indicators waiting to be re-scanned, oldest first: (kind, key) -> function starting the scan again.
+VT_RESCAN_QUEUE_MAX = int(os.getenv("VT_RESCAN_QUEUE_MAX", "1000"))
+rescan_queue = OrderedDict()
+
+def queue_rescan(kind, key, rescan):
+    rescan_queue[(kind, key)] = rescan
+    rescan_queue.move_to_end((kind, key))
+
+    while len(rescan_queue) > VT_RESCAN_QUEUE_MAX:
+        rescan_queue.popitem(last=False)
+
+# Look up an indicator through the verdict cache. On a miss, every request lookup() makes is queued at the scan's
+# priority, and (including waiting for quota) stops at the deadline.
+# Network errors and malformed replies give an "Unable to verify" verdict so one failed indicator does not stop
+# the others.
+async def scan(kind, key, lookup, priority, rescan, deadline):
+    async def run():
+        request_priority.set(priority)
+        request_deadline.set(deadline)
+
+        try:
+            return await lookup()
+        except CircuitOpen:
+            queue_rescan(kind, key, rescan)
+            return {"verdict": DEGRADED_VERDICT}
+        except QuotaDeferred as e:
+            print(f"VirusTotal scan deferred: {e}")
+            return {"verdict": DEFERRED_VERDICT}
+        except httpx.HTTPError as e:
+            print(f"VirusTotal request failed: {e}")
+            return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
+        except (KeyError, ValueError, TypeError, AttributeError) as e:
+            print(f"Unexpected VirusTotal response: {e!r}")
+            return {"verdict": "Unable to verify with VirusTotal. Treat as suspicious and verify manually"}
 
-        for a in soup.find_all("a", href=True):
-            urls.add(a["href"])
+    return await verdict_cache.fetch_async(kind, key, run)
 
-    domains = {urlparse(u).netloc for u in urls}
-    attachments = []
+# Scans reuse cached verdicts, so the same indicator is only sent to VirusTotal once per cache period.
+# deadline is the time.monotonic() value the caller can wait until, covering quota waits, requests and polling;
+# without one the scan gets VT_SCAN_DEADLINE_SECONDS from when it starts.
+async def scan_domain(domain, priority=PRIORITY_DOMAIN, deadline=None):
+    deadline = deadline or scan_deadline()
+    return await scan(
+        "domain", canonical_domain(domain), lambda: lookup_domain(domain), priority,
+        rescan=lambda: scan_domain(domain, priority), deadline=deadline
+    )
 
-    # Extract email attachments.
-    for part in msg.iter_attachments():
-        fn = part.get_filename()
-        
-        if fn:
-            attachments.append((fn, part.get_payload(decode=True)))
+async def scan_ip(ip, priority=PRIORITY_DOMAIN, deadline=None):
+    deadline = deadline or scan_deadline()
+    return await scan(
+        "ip", ip, lambda: lookup_ip(ip), priority,
+        rescan=lambda: scan_ip(ip, priority), deadline=deadline
+    )
+
+async def scan_url(url, priority=PRIORITY_URL, deadline=None):
+    deadline = deadline or scan_deadline()
+    return await scan(
+        "url", canonical_url(url), lambda: lookup_url(url, deadline), priority,
+        rescan=lambda: scan_url(url, priority), deadline=deadline
+    )
+
+# Attachments are keyed by the SHA-256 of their contents, so renamed copies share a verdict. Pass sha256 if it is
+# already known. The file may be closed by the time VirusTotal recovers, so a re-scan only looks up the hash.
+async def scan_file_attachment(filename, file_data, priority=PRIORITY_ATTACHMENT, deadline=None, sha256=None):
+    deadline = deadline or scan_deadline()
+    sha256 = sha256 or file_sha256(file_data)
+    return await scan(
+        "file", sha256, lambda: lookup_file_attachment(filename, file_data, sha256, deadline), priority,
+        rescan=lambda: scan_file_attachment(filename, None, priority, sha256=sha256), deadline=deadline
+    )
 
-    return list(urls), list(domains), attachments
\ No newline at end of file
+# How re-scanned indicators are named in incidents; attachments are only known by their hash by then.
+RESCAN_LABELS = {"url": "URL", "domain": "Domain", "ip": "IP address", "file": "Attachment SHA-256"}
+
+# Re-scan queued indicators once VirusTotal is reachable again, so their verdicts are cached for the next
+# request. Malicious and suspicious results of each pass are given to on_flagged as (label, name, verdict)
+# tuples, so they create an incident like a live scan would.
+async def run_rescan_worker(interval_seconds: float = 10, on_flagged=None):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        flagged = []
+
+        try:
+            while rescan_queue and vt_breaker.available:
+                (kind, key), rescan = rescan_queue.popitem(last=False)
+                verdict = (await rescan())["verdict"]
+
+                if verdict_type(verdict) in ("malicious", "suspicious"):
+                    logger.warning("Re-scan after VirusTotal outage: %s %s → %s", kind, key, verdict)
+                    flagged.append((RESCAN_LABELS[kind], key, verdict))
+        except Exception:
+            logger.exception("VirusTotal re-scan failed")
+
+        if flagged and on_flagged is not None:
+            try:
+                await on_flagged(flagged)
+            except Exception:
+                logger.exception("Could not report %d indicators flagged by the VirusTotal re-scan", len(flagged))
+
+# Extract indicators and attachments from an email held in memory, such as a pasted chat message.
+# Returns the IndicatorExtractor result and a list of mime_stream.Attachment objects.
+def parse_email(raw_email_bytes, extractor=None):
+    return parse_email_file(io.BytesIO(raw_email_bytes), extractor)
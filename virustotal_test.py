@@ -0,0 +1,247 @@
+# This file tests VirusTotal polling and scan deadlines against the local stand-in in vt_standin.py.
+# Run it with pytest, or directly with python. It does not contact VirusTotal.
+
+import os
+import time
+import uuid
+import asyncio
+import httpx
+from email.utils import formatdate
+
+from vt_standin import start_standin
+
+standin = start_standin()
+os.environ["VT_BASE_URL"] = standin.base_url
+os.environ["VT_CACHE_PATH"] = ""
+os.environ.setdefault("VT_REQUESTS_PER_MINUTE", "100000")
+os.environ.setdefault("VT_REQUESTS_PER_DAY", "1000000")
+
+import http_clients
+import virustotal
+from vt_scheduler import VTScheduler, QuotaDeferred
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+# Run a test coroutine in its own event loop, closing the VirusTotal client opened in that loop afterwards.
+def run(coro):
+    async def wrapped():
+        try:
+            return await coro
+        finally:
+            if http_clients.vt_client is not None:
+                await http_clients.vt_client.aclose()
+
+    return asyncio.run(wrapped())
+
+def unique_url(analysis_seconds: float, word: str = "clean") -> str:
+    return f"http://{word}.example.test/{uuid.uuid4().hex}?analysis={analysis_seconds}"
+
+# Time a scan; returns (verdict, seconds taken, analysis checks made).
+def timed(scan):
+    before = standin.requests["GET analyses"]
+    started = time.monotonic()
+    result = run(scan)
+
+    return result["verdict"], time.monotonic() - started, standin.requests["GET analyses"] - before
+
+def test_quick_analysis_is_checked_early():
+    verdict, elapsed, polls = timed(virustotal.scan_url(unique_url(0.3), deadline=time.monotonic() + 10))
+
+    assert verdict == "Looks Safe"
+    assert elapsed < 2.5, elapsed
+    assert polls <= 3, polls
+
+def test_malicious_url_verdict():
+    verdict, _, _ = timed(virustotal.scan_url(unique_url(0.2, "evil"), deadline=time.monotonic() + 10))
+
+    assert verdict == "Likely Malicious"
+
+def test_slow_analysis_stops_at_deadline():
+    verdict, elapsed, _ = timed(virustotal.scan_url(unique_url(20), deadline=time.monotonic() + 2))
+
+    assert verdict.startswith("Unable to verify")
+    assert 1.5 < elapsed < 3.5, elapsed
+
+def test_backoff_checks_less_often_over_time():
+    _, _, polls = timed(virustotal.scan_url(unique_url(20), deadline=time.monotonic() + 6))
+
+    # Fixed 1 s checks would make about 6; with backoff (about 1, 2, 4 s) there are at most 4.
+    assert polls <= 4, polls
+
+def test_acquire_stops_at_deadline():
+    async def scenario():
+        scheduler = VTScheduler(per_minute=1, per_day=100, max_wait_seconds=60)
+        await scheduler.acquire()
+
+        started = time.monotonic()
+
+        try:
+            await scheduler.acquire(deadline=time.monotonic() + 0.5)
+        except QuotaDeferred:
+            waited = time.monotonic() - started
+        else:
+            raise AssertionError("acquire() should not get a token within the deadline")
+
+        try:
+            await scheduler.acquire(deadline=time.monotonic() - 1)
+        except QuotaDeferred:
+            pass
+        else:
+            raise AssertionError("acquire() should refuse a deadline that has already passed")
+
+        return waited, scheduler.deferred
+
+    waited, deferred = asyncio.run(scenario())
+
+    assert 0.4 < waited < 1.0, waited
+    assert deferred == 2
+
+# Background jobs pass deadlines longer than max_wait_seconds and keep waiting for quota until then.
+def test_acquire_waits_until_a_long_deadline():
+    async def scenario():
+        scheduler = VTScheduler(per_minute=60, per_day=100, max_wait_seconds=0.2)
+        scheduler.tokens = 0
+
+        started = time.monotonic()
+        await scheduler.acquire(deadline=time.monotonic() + 5)
+
+        return time.monotonic() - started
+
+    waited = asyncio.run(scenario())
+
+    assert 0.5 < waited < 2, waited
+
+# An attachment scan started after a long queue of domain scans is still sent first.
+def test_attachment_is_scanned_ahead_of_queued_domains():
+    scheduler = virustotal.vt_scheduler
+    virustotal.vt_scheduler = VTScheduler(per_minute=600, per_day=10000, max_wait_seconds=60)
+    virustotal.vt_scheduler.tokens = 0
+    finished = []
+
+    async def record(name, scan):
+        await scan
+        finished.append(name)
+
+    async def scenario():
+        deadline = time.monotonic() + 20
+        domains = [
+            record("domain", virustotal.scan_domain(f"{uuid.uuid4().hex}.example.test", deadline=deadline))
+            for _ in range(40)
+        ]
+        attachment = record("attachment", virustotal.scan_file_attachment("a.bin", uuid.uuid4().bytes, deadline=deadline))
+
+        await asyncio.gather(*domains, attachment)
+
+    try:
+        run(scenario())
+    finally:
+        virustotal.vt_scheduler = scheduler
+
+    # 40 domains take about 4 s at 10 requests a second; the attachment finishes once its analysis does.
+    assert finished.index("attachment") < 30, finished.index("attachment")
+
+# A Retry-After header given as an HTTP date, or one that cannot be read, must not fail the scan.
+def test_retry_after_formats():
+    soon = formatdate(time.time() + 30, usegmt=True)
+
+    assert virustotal.retry_after_seconds("120") == 120
+    assert 25 < virustotal.retry_after_seconds(soon) <= 30
+    assert virustotal.retry_after_seconds("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert virustotal.retry_after_seconds("soon") == 60
+    assert virustotal.retry_after_seconds(None) == 60
+
+# A reply without the expected fields gives an "Unable to verify" verdict instead of failing every scan in the request.
+def test_malformed_reply_is_unverified():
+    async def missing_id():
+        return {}["data"]
+
+    async def bad_json():
+        return httpx.Response(200, content=b"<html>").json()
+
+    async def scenario():
+        deadline = time.monotonic() + 5
+        return await asyncio.gather(
+            virustotal.scan("url", uuid.uuid4().hex, missing_id, 1, rescan=None, deadline=deadline),
+            virustotal.scan("url", uuid.uuid4().hex, bad_json, 1, rescan=None, deadline=deadline),
+            virustotal.scan_url(unique_url(0.2), deadline=deadline)
+        )
+
+    missing, bad, good = run(scenario())
+
+    assert missing["verdict"].startswith("Unable to verify")
+    assert bad["verdict"].startswith("Unable to verify")
+    assert good["verdict"] == "Looks Safe"
+
+# Concurrent scans of the same URL share one lookup instead of each sending their own requests.
+def test_concurrent_scans_of_one_url_are_merged():
+    url = unique_url(0.5)
+    before = dict(standin.requests)
+
+    async def scenario():
+        deadline = time.monotonic() + 5
+        return await asyncio.gather(*(virustotal.scan_url(url, deadline=deadline) for _ in range(5)))
+
+    results = run(scenario())
+
+    assert [result["verdict"] for result in results] == ["Looks Safe"] * 5
+    assert standin.requests["POST urls"] - before.get("POST urls", 0) == 1
+    assert not virustotal.verdict_cache.in_flight
+
+# A request that waited for quota while the circuit opened is not sent, and its token goes back to the scheduler.
+def test_request_stopped_by_breaker_returns_its_token():
+    scheduler, breaker = virustotal.vt_scheduler, virustotal.vt_breaker
+    virustotal.vt_scheduler = VTScheduler(per_minute=60, per_day=100, max_wait_seconds=5)
+    virustotal.vt_scheduler.tokens = 0
+    virustotal.vt_breaker = CircuitBreaker(min_requests=1, cooldown_seconds=30)
+
+    async def scenario():
+        request = asyncio.create_task(virustotal.lookup_report(f"domains/{uuid.uuid4().hex}.example.test"))
+        await asyncio.sleep(0.1)
+        virustotal.vt_breaker.record_failure()
+
+        try:
+            await request
+        except CircuitOpen:
+            pass
+        else:
+            raise AssertionError("the request should be stopped by the open circuit")
+
+    try:
+        before = standin.requests["GET domains"]
+        run(scenario())
+
+        assert standin.requests["GET domains"] == before
+        assert virustotal.vt_scheduler.used_today == 0
+        assert virustotal.vt_scheduler.refunded == 1
+    finally:
+        virustotal.vt_scheduler, virustotal.vt_breaker = scheduler, breaker
+
+# Every kind of scan stops waiting for quota at its deadline instead of VT_MAX_QUEUE_WAIT_SECONDS.
+def test_scans_waiting_for_quota_stop_at_deadline():
+    scheduler = virustotal.vt_scheduler
+    virustotal.vt_scheduler = VTScheduler(per_minute=1, per_day=100, max_wait_seconds=60)
+
+    try:
+        verdict, _, _ = timed(virustotal.scan_domain(f"{uuid.uuid4().hex}.example.test"))
+        assert verdict == "Looks Safe"
+
+        scans = [
+            virustotal.scan_domain(f"{uuid.uuid4().hex}.example.test", deadline=time.monotonic() + 1),
+            virustotal.scan_ip("8.8.4.4", deadline=time.monotonic() + 1),
+            virustotal.scan_url(unique_url(0.2), deadline=time.monotonic() + 1),
+            virustotal.scan_file_attachment("a.bin", uuid.uuid4().bytes, deadline=time.monotonic() + 1),
+        ]
+
+        for scan in scans:
+            verdict, elapsed, _ = timed(scan)
+
+            assert verdict.startswith("Deferred"), verdict
+            assert elapsed < 2, elapsed
+    finally:
+        virustotal.vt_scheduler = scheduler
+
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+            print(f"{name} passed")
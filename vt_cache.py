@@ -0,0 +1,259 @@
+# This file caches VirusTotal verdicts so the same URL, domain or attachment is not looked up again.
+# Verdicts are kept in memory and, optionally, in a SQLite database that survives restarts.
+import os
+import json
+import time
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from response_cache import ResponseCache
+
+# How long each kind of verdict is reused. "Not found" and "Unable to verify" are only kept briefly,
+# so a new or temporarily unreachable indicator is checked again soon.
+VERDICT_TTLS = {
+    "malicious": float(os.getenv("VT_CACHE_TTL_MALICIOUS_SECONDS", str(7 * 24 * 3600))),
+    "suspicious": float(os.getenv("VT_CACHE_TTL_SUSPICIOUS_SECONDS", str(6 * 3600))),
+    "safe": float(os.getenv("VT_CACHE_TTL_SAFE_SECONDS", str(24 * 3600))),
+    "not_found": float(os.getenv("VT_CACHE_TTL_NOT_FOUND_SECONDS", "900")),
+    "unverified": float(os.getenv("VT_CACHE_TTL_UNVERIFIED_SECONDS", "120"))
+}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+# Group a verdict the same way main.py does when deciding on incidents.
+def verdict_type(verdict: str) -> str:
+    if verdict.startswith("Likely"):
+        return "malicious"
+    if verdict == "Suspicious":
+        return "suspicious"
+    if verdict.startswith("Not found"):
+        return "not_found"
+    if verdict.startswith("Unable to verify"):
+        return "unverified"
+    if verdict.startswith("Deferred") or verdict.startswith("Degraded"):
+        return "deferred"
+
+    return "safe"
+
+# Query parameters added by mail and ad trackers. They do not change the page, so they are left out of cache keys.
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid", "_hsenc", "_hsmi"}
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name.startswith("utm_") or name in TRACKING_PARAMS
+
+# Lowercase the scheme and host, drop default ports, the fragment and tracking parameters.
+# The path and the remaining query are kept as written.
+def canonical_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+
+    netloc = host if port in (None, DEFAULT_PORTS.get(scheme)) else f"{host}:{port}"
+
+    if parts.username:
+        netloc = f"{parts.username}@{netloc}"
+
+    query = parts.query
+    pairs = parse_qsl(query, keep_blank_values=True)
+
+    if any(is_tracking_param(name) for name, _ in pairs):
+        query = urlencode([(name, value) for name, value in pairs if not is_tracking_param(name)])
+
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+def canonical_domain(domain: str) -> str:
+    return domain.strip().lower().rstrip(".")
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# SHA-256 of attachment bytes or of a binary file object. File objects are read in chunks so
+# large attachments are never held in memory just to be hashed.
+def file_sha256(data) -> str:
+    digest = hashlib.sha256()
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        view = memoryview(data)
+
+        for start in range(0, len(view), HASH_CHUNK_SIZE):
+            digest.update(view[start:start + HASH_CHUNK_SIZE])
+    else:
+        for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+# Keeps verdicts in SQLite (WAL mode) so they survive restarts and are shared by workers on the same machine.
+class SQLiteVerdictStore:
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10, isolation_level=None)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS vt_verdicts (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+
+    # Return (value, seconds left) or None if missing or expired.
+    def get(self, key: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM vt_verdicts WHERE key = ?",
+                (key,)
+            ).fetchone()
+
+        if not row:
+            return None
+
+        remaining = row[1] - time.time()
+
+        if remaining <= 0:
+            return None
+
+        return json.loads(row[0]), remaining
+
+    def set(self, key: str, value: dict, ttl_seconds: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO vt_verdicts (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time() + ttl_seconds)
+            )
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM vt_verdicts WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# Two-tier verdict cache: an in-memory LRU in front of an optional SQLite store.
+class VerdictCache:
+    def __init__(self, max_entries: int = 10000, ttls: dict = VERDICT_TTLS, path: str | None = None):
+        self.ttls = ttls
+        self.memory = ResponseCache(max_entries=max_entries, ttl_seconds=max(ttls.values()))
+        self.persistent = SQLiteVerdictStore(path) if path else None
+
+        self.persistent_hits = 0
+        self.lookups_saved = 0
+        self.lookups_merged = 0
+
+        # Scans running now, by cache key, so concurrent lookups of the same indicator share one scan.
+        self.in_flight = {}
+
+    def get(self, kind: str, key: str):
+        cache_key = f"{kind}:{key}"
+        value = self.memory.get(cache_key)
+
+        if value is None and self.persistent:
+            entry = self.persistent.get(cache_key)
+
+            if entry:
+                value, remaining = entry
+                self.memory.set(cache_key, value, ttl_seconds=remaining)
+                self.persistent_hits += 1
+
+        # Return a copy so callers cannot change the cached verdict.
+        return dict(value) if value is not None else None
+
+    def set(self, kind: str, key: str, result: dict):
+        cache_key = f"{kind}:{key}"
+        kind_of_verdict = verdict_type(result.get("verdict", ""))
+
+        # Deferred and degraded scans were never answered by VirusTotal, so there is nothing to reuse.
+        if kind_of_verdict == "deferred":
+            return
+
+        ttl = self.ttls[kind_of_verdict]
+
+        self.memory.set(cache_key, dict(result), ttl_seconds=ttl)
+
+        if self.persistent:
+            self.persistent.set(cache_key, result, ttl)
+
+    # Return the cached verdict, or run the scan and cache what it returns.
+    def fetch(self, kind: str, key: str, scan):
+        result = self.get(kind, key)
+
+        if result is not None:
+            self.lookups_saved += 1
+            return result
+
+        result = scan()
+        self.set(kind, key, result)
+        return result
+
+    # Async version of fetch; scan returns a coroutine and is only called on a cache miss.
+    # A lookup made while the same indicator is being scanned waits for that scan instead of starting another.
+    async def fetch_async(self, kind: str, key: str, scan):
+        result = self.get(kind, key)
+
+        if result is not None:
+            self.lookups_saved += 1
+            return result
+
+        cache_key = f"{kind}:{key}"
+        running = self.in_flight.get(cache_key)
+
+        # A scan started in another event loop (an earlier test run, for example) cannot be awaited here.
+        if running is not None and running.get_loop() is asyncio.get_running_loop():
+            self.lookups_merged += 1
+            result = await asyncio.shield(running)
+
+            # The shared scan stopped at its first caller's deadline. A later deadline is given its own scan.
+            if verdict_type(result.get("verdict", "")) != "deferred":
+                return dict(result)
+
+        running = asyncio.ensure_future(self._scan(kind, key, scan))
+        self.in_flight[cache_key] = running
+        running.add_done_callback(lambda done: self._scan_done(cache_key, done))
+
+        # The scan carries on for the other callers if this one is cancelled; its verdict is still cached.
+        return dict(await asyncio.shield(running))
+
+    async def _scan(self, kind: str, key: str, scan):
+        result = await scan()
+        self.set(kind, key, result)
+        return result
+
+    def _scan_done(self, cache_key: str, done):
+        if self.in_flight.get(cache_key) is done:
+            del self.in_flight[cache_key]
+
+    def close(self):
+        if self.persistent:
+            self.persistent.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.memory.stats(),
+            "persistent": self.persistent is not None,
+            "persistent_hits": self.persistent_hits,
+            "lookups_saved": self.lookups_saved,
+            "lookups_merged": self.lookups_merged,
+            "ttls": self.ttls
+        }
+
+verdict_cache = VerdictCache(
+    max_entries=int(os.getenv("VT_CACHE_MAX_ENTRIES", "10000")),
+    path=os.getenv("VT_CACHE_PATH") or None
+)
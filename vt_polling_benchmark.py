@@ -0,0 +1,81 @@
+# This file compares the old fixed polling (every 2 s, at most 10 checks) with adaptive polling
+# (quick first check, then exponential backoff with jitter until the deadline).
+# It runs against the local VirusTotal stand-in in vt_standin.py and does not contact VirusTotal.
+
+import os
+import time
+import random
+import asyncio
+import itertools
+import statistics
+
+from vt_standin import start_standin
+
+standin = start_standin()
+os.environ["VT_BASE_URL"] = standin.base_url
+os.environ.setdefault("VT_REQUESTS_PER_MINUTE", "100000")
+os.environ.setdefault("VT_REQUESTS_PER_DAY", "1000000")
+
+import virustotal
+
+SCANS = 60
+
+# Most new analyses finish within a few seconds; a few large ones take over 20 s.
+def analysis_times(seed: int = 7) -> list:
+    rng = random.Random(seed)
+    times = []
+
+    for _ in range(SCANS):
+        roll = rng.random()
+
+        if roll < 0.6:
+            times.append(rng.uniform(0.2, 1.0))
+        elif roll < 0.9:
+            times.append(rng.uniform(1.0, 5.0))
+        else:
+            times.append(rng.uniform(21.0, 27.0))
+
+    return times
+
+# Submit a URL that the stand-in takes `seconds` to analyse, then wait for the verdict.
+async def scan(index: int, seconds: float, policy: str) -> tuple:
+    url = f"http://example.test/{policy}/{index}?analysis={seconds:.2f}"
+    started = time.monotonic()
+
+    resp = await virustotal.vt_request(
+        "POST", f"{virustotal.VT_BASE_URL}/urls", headers=virustotal.headers, data={"url": url}, timeout=15
+    )
+    analysis_id = resp.json()["data"]["id"]
+
+    if policy == "fixed":
+        # The previous loop: sleep 2 s between checks, at most 10 checks.
+        result = await virustotal.wait_for_analysis(
+            analysis_id, virustotal.url_verdict, started + 10 * 2.05, delays=itertools.repeat(2)
+        )
+    else:
+        result = await virustotal.wait_for_analysis(analysis_id, virustotal.url_verdict, virustotal.scan_deadline())
+
+    return time.monotonic() - started, not result["verdict"].startswith("Unable")
+
+async def run(policy: str, times: list):
+    before = standin.requests["GET analyses"]
+    results = await asyncio.gather(*(scan(i, t, policy) for i, t in enumerate(times)))
+    polls = standin.requests["GET analyses"] - before
+
+    finished = [elapsed for elapsed, ok in results if ok]
+    waste = [elapsed - t for (elapsed, ok), t in zip(results, times) if ok]
+
+    print(f"{policy:<9} polls {polls:4d} ({polls / len(times):.1f} per scan)   "
+          f"verdicts {len(finished)}/{len(times)}   "
+          f"time to verdict p50 {statistics.median(finished):5.2f} s   "
+          f"mean wait after analysis finished {statistics.mean(waste):4.2f} s")
+
+async def main():
+    times = analysis_times()
+    print(f"{SCANS} new URL analyses, deadline {virustotal.VT_SCAN_DEADLINE_SECONDS:.0f} s")
+
+    await run("fixed", times)
+    await run("adaptive", times)
+
+if __name__ == "__main__":
+    asyncio.run(main())
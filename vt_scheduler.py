@@ -0,0 +1,157 @@
+# This file schedules VirusTotal API requests so the key's quota is not exceeded.
+# Requests wait in a priority queue for a token instead of failing when the quota is reached.
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from datetime import datetime, timezone
+
+# Lower numbers are sent first: attachments from uploaded emails ahead of URLs, and URLs ahead of domains.
+PRIORITY_ATTACHMENT = 0
+PRIORITY_URL = 1
+PRIORITY_DOMAIN = 2
+
+# Raised when a request cannot be sent in time (or the daily budget is used up), so the scan is deferred.
+class QuotaDeferred(Exception):
+    pass
+
+# Token bucket refilled at the per-minute rate, plus a daily budget that resets at midnight UTC like VirusTotal's.
+class VTScheduler:
+    def __init__(self, per_minute: int = 4, per_day: int = 500, max_wait_seconds: float = 60):
+        self.per_minute = per_minute
+        self.per_day = per_day
+        self.max_wait_seconds = max_wait_seconds
+
+        self.tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._day = datetime.now(timezone.utc).date()
+        self.used_today = 0
+        self._paused_until = 0.0
+
+        self._queue = []
+        self._order = itertools.count()
+        self._timer = None
+
+        self.granted = 0
+        self.deferred = 0
+        self.refunded = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.per_minute, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+        today = datetime.now(timezone.utc).date()
+
+        if today != self._day:
+            self._day = today
+            self.used_today = 0
+
+    # Hand tokens to waiting requests in priority order, and set a timer for when the next token is due.
+    def _dispatch(self):
+        self._refill()
+        now = time.monotonic()
+
+        while self._queue and self.tokens >= 1 and now >= self._paused_until:
+            _, _, waiter = heapq.heappop(self._queue)
+
+            # The request already gave up waiting.
+            if waiter.done():
+                continue
+
+            if self.used_today >= self.per_day:
+                waiter.set_exception(QuotaDeferred("VirusTotal daily quota reached"))
+                continue
+
+            self.tokens -= 1
+            self.used_today += 1
+            waiter.set_result(None)
+
+        while self._queue and self._queue[0][2].done():
+            heapq.heappop(self._queue)
+
+        if self._queue and self._timer is None:
+            delay = max((1 - self.tokens) * 60 / self.per_minute, self._paused_until - now, 0.01)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        self._dispatch()
+
+    # Wait for permission to send one request until deadline (a time.monotonic() value), or for at most
+    # max_wait_seconds when there is no deadline. Background jobs pass deadlines well beyond max_wait_seconds.
+    async def acquire(self, priority: int = PRIORITY_URL, deadline: float | None = None):
+        self._refill()
+
+        if self.used_today >= self.per_day:
+            self.deferred += 1
+            raise QuotaDeferred("VirusTotal daily quota reached")
+
+        # Past the deadline a request is only sent if a token is free right now.
+        max_wait = self.max_wait_seconds
+
+        if deadline is not None:
+            max_wait = max(0, deadline - time.monotonic())
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._order), waiter))
+        started = time.monotonic()
+
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter, max_wait)
+        except asyncio.TimeoutError:
+            self.deferred += 1
+            raise QuotaDeferred("VirusTotal request waited too long for quota")
+        except QuotaDeferred:
+            self.deferred += 1
+            raise
+
+        waited = time.monotonic() - started
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    # Give back a token that was granted but not used, for example because the circuit breaker stopped the request.
+    # It goes to the next waiting request.
+    def refund(self):
+        self._refill()
+        self.tokens = min(self.per_minute, self.tokens + 1)
+        self.used_today = max(0, self.used_today - 1)
+        self.refunded += 1
+
+        self._dispatch()
+
+    # VirusTotal answered 429: send nothing more until the pause is over.
+    def pause(self, seconds: float = 60):
+        self.tokens = 0
+        self._paused_until = time.monotonic() + seconds
+
+    def queue_depth(self) -> int:
+        return sum(1 for _, _, waiter in self._queue if not waiter.done())
+
+    def stats(self) -> dict:
+        self._refill()
+
+        return {
+            "requests_per_minute": self.per_minute,
+            "requests_per_day": self.per_day,
+            "tokens_available": round(self.tokens, 2),
+            "used_today": self.used_today,
+            "queue_depth": self.queue_depth(),
+            "granted": self.granted,
+            "deferred": self.deferred,
+            "refunded": self.refunded,
+            "average_wait_seconds": round(self.total_wait / self.granted, 3) if self.granted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
+
+vt_scheduler = VTScheduler(
+    per_minute=int(os.getenv("VT_REQUESTS_PER_MINUTE", "4")),
+    per_day=int(os.getenv("VT_REQUESTS_PER_DAY", "500")),
+    max_wait_seconds=float(os.getenv("VT_MAX_QUEUE_WAIT_SECONDS", "60"))
+)
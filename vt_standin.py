@@ -0,0 +1,130 @@
+# This file runs a small local server that answers like the VirusTotal v3 API, for trying out the scanner
+# without an API key or quota. Start it with start_standin() and point VT_BASE_URL at the returned address.
+#
+# Behaviour is chosen by the indicator itself:
+# - domains, IP addresses and URLs containing "evil" are malicious, "unknown" are not found
+# - a submitted URL with "analysis=<seconds>" in it takes that long to analyse (default 1 s)
+# - uploaded files take ANALYSIS_SECONDS to analyse; file hashes are never known in advance
+# - setting server.failing = True makes every request fail with 503, to simulate an outage
+import json
+import time
+import uuid
+import base64
+import threading
+from collections import Counter
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANALYSIS_SECONDS = 1.0
+
+def stats_for(indicator: str) -> dict:
+    if "evil" in indicator:
+        return {"malicious": 5, "suspicious": 0, "harmless": 60, "undetected": 10}
+
+    return {"malicious": 0, "suspicious": 0, "harmless": 65, "undetected": 10}
+
+def analysis_seconds(url: str) -> float:
+    for part in url.replace("?", "&").split("&"):
+        if part.startswith("analysis="):
+            return float(part.split("=", 1)[1])
+
+    return ANALYSIS_SECONDS
+
+class VirusTotalStandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, payload: dict | None = None):
+        body = json.dumps(payload or {}).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        server = self.server
+
+        if server.failing:
+            return self.reply(503)
+
+        parts = self.path.split("?")[0].strip("/").split("/")
+        kind, key = parts[-2], parts[-1]
+        server.requests[f"GET {kind}"] += 1
+
+        if kind in ("domains", "ip_addresses"):
+            if "unknown" in key:
+                return self.reply(404)
+
+            return self.reply(200, {"data": {"attributes": {"last_analysis_stats": stats_for(key)}}})
+
+        if kind == "urls":
+            url = base64.urlsafe_b64decode(key + "=" * (-len(key) % 4)).decode("utf-8", "replace")
+
+            if url not in server.known_urls:
+                return self.reply(404)
+
+            return self.reply(200, {"data": {"attributes": {
+                "last_analysis_stats": stats_for(url),
+                "last_analysis_date": int(server.known_urls[url])
+            }}})
+
+        if kind == "files":
+            return self.reply(404)
+
+        if kind == "analyses":
+            analysis = server.analyses.get(key)
+
+            if analysis is None:
+                return self.reply(404)
+
+            indicator, ready_at = analysis
+
+            if time.monotonic() < ready_at:
+                return self.reply(200, {"data": {"attributes": {"status": "queued"}}})
+
+            return self.reply(200, {"data": {"attributes": {"status": "completed", "stats": stats_for(indicator)}}})
+
+        self.reply(404)
+
+    def do_POST(self):
+        server = self.server
+        kind = self.path.split("?")[0].strip("/").split("/")[-1]
+        body = self.read_body()
+        server.requests[f"POST {kind}"] += 1
+
+        if server.failing:
+            return self.reply(503)
+
+        if kind == "urls":
+            url = parse_qs(body.decode("utf-8")).get("url", [""])[0]
+            indicator, seconds = url, analysis_seconds(url)
+            server.known_urls[url] = time.time()
+        elif kind == "files":
+            indicator, seconds = body.decode("latin-1"), ANALYSIS_SECONDS
+        else:
+            return self.reply(404)
+
+        analysis_id = uuid.uuid4().hex
+        server.analyses[analysis_id] = (indicator, time.monotonic() + seconds)
+        self.reply(200, {"data": {"id": analysis_id, "type": "analysis"}})
+
+# Start the stand-in on a free local port and return the server; its base URL is server.base_url.
+def start_standin() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), VirusTotalStandIn)
+    server.daemon_threads = True
+    server.analyses = {}
+    server.known_urls = {}
+    server.requests = Counter()
+    server.failing = False
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v3"
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server